@@ -0,0 +1,685 @@
+"""
+所有服务接口的压测
+
+每个服务用 gunicorn 单独启动，数据目录为临时目录。默认使用 stubs 目录中的模拟渲染器（mmdc、markmap-cli、
+marp 命令行，按 --stub-latency 等待后生成输出），测量的是服务本身的排队、存储、缓存和进程管理开销；
+--renderers real 使用已安装的渲染器（各服务 node_modules 中的常驻进程），没有安装的服务会跳过。
+
+每个场景以固定并发发送请求，请求内容互不相同（缓存命中场景除外），包括仓库自带的 sample-quiz.md、
+helloworld.md 以及按节点数、页数、题目数生成的导图、图表、PPT 和试卷。报告每个场景的 p50/p95/p99 延迟、
+吞吐和服务进程树（gunicorn 及渲染子进程）的峰值内存，结果保存为 JSON，用 --compare 与另一次提交的结果对比。
+
+    python benchmarks/run.py
+    python benchmarks/run.py --services mermaid,quiz --requests 200 --concurrency 32
+    python benchmarks/run.py --renderers real --output before.json
+    python benchmarks/run.py --compare before.json
+    python benchmarks/run.py --results after.json --compare before.json
+"""
+import argparse
+import datetime
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# 服务名: (目录, 压测使用的端口)
+SERVICES = {
+    "mermaid": ("mermaid-flask-service", 5102),
+    "markmap": ("markmap-flask-service", 5103),
+    "marp": ("marp-flask-service", 5104),
+    "quiz": ("quiz-flask-service", 5106),
+}
+
+SIZE_NAMES = ("small", "medium", "large")
+# 各尺寸对应的图表节点数、导图节点数、PPT 页数和试卷题目数
+MERMAID_NODES = {"small": 10, "medium": 100, "large": 400}
+MINDMAP_NODES = {"small": 20, "medium": 200, "large": 2000}
+DECK_SLIDES = {"small": 5, "medium": 30, "large": 120}
+QUIZ_QUESTIONS = {"small": 10, "medium": 100, "large": 1000}
+
+HASH_RE = re.compile(r"[0-9a-f]{64}")
+TEXT = "text/plain; charset=utf-8"
+
+
+# ---------- 请求内容 ----------
+
+def read_sample(*parts):
+    with open(os.path.join(ROOT_DIR, *parts), encoding="utf-8") as f:
+        return f.read()
+
+
+def mermaid_diagram(nodes, tag):
+    """nodes 个节点的二叉树流程图"""
+    lines = ["graph TD", f"    %% {tag}"]
+    for i in range(1, nodes):
+        parent = (i - 1) // 2
+        lines.append(f"    N{parent}[步骤 {parent}] -->|分支 {i % 2}| N{i}[步骤 {i}]")
+    return "\n".join(lines)
+
+
+def mermaid_markdown(nodes, tag):
+    return f"```mermaid\n{mermaid_diagram(nodes, tag)}\n```\n"
+
+
+def mindmap(nodes, tag, extras=False):
+    """
+    大约 nodes 个节点的大纲，每个分支 10 个要点、每个要点 2 个细节
+
+    extras 为 True 时加入代码块和表格，markmap 服务会交给 Node 渲染而不是进程内模板。
+    """
+    lines = [f"# 思维导图 {tag}", ""]
+    branch = 0
+    count = 1
+    while count < nodes:
+        branch += 1
+        lines += [f"## 分支 {branch}", ""]
+        count += 1
+        for point in range(1, 11):
+            if count >= nodes:
+                break
+            lines += [f"- 要点 {branch}.{point} **重点**", f"  - 细节 {branch}.{point}.1", f"  - 细节 {branch}.{point}.2 `代码`"]
+            count += 3
+        lines.append("")
+    if extras:
+        lines += ["## 附录", "", "```python", "print('hello')", "```", "", "| 列 | 值 |", "|---|---|", "| a | 1 |", ""]
+    return "\n".join(lines)
+
+
+def slide_deck(slides, tag):
+    pages = [f"---\nmarp: true\n---\n\n# 演示文稿 {tag}\n\n副标题"]
+    for i in range(1, slides):
+        pages.append(f"# 第 {i} 页\n\n- 要点一 **加粗**\n- 要点二 `代码`\n- 要点三\n")
+    return "\n\n---\n\n".join(pages)
+
+
+QUESTIONS = [
+    "1. MaxSoft is a software company.\n    - (x) True\n    - ( ) False\n",
+    "2. What are the test automation frameworks developed by MaxSoft?\n"
+    "    - [x] IntelliAPI\n    - [x] WebBot\n    - [ ] Gauge\n    - [ ] Selenium\n",
+    "3. Who is the Co-Founder of MaxSoft?\n    - R:= Osanda\n",
+]
+
+
+def quiz(questions, tag):
+    body = "\n".join(QUESTIONS[i % len(QUESTIONS)] for i in range(questions))
+    return f"# 测验 {tag}\n\n---\n{body}"
+
+
+def tagged(content, tag):
+    """在样例文件末尾加上注释，内容不同才不会命中已生成的文件"""
+    return f"{content.rstrip()}\n\n<!-- {tag} -->\n"
+
+
+# ---------- HTTP 客户端 ----------
+
+class Client:
+    """每个请求使用一个新连接，与 Dify 调用工具时相同"""
+
+    def __init__(self, port, timeout):
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, content_type=TEXT):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        try:
+            headers = {"Content-Type": content_type} if body is not None else {}
+            conn.request(method, path, body=body.encode("utf-8") if isinstance(body, str) else body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+
+def call(method, path, body=None, content_type=TEXT):
+    """返回发送一个请求的函数，函数的返回值是状态码"""
+    return lambda client: client.request(method, path, body, content_type)[0]
+
+
+def job_call(body):
+    """提交异步任务并轮询到任务结束，耗时为从提交到拿到结果"""
+    def run(client):
+        status, data = client.request("POST", "/jobs", body)
+        if status != 202:
+            return status
+        job_id = json.loads(data)["job_id"]
+        while True:
+            status, data = client.request("GET", f"/jobs/{job_id}")
+            if status != 200:
+                return status
+            state = json.loads(data)["job"]["status"]
+            if state == "succeeded":
+                return 200
+            if state not in ("queued", "running"):
+                return 500
+            time.sleep(0.02)
+    return run
+
+
+def upload_hash(client, path, body):
+    """准备阶段的上传，返回响应中的内容哈希"""
+    status, data = client.request("POST", path, body)
+    if status != 200:
+        raise RuntimeError(f"准备数据失败: POST {path} 返回 {status}")
+    return HASH_RE.search(data.decode("utf-8")).group(0)
+
+
+# ---------- 场景 ----------
+# 每个场景是 (名称, build)，build(client, n, tag) 完成不计时的准备工作并返回 n 个请求函数
+
+def mermaid_scenarios(sizes):
+    scenarios = []
+    for size in sizes:
+        nodes = MERMAID_NODES[size]
+        scenarios.append((f"POST /upload {size} ({nodes} 节点)", lambda client, n, tag, nodes=nodes: [
+            call("POST", "/upload", mermaid_markdown(nodes, f"{tag}-{i}")) for i in range(n)]))
+
+    def cached(client, n, tag):
+        body = mermaid_markdown(MERMAID_NODES["small"], tag)
+        upload_hash(client, "/upload", body)
+        return [call("POST", "/upload", body)] * n
+
+    def jobs(client, n, tag):
+        return [job_call(mermaid_markdown(MERMAID_NODES["small"], f"{tag}-{i}")) for i in range(n)]
+
+    def batch(client, n, tag):
+        return [call("POST", "/render/batch", json.dumps({
+            "diagrams": [mermaid_diagram(MERMAID_NODES["small"], f"{tag}-{i}-{k}") for k in range(5)]
+        }), "application/json") for i in range(n)]
+
+    def svg(client, n, tag):
+        content_hash = upload_hash(client, "/upload", mermaid_markdown(MERMAID_NODES["medium"], tag))
+        return [call("GET", f"/svg/{content_hash}.svg")] * n
+
+    def png(client, n, tag):
+        # 每个请求的 png 都需要第一次生成
+        hashes = [upload_hash(client, "/upload", mermaid_markdown(MERMAID_NODES["small"], f"{tag}-{i}")) for i in range(n)]
+        return [call("GET", f"/png/{content_hash}.png") for content_hash in hashes]
+
+    return scenarios + [
+        ("POST /upload 缓存命中", cached),
+        ("POST /jobs + GET /jobs/<id>", jobs),
+        ("POST /render/batch (5 个图表)", batch),
+        ("GET /svg/<filename>", svg),
+        ("GET /png/<filename> (首次生成)", png),
+    ]
+
+
+def markmap_scenarios(sizes):
+    scenarios = []
+    for size in sizes:
+        nodes = MINDMAP_NODES[size]
+        scenarios.append((f"POST /upload {size} ({nodes} 节点)", lambda client, n, tag, nodes=nodes: [
+            call("POST", "/upload", mindmap(nodes, f"{tag}-{i}")) for i in range(n)]))
+
+    def node_render(client, n, tag):
+        return [call("POST", "/upload", mindmap(MINDMAP_NODES["small"], f"{tag}-{i}", extras=True)) for i in range(n)]
+
+    def cached(client, n, tag):
+        body = mindmap(MINDMAP_NODES["medium"], tag)
+        upload_hash(client, "/upload", body)
+        return [call("POST", "/upload", body)] * n
+
+    def jobs(client, n, tag):
+        return [job_call(mindmap(MINDMAP_NODES["small"], f"{tag}-{i}")) for i in range(n)]
+
+    def html(client, n, tag):
+        content_hash = upload_hash(client, "/upload", mindmap(MINDMAP_NODES["medium"], tag))
+        return [call("GET", f"/html/{content_hash}.html")] * n
+
+    def download(client, n, tag):
+        content_hash = upload_hash(client, "/upload", mindmap(MINDMAP_NODES["medium"], tag))
+        return [call("GET", f"/download/{content_hash}.html")] * n
+
+    def files(client, n, tag):
+        content_hash = upload_hash(client, "/upload", mindmap(MINDMAP_NODES["medium"], tag))
+        return [call("GET", f"/files/{content_hash}")] * n
+
+    def revisions(client, n, tag):
+        # 每个修订版本在上一版末尾追加一个要点
+        body = mindmap(MINDMAP_NODES["medium"], tag)
+        content_hash = upload_hash(client, "/upload", body)
+        return [call("POST", f"/upload?parent={content_hash}", f"{body}- 修订 {i}\n") for i in range(n)]
+
+    return scenarios + [
+        ("POST /upload 含代码块 (Node 渲染)", node_render),
+        ("POST /upload 缓存命中", cached),
+        ("POST /jobs + GET /jobs/<id>", jobs),
+        ("POST /upload?parent=<base_name> 修订版本", revisions),
+        ("GET /html/<filename>", html),
+        ("GET /download/<filename>", download),
+        ("GET /files/<base_name>", files),
+        ("GET /cache/stats", lambda client, n, tag: [call("GET", "/cache/stats")] * n),
+        ("GET /cleanup/stats", lambda client, n, tag: [call("GET", "/cleanup/stats")] * n),
+    ]
+
+
+def marp_scenarios(sizes):
+    helloworld = read_sample("marp-flask-service", "data", "helloworld.md")
+    scenarios = [("POST /upload helloworld.md", lambda client, n, tag: [
+        call("POST", "/upload", tagged(helloworld, f"{tag}-{i}")) for i in range(n)])]
+    for size in sizes:
+        slides = DECK_SLIDES[size]
+        scenarios.append((f"POST /upload {size} ({slides} 页)", lambda client, n, tag, slides=slides: [
+            call("POST", "/upload", slide_deck(slides, f"{tag}-{i}")) for i in range(n)]))
+
+    def export(ext):
+        def build(client, n, tag):
+            # 每个请求的文件都需要第一次转换
+            hashes = [upload_hash(client, "/upload", slide_deck(DECK_SLIDES["small"], f"{tag}-{i}")) for i in range(n)]
+            return [call("GET", f"/{content_hash}{ext}") for content_hash in hashes]
+        return build
+
+    def html(client, n, tag):
+        content_hash = upload_hash(client, "/upload", slide_deck(DECK_SLIDES["medium"], tag))
+        return [call("GET", f"/{content_hash}.html")] * n
+
+    return scenarios + [
+        ("GET /<hash>.html", html),
+        ("GET /<hash>.pdf (首次转换)", export(".pdf")),
+        ("GET /<hash>.pptx (首次转换)", export(".pptx")),
+    ]
+
+
+def quiz_scenarios(sizes):
+    sample = read_sample("quiz-flask-service", "markdown-quiz-files", "sample-quiz.md")
+    scenarios = [("POST /upload_markdown sample-quiz.md", lambda client, n, tag: [
+        call("POST", "/upload_markdown", tagged(sample, f"{tag}-{i}")) for i in range(n)])]
+    for size in sizes:
+        questions = QUIZ_QUESTIONS[size]
+        scenarios.append((f"POST /upload_markdown {size} ({questions} 题)", lambda client, n, tag, questions=questions: [
+            call("POST", "/upload_markdown", quiz(questions, f"{tag}-{i}")) for i in range(n)]))
+
+    def cached(client, n, tag):
+        body = tagged(sample, tag)
+        upload_hash(client, "/upload_markdown", body)
+        return [call("POST", "/upload_markdown", body)] * n
+
+    def get_html(client, n, tag):
+        content_hash = upload_hash(client, "/upload_markdown", quiz(QUIZ_QUESTIONS["medium"], tag))
+        return [call("GET", f"/get_html/{content_hash}")] * n
+
+    def variants(client, n, tag):
+        content_hash = upload_hash(client, "/upload_markdown", quiz(QUIZ_QUESTIONS["medium"], tag))
+        return [call("GET", f"/quiz/{content_hash}?seed={i}&count=10") for i in range(n)]
+
+    def submit(client, n, tag):
+        content_hash = upload_hash(client, "/upload_markdown", quiz(QUIZ_QUESTIONS["medium"], tag))
+        return [call("POST", f"/quiz/{content_hash}/submit", json.dumps({
+            "seed": i, "count": 10, "answers": [None] * 10, "taker": f"{tag}-{i}",
+        }), "application/json") for i in range(n)]
+
+    return scenarios + [
+        ("POST /upload_markdown 缓存命中", cached),
+        ("GET /get_html/<filename>", get_html),
+        ("GET /quiz/<id>?seed=N&count=10", variants),
+        ("POST /quiz/<id>/submit", submit),
+    ]
+
+
+SCENARIOS = {
+    "mermaid": mermaid_scenarios,
+    "markmap": markmap_scenarios,
+    "marp": marp_scenarios,
+    "quiz": quiz_scenarios,
+}
+
+
+# ---------- 服务进程 ----------
+
+def missing_renderer(name):
+    """--renderers real 时检查渲染器是否已安装，返回缺少的内容，已安装时返回 None"""
+    service_dir = os.path.join(ROOT_DIR, SERVICES[name][0])
+    required = {
+        "mermaid": os.path.join(service_dir, "renderer", "node_modules"),
+        "markmap": os.path.join(service_dir, "worker", "node_modules"),
+        "marp": os.path.join(service_dir, "worker", "node_modules", ".bin", "marp"),
+    }.get(name)
+    if required is None:
+        return None
+    if shutil.which("node") is None:
+        return "node"
+    if not os.path.exists(required):
+        return os.path.relpath(required, ROOT_DIR)
+    return None
+
+
+def service_env(args, data_dir, port):
+    env = dict(
+        os.environ,
+        DATA_DIR=data_dir,
+        PUBLIC_URL=f"http://127.0.0.1:{port}",
+        # 压测测量的是服务的处理能力，不限流，排队上限足够大
+        RATE_LIMIT_PER_MINUTE="0",
+        JOB_MAX_QUEUE=str(max(args.requests, args.concurrency, 32)),
+        MARP_MAX_PENDING=str(max(args.requests, args.concurrency, 8)),
+    )
+    if args.renderers == "stub":
+        env.update(
+            PATH=STUBS_DIR + os.pathsep + env.get("PATH", ""),
+            STUB_LATENCY=str(args.stub_latency),
+            STUB_LATENCY_PER_KB=str(args.stub_latency_per_kb),
+            # 模拟渲染器只有命令行形式，常驻进程池不启动
+            MERMAID_RENDERER="mmdc",
+            MARKMAP_POOL_SIZE="0",
+            MARP_POOL_SIZE="0",
+            MARP_CLI=os.path.join(STUBS_DIR, "marp"),
+        )
+    return env
+
+
+def start_service(name, args, data_dir, log):
+    directory, port = SERVICES[name]
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+               "--threads", str(args.threads), "--timeout", "120", "main:app"]
+    proc = subprocess.Popen(command, cwd=os.path.join(ROOT_DIR, directory), env=service_env(args, data_dir, port),
+                            stdout=log, stderr=subprocess.STDOUT)
+    client = Client(port, timeout=5)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} 服务启动失败，退出码 {proc.returncode}")
+        try:
+            # 所有 worker 都加载完应用后才开始计时
+            if all(client.request("GET", "/metrics")[0] == 200 for _ in range(args.workers * 2)):
+                return proc, Client(port, timeout=args.timeout)
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{name} 服务启动超时")
+
+
+def stop_service(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def process_tree_rss(pid):
+    """进程及其子进程的常驻内存(MiB)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+
+class RssSampler:
+    """后台每隔 interval 秒采样一次进程树内存，记录峰值；没有 /proc 的系统上峰值为 None"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while True:
+            rss = process_tree_rss(self.pid)
+            if rss:
+                self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# ---------- 运行和统计 ----------
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_scenario(client, pid, name, calls, concurrency):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(fn):
+        start = time.perf_counter()
+        try:
+            status = str(fn(client))
+        except (OSError, http.client.HTTPException, ValueError, KeyError):
+            status = "error"
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    with RssSampler(pid) as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, calls))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 1)
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)),
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]),
+        },
+        "peak_rss_mib": round(sampler.peak, 1) if sampler.peak else None,
+    }
+
+
+def print_scenario(result):
+    latency = result["latency_ms"]
+    rss = f"{result['peak_rss_mib']:7.1f}MiB" if result["peak_rss_mib"] else "      -   "
+    errors = f"  错误 {result['statuses']}" if result["errors"] else ""
+    print(f"  {result['name']:<36} 吞吐 {result['throughput']:8.1f}/秒  p50 {latency['p50']:8.1f}ms  "
+          f"p95 {latency['p95']:8.1f}ms  p99 {latency['p99']:8.1f}ms  内存峰值 {rss}{errors}", flush=True)
+
+
+def bench_service(name, args, run_id):
+    if args.renderers == "real":
+        missing = missing_renderer(name)
+        if missing:
+            print(f"{name}: 跳过，没有安装 {missing}")
+            return {"skipped": f"没有安装 {missing}"}
+
+    print(f"{name}: 启动服务（{args.workers} 个 worker，每个 {args.threads} 个线程，{args.renderers} 渲染器）")
+    with tempfile.TemporaryDirectory() as data_dir:
+        with open(os.path.join(data_dir, "service.log"), "wb") as log:
+            try:
+                proc, client = start_service(name, args, os.path.join(data_dir, "data"), log)
+            except RuntimeError as e:
+                log.flush()
+                with open(os.path.join(data_dir, "service.log"), encoding="utf-8", errors="replace") as f:
+                    print(f.read()[-2000:])
+                print(f"{name}: {e}")
+                return {"skipped": str(e)}
+            try:
+                idle_rss = process_tree_rss(proc.pid)
+                scenarios = []
+                for index, (scenario, build) in enumerate(SCENARIOS[name](args.sizes)):
+                    if args.scenario and not re.search(args.scenario, scenario):
+                        continue
+                    # 每个场景先预热几次，进程池和模板在第一次使用时加载
+                    tag = f"{run_id}-{index}"
+                    for fn in build(client, args.warmup, f"{tag}-warmup"):
+                        fn(client)
+                    calls = build(client, args.requests, tag)
+                    result = run_scenario(client, proc.pid, scenario, calls, args.concurrency)
+                    print_scenario(result)
+                    scenarios.append(result)
+                peaks = [s["peak_rss_mib"] for s in scenarios if s["peak_rss_mib"]]
+                return {
+                    "idle_rss_mib": round(idle_rss, 1) or None,
+                    "peak_rss_mib": max(peaks) if peaks else None,
+                    "scenarios": scenarios,
+                }
+            finally:
+                stop_service(proc)
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+# ---------- 对比 ----------
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(baseline, current, threshold):
+    """逐个场景对比两次结果，返回退化的场景数：p95 延迟变慢或吞吐下降超过 threshold%"""
+    print(f"\n对比 {baseline.get('commit') or '基准'} -> {current.get('commit') or '本次'}（变化超过 {threshold:g}% 视为退化）")
+    regressions = 0
+    for name, service in current["services"].items():
+        old_service = baseline.get("services", {}).get(name, {})
+        old_scenarios = {s["name"]: s for s in old_service.get("scenarios", [])}
+        for scenario in service.get("scenarios", []):
+            old = old_scenarios.get(scenario["name"])
+            if old is None:
+                continue
+            p50 = change(old["latency_ms"]["p50"], scenario["latency_ms"]["p50"])
+            p95 = change(old["latency_ms"]["p95"], scenario["latency_ms"]["p95"])
+            p99 = change(old["latency_ms"]["p99"], scenario["latency_ms"]["p99"])
+            throughput = change(old["throughput"], scenario["throughput"])
+            rss = change(old["peak_rss_mib"], scenario["peak_rss_mib"])
+            regressed = (p95 is not None and p95 > threshold) or (throughput is not None and throughput < -threshold)
+            regressions += regressed
+            fmt = lambda value: f"{value:+7.1f}%" if value is not None else "      -"
+            print(f"  {'退化' if regressed else '    '} {name:<8} {scenario['name']:<36} 吞吐 {fmt(throughput)}  "
+                  f"p50 {fmt(p50)}  p95 {fmt(p95)}  p99 {fmt(p99)}  内存峰值 {fmt(rss)}")
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default=",".join(SERVICES), help="压测的服务，逗号分隔")
+    parser.add_argument("--scenario", help="只运行名称匹配该正则表达式的场景")
+    parser.add_argument("--renderers", choices=["stub", "real"], default="stub", help="模拟渲染器或已安装的渲染器")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="模拟渲染器每次调用的固定耗时(秒)")
+    parser.add_argument("--stub-latency-per-kb", type=float, default=0.002, help="模拟渲染器输入每KB增加的耗时(秒)")
+    parser.add_argument("--sizes", default=",".join(SIZE_NAMES), help="生成内容的尺寸，small,medium,large 中的若干个")
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时发出的请求数")
+    parser.add_argument("--warmup", type=int, default=4, help="每个场景计时前的预热请求数")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker 进程数")
+    parser.add_argument("--threads", type=int, default=4, help="每个 worker 的线程数")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求的超时(秒)")
+    parser.add_argument("--output", help="结果文件，默认为 benchmarks/results/<时间>-<提交>.json")
+    parser.add_argument("--results", help="不运行压测，直接用这个结果文件与 --compare 对比")
+    parser.add_argument("--compare", help="与这个结果文件对比，有退化时退出码为 1")
+    parser.add_argument("--threshold", type=float, default=10, help="视为退化的变化百分比")
+    args = parser.parse_args()
+    args.services = [name.strip() for name in args.services.split(",") if name.strip()]
+    args.sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    for name in args.services:
+        if name not in SERVICES:
+            parser.error(f"未知的服务: {name}")
+    for size in args.sizes:
+        if size not in SIZE_NAMES:
+            parser.error(f"未知的尺寸: {size}")
+    if args.results and not args.compare:
+        parser.error("--results 需要与 --compare 一起使用")
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.results:
+        current = load_results(args.results)
+    else:
+        if importlib.util.find_spec("gunicorn") is None:
+            sys.exit("需要安装 gunicorn: pip install gunicorn")
+        commit, dirty = git_revision()
+        run_id = uuid.uuid4().hex[:8]
+        started = datetime.datetime.now(datetime.timezone.utc)
+        current = {
+            "commit": commit,
+            "dirty": dirty,
+            "started_at": started.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {
+                "renderers": args.renderers,
+                "stub_latency": args.stub_latency,
+                "stub_latency_per_kb": args.stub_latency_per_kb,
+                "sizes": args.sizes,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+                "threads": args.threads,
+            },
+            "services": {},
+        }
+        for name in args.services:
+            current["services"][name] = bench_service(name, args, run_id)
+
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{started.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}{'-dirty' if dirty else ''}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {output}")
+
+    if args.compare:
+        regressions = compare(load_results(args.compare), current, args.threshold)
+        if regressions:
+            print(f"{regressions} 个场景退化")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
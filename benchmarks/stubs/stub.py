@@ -0,0 +1,50 @@
+"""
+模拟渲染器共用的函数
+
+模拟的 mmdc、markmap-cli 和 marp 命令行按下面的环境变量等待一段时间后生成格式正确的输出，
+用来在没有安装 Node 和 Chromium 的环境中测量服务本身的开销：
+    STUB_LATENCY         每次调用的固定耗时(秒)，默认0.2
+    STUB_LATENCY_PER_KB  输入每KB增加的耗时(秒)，默认0.002
+    STUB_CALL_LOG        设置时每次调用向该文件追加一行命令行参数，测试用来统计渲染进程的启动次数
+"""
+import os
+import sys
+import time
+
+STUB_LATENCY = float(os.environ.get("STUB_LATENCY", "0.2"))  # 每次调用的固定耗时(秒)
+STUB_LATENCY_PER_KB = float(os.environ.get("STUB_LATENCY_PER_KB", "0.002"))  # 输入每KB增加的耗时(秒)
+
+# 最小的合法 PNG（1x1 透明像素）
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def option(args, name):
+    """返回命令行参数中 name 后面的值"""
+    if name in args:
+        return args[args.index(name) + 1]
+    return None
+
+
+def read_input(path):
+    if os.environ.get("STUB_CALL_LOG"):
+        # 追加写入的单行在多个进程间是原子的
+        with open(os.environ["STUB_CALL_LOG"], "a", encoding="utf-8") as f:
+            f.write(" ".join([os.path.basename(sys.argv[0])] + sys.argv[1:]) + "\n")
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    time.sleep(STUB_LATENCY + STUB_LATENCY_PER_KB * len(content.encode("utf-8")) / 1024)
+    return content
+
+
+def write_output(path, data):
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(path, mode, **({} if isinstance(data, bytes) else {"encoding": "utf-8"})) as f:
+        f.write(data)
+
+
+def fail(message):
+    print(message, file=sys.stderr)
+    sys.exit(1)
@@ -0,0 +1 @@
+"""各个工具服务共享的模块"""
@@ -0,0 +1,217 @@
+"""
+异步模式下的常驻 Node 进程池
+
+与 common.pool 的同步进程池使用同一套按行交换 JSON 的协议（启动后输出 {"ready": true}，
+任务 {"id", ...} 对应响应 {"id", ...} 或 {"id", "error"}），进程通过 asyncio.create_subprocess_exec 启动，
+等待结果时不占用线程，成百上千个等待中的请求只需要事件循环的一个线程。
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+from common.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SPAWNS
+
+logger = logging.getLogger(__name__)
+
+# 单行响应的长度上限，渲染结果（例如思维导图 HTML）放在一行中返回
+LINE_LIMIT = 64 * 1024 * 1024
+
+
+class WorkerError(Exception):
+    """进程返回的任务错误"""
+
+
+class WorkerTimeout(WorkerError):
+    """单个任务超时"""
+
+
+class PoolUnavailable(Exception):
+    """进程池不可用，调用方应回退到同步实现"""
+
+
+class _WorkerDied(Exception):
+    """进程在任务执行期间退出"""
+
+
+class _AsyncWorker:
+    """单个 Node 进程，同一时刻只执行一个任务"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.jobs = 0
+        self._ids = itertools.count(1)
+
+    @classmethod
+    async def spawn(cls, command, start_timeout):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=LINE_LIMIT
+            )
+        except OSError as e:
+            raise PoolUnavailable(f"无法启动进程: {e}")
+        worker = cls(proc)
+        try:
+            message = await asyncio.wait_for(worker._next_message(), start_timeout)
+        except (asyncio.TimeoutError, _WorkerDied, ValueError):
+            worker.kill()
+            raise PoolUnavailable("进程启动失败")
+        if not message.get("ready"):
+            worker.kill()
+            raise PoolUnavailable("进程未就绪")
+        return worker
+
+    async def _next_message(self):
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise _WorkerDied()
+        return json.loads(line)
+
+    async def request(self, message):
+        job_id = next(self._ids)
+        try:
+            self.proc.stdin.write((json.dumps(dict(message, id=job_id), ensure_ascii=False) + "\n").encode("utf-8"))
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            raise _WorkerDied()
+        while True:
+            response = await self._next_message()
+            # 丢弃之前超时任务遗留的响应
+            if response.get("id") == job_id:
+                break
+        self.jobs += 1
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response
+
+    def alive(self):
+        return self.proc.returncode is None
+
+    def kill(self):
+        if self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
+
+class AsyncProcessPool:
+    """
+    固定大小的异步进程池
+
+    进程在第一次请求时在当前事件循环中启动；崩溃或超时的进程会被杀掉并重新拉起，
+    处理满 max_jobs 个任务的进程会被回收。启动失败后在 retry_interval 秒内直接抛出 PoolUnavailable。
+    """
+
+    def __init__(self, command, size=2, timeout=30, max_jobs=500, start_timeout=30, retry_interval=60, name="node"):
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.start_timeout = start_timeout
+        self.retry_interval = retry_interval
+        self.name = name
+        self._idle = None
+        self._lock = None
+        self._workers = 0
+        self._disabled_until = 0
+        # 后台回收进程的任务，保持引用避免被垃圾回收
+        self._tasks = set()
+
+    async def _spawn(self):
+        SUBPROCESS_SPAWNS.inc(tool=self.name, kind="pool")
+        try:
+            return await _AsyncWorker.spawn(self.command, self.start_timeout)
+        except PoolUnavailable:
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="start")
+            raise
+
+    async def _ensure_started(self):
+        if self._workers > 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._workers > 0:
+                return
+            if self.size <= 0:
+                raise PoolUnavailable(f"{self.name} 进程池已禁用")
+            if time.time() < self._disabled_until:
+                raise PoolUnavailable(f"{self.name} 进程池暂不可用")
+            self._idle = asyncio.Queue()
+            workers = await asyncio.gather(*(self._spawn() for _ in range(self.size)), return_exceptions=True)
+            errors = [w for w in workers if isinstance(w, BaseException)]
+            if errors:
+                for worker in workers:
+                    if not isinstance(worker, BaseException):
+                        worker.kill()
+                logger.warning(f"{self.name} 异步进程池启动失败，{self.retry_interval} 秒内使用同步实现: {errors[0]}")
+                self._disabled_until = time.time() + self.retry_interval
+                raise PoolUnavailable(str(errors[0]))
+            for worker in workers:
+                self._idle.put_nowait(worker)
+            self._workers = len(workers)
+            logger.info(f"{self.name} 异步进程池已启动，进程数 {self.size}")
+
+    async def _replace(self, worker):
+        """杀掉出问题的进程，并尽量补充一个新进程"""
+        worker.kill()
+        try:
+            self._idle.put_nowait(await self._spawn())
+        except PoolUnavailable as e:
+            self._workers -= 1
+            if self._workers <= 0:
+                self._disabled_until = time.time() + self.retry_interval
+            logger.error(f"无法重启 {self.name} 进程: {e}")
+
+    async def request(self, message):
+        """提交任务并返回响应，任务出错时抛出 WorkerError，超时抛出 WorkerTimeout"""
+        await self._ensure_started()
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolUnavailable(f"等待空闲 {self.name} 进程超时")
+
+        if not worker.alive():
+            await self._replace(worker)
+            raise PoolUnavailable(f"{self.name} 进程已退出")
+
+        try:
+            response = await asyncio.wait_for(worker.request(message), self.timeout)
+        except WorkerError:
+            self._release(worker)
+            raise
+        except asyncio.TimeoutError:
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="timeout")
+            logger.error(f"{self.name} 任务超时({self.timeout} 秒)，重启进程")
+            await self._replace(worker)
+            raise WorkerTimeout(f"任务超过 {self.timeout} 秒未完成")
+        except (_WorkerDied, ValueError):
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="crash")
+            logger.error(f"{self.name} 进程异常退出，重启进程")
+            await self._replace(worker)
+            raise PoolUnavailable(f"{self.name} 进程异常退出")
+        except BaseException:
+            # 请求被取消（客户端断开），进程中的任务仍在执行，之后的响应按 id 丢弃
+            self._release(worker)
+            raise
+
+        self._release(worker)
+        return response
+
+    def _release(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            task = asyncio.get_running_loop().create_task(self._replace(worker))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._idle.put_nowait(worker)
+
+    def close(self):
+        """结束所有空闲进程"""
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+        self._workers = 0
@@ -0,0 +1,358 @@
+"""
+文件过期索引
+
+用 SQLite 表按过期时间记录数据目录中的文件，清理时只取出已经过期的条目，
+不需要每次遍历整个目录。写入文件时由 ContentStore 登记，清理按批次删除并提交，
+中途退出后下一次清理会从剩下的过期条目继续。
+
+设置了容量上限（max_bytes）时同时记录每个文件最近一次被读取的时间，读取记录先放在内存中，每隔 ACCESS_FLUSH_INTERVAL 秒批量写入；
+清理线程每隔 QUOTA_CHECK_INTERVAL 秒检查总大小，超出上限时按最近读取时间从旧到新删除，直到低于上限的 QUOTA_LOW_WATER。
+"""
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from common.metrics import (EVICT_DELETED, EVICT_FREED, SWEEP_DELETED, SWEEP_FREED, SWEEP_LAST, SWEEP_PENDING,
+                            SWEEP_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# 读取记录写入索引的间隔(秒)
+ACCESS_FLUSH_INTERVAL = 30
+# 检查容量上限的间隔(秒)
+QUOTA_CHECK_INTERVAL = 30
+# 超出容量上限时删除到上限的这个比例，避免每次写入后都要删除
+QUOTA_LOW_WATER = 0.9
+
+
+class ExpiryIndex:
+    """按过期时间索引数据目录中的文件"""
+
+    DB_NAME = ".expiry.sqlite3"
+
+    def __init__(self, root, ttl, timeout=10, max_bytes=0):
+        self.root = root
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.path = os.path.join(root, self.DB_NAME)
+        self._local = threading.local()
+        self._accessed = {}
+        self._accessed_flushed = time.time()
+        os.makedirs(root, exist_ok=True)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, expires_at REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS files_expires ON files (expires_at)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+            if "accessed_at" not in columns:
+                # 旧版本的索引没有读取时间，按登记时间计算
+                conn.execute("ALTER TABLE files ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE files SET accessed_at = expires_at - ?", (ttl,))
+            conn.execute("CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sweeps ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, started_at REAL NOT NULL, finished_at REAL, "
+                "deleted INTEGER NOT NULL DEFAULT 0, bytes_freed INTEGER NOT NULL DEFAULT 0, "
+                "cursor REAL, duration REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 出来的子进程不能复用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.root)
+
+    def track(self, path, expires_at=None):
+        """登记或刷新文件的过期时间"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.ttl
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO files (path, expires_at, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (self._relpath(path), expires_at, size, now),
+            )
+        except sqlite3.Error as e:
+            logger.error(f"无法登记文件过期时间 {path}: {e}")
+
+    def accessed(self, path):
+        """记录文件被读取，没有设置容量上限时不记录"""
+        if not self.max_bytes:
+            return
+        now = time.time()
+        self._accessed[self._relpath(path)] = now
+        if now - self._accessed_flushed >= ACCESS_FLUSH_INTERVAL:
+            self.flush_accessed()
+
+    def flush_accessed(self):
+        """把内存中的读取记录写入索引"""
+        self._accessed_flushed = time.time()
+        accessed, self._accessed = self._accessed, {}
+        if not accessed:
+            return
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE files SET accessed_at = ? WHERE path = ?",
+                             [(at, relpath) for relpath, at in accessed.items()])
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"无法记录文件读取时间: {e}")
+
+    def bootstrap(self, files):
+        """
+        首次使用时登记已有文件，files 为 (路径, 修改时间) 序列
+
+        只执行一次，之后的文件都由写入方登记。
+        """
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'bootstrapped'").fetchone():
+            return 0
+        count = 0
+        rows = []
+        conn.execute("BEGIN IMMEDIATE")
+        for path, mtime in files:
+            try:
+                rows.append((self._relpath(path), mtime + self.ttl, os.path.getsize(path), mtime))
+            except OSError:
+                continue
+            if len(rows) >= 1000:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO files (path, expires_at, size, accessed_at) VALUES (?, ?, ?, ?)", rows)
+                count += len(rows)
+                rows = []
+        conn.executemany("INSERT OR IGNORE INTO files (path, expires_at, size, accessed_at) VALUES (?, ?, ?, ?)", rows)
+        count += len(rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bootstrapped', ?)", (str(time.time()),))
+        conn.execute("COMMIT")
+        return count
+
+    def sweep(self, batch_size=500, pause=0.05, now=None):
+        """
+        删除已过期的文件，每批最多 batch_size 个，批次之间暂停 pause 秒
+
+        返回本次清理的统计信息。
+        """
+        conn = self._connection()
+        started = time.time()
+        now = now or started
+        sweep_id = conn.execute("INSERT INTO sweeps (started_at) VALUES (?)", (started,)).lastrowid
+        deleted = 0
+        bytes_freed = 0
+        cursor = None
+
+        while True:
+            rows = conn.execute(
+                "SELECT path, expires_at, size FROM files WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (now, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+
+            removed = []
+            rescheduled = []
+            for relpath, expires_at, size in rows:
+                path = os.path.join(self.root, relpath)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    # 文件已经不存在
+                    removed.append((relpath,))
+                    continue
+                # 文件在登记之后又被更新过，按新的修改时间重新计算
+                if mtime + self.ttl > now:
+                    rescheduled.append((mtime + self.ttl, relpath))
+                    continue
+                try:
+                    os.remove(path)
+                    deleted += 1
+                    bytes_freed += size
+                except OSError as e:
+                    logger.error(f"无法删除文件 {path}: {e}")
+                removed.append((relpath,))
+                cursor = expires_at
+
+            # 每批提交一次，中途退出时已处理的条目不会重复处理
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            conn.executemany("UPDATE files SET expires_at = ? WHERE path = ?", rescheduled)
+            conn.execute(
+                "UPDATE sweeps SET deleted = ?, bytes_freed = ?, cursor = ? WHERE id = ?",
+                (deleted, bytes_freed, cursor, sweep_id),
+            )
+            conn.execute("COMMIT")
+
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+
+        finished = time.time()
+        conn.execute(
+            "UPDATE sweeps SET finished_at = ?, duration = ? WHERE id = ?",
+            (finished, finished - started, sweep_id),
+        )
+        # 只保留最近的清理记录
+        conn.execute("DELETE FROM sweeps WHERE id <= ?", (sweep_id - 100,))
+        return {
+            "deleted": deleted,
+            "bytes_freed": bytes_freed,
+            "duration": round(finished - started, 3),
+            "pending": self.pending(now),
+        }
+
+    def evict(self, batch_size=500):
+        """
+        总大小超过容量上限时按最近读取时间从旧到新删除文件，直到低于上限的 QUOTA_LOW_WATER
+
+        返回删除的文件数和释放的字节数。
+        """
+        conn = self._connection()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        if not self.max_bytes or total <= self.max_bytes:
+            return {"deleted": 0, "bytes_freed": 0}
+        # 本进程的读取记录先写入，其他进程的记录最多晚 ACCESS_FLUSH_INTERVAL 秒
+        self.flush_accessed()
+        target = self.max_bytes * QUOTA_LOW_WATER
+        deleted = 0
+        bytes_freed = 0
+        while total > target:
+            rows = conn.execute(
+                "SELECT path, size FROM files ORDER BY accessed_at LIMIT ?", (batch_size,)).fetchall()
+            if not rows:
+                break
+            removed = []
+            for relpath, size in rows:
+                try:
+                    os.remove(os.path.join(self.root, relpath))
+                    deleted += 1
+                    bytes_freed += size
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"无法删除文件 {relpath}: {e}")
+                removed.append((relpath,))
+                total -= size
+                if total <= target:
+                    break
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            conn.execute("COMMIT")
+        return {"deleted": deleted, "bytes_freed": bytes_freed}
+
+    def pending(self, now=None):
+        """已过期但尚未删除的文件数"""
+        now = now or time.time()
+        return self._connection().execute("SELECT COUNT(*) FROM files WHERE expires_at <= ?", (now,)).fetchone()[0]
+
+    def stats(self):
+        """索引中的文件数、总字节数和最近一次清理的统计"""
+        conn = self._connection()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+        row = conn.execute(
+            "SELECT started_at, finished_at, deleted, bytes_freed, duration FROM sweeps ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        last_sweep = None
+        if row:
+            last_sweep = dict(zip(("started_at", "finished_at", "deleted", "bytes_freed", "duration"), row))
+        return {"files": count, "bytes": total, "max_bytes": self.max_bytes, "last_sweep": last_sweep}
+
+
+# 当前进程中已经启动的清理线程，网关在一个进程中加载多个服务时，同一个数据目录只启动一个线程
+_sweepers = {}
+_sweepers_lock = threading.Lock()
+
+
+def start_sweeper(index, interval, bootstrap_files=None):
+    """
+    启动后台清理线程
+
+    每个进程都会启动线程，但只有拿到 .expiry.lock 文件锁的进程执行清理并一直持有锁；
+    其他进程定期重试，持锁进程退出后由它们接手。同一进程对同一个数据目录重复调用时返回已有的线程。
+    设置了容量上限时每隔 QUOTA_CHECK_INTERVAL 秒检查一次总大小，过期清理仍然每 interval 秒执行一次。
+    """
+    lock_path = os.path.join(index.root, ".expiry.lock")
+
+    def run():
+        lock_file = open(lock_path, "a")
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(interval)
+
+        logger.info(f"文件清理服务已启动，每 {interval} 秒清理一次")
+        if bootstrap_files is not None:
+            try:
+                count = index.bootstrap(bootstrap_files())
+                if count:
+                    logger.info(f"已登记 {count} 个已有文件的过期时间")
+            except Exception as e:
+                logger.error(f"登记已有文件时出错: {e}")
+
+        next_sweep = 0
+        while True:
+            if index.max_bytes:
+                try:
+                    result = index.evict()
+                    EVICT_DELETED.inc(result["deleted"])
+                    EVICT_FREED.inc(result["bytes_freed"])
+                    if result["deleted"]:
+                        logger.info(f"超出容量上限，已删除 {result['deleted']} 个最久未读取的文件，"
+                                    f"释放 {result['bytes_freed']} 字节")
+                except Exception as e:
+                    logger.error(f"按容量清理文件时出错: {e}")
+            if time.time() < next_sweep:
+                time.sleep(QUOTA_CHECK_INTERVAL)
+                continue
+            next_sweep = time.time() + interval
+            try:
+                result = index.sweep()
+                SWEEP_SECONDS.observe(result["duration"])
+                SWEEP_DELETED.inc(result["deleted"])
+                SWEEP_FREED.inc(result["bytes_freed"])
+                SWEEP_PENDING.set(result["pending"])
+                SWEEP_LAST.set(time.time())
+                if result["deleted"]:
+                    logger.info(
+                        f"已清理 {result['deleted']} 个过期文件，释放 {result['bytes_freed']} 字节，"
+                        f"耗时 {result['duration']} 秒"
+                    )
+            except Exception as e:
+                logger.error(f"清理文件时出错: {e}")
+            time.sleep(min(interval, QUOTA_CHECK_INTERVAL) if index.max_bytes else interval)
+
+    key = (os.getpid(), os.path.realpath(lock_path))
+    with _sweepers_lock:
+        if key in _sweepers:
+            return _sweepers[key]
+        thread = _sweepers[key] = threading.Thread(target=run, daemon=True)
+        thread.start()
+    return thread
@@ -0,0 +1,355 @@
+"""
+后台渲染任务队列
+
+任务提交后立即返回任务 ID，由提交任务的进程中固定数量的线程执行；队列有长度上限，
+超出时抛出 QueueFull。任务状态保存在数据目录下的 SQLite 中，gunicorn 的任何 worker 都可以查询。
+每个任务有独立的超时时间，由每个进程中的一个线程按截止时间统一处理，超时后状态变为 timeout，之后完成的结果会被丢弃。
+任务结束（成功、失败或超时）时，如果提交时指定了 webhook，会由单独的线程把任务状态 POST 到该地址，
+不占用执行任务的线程。webhook 只能是公网地址，内网、本机和链路本地地址（例如 169.254.169.254）需要在
+WEBHOOK_ALLOWED_HOSTS 中列出主机名才能使用。
+"""
+import contextvars
+import heapq
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+from common.ratelimit import estimate_wait
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()}  # 允许回调的内网主机名，逗号分隔
+WEBHOOK_MAX_PENDING = int(os.environ.get("WEBHOOK_MAX_PENDING", "1000"))  # 等待发送的 webhook 上限，超出时丢弃并记录日志
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+
+class QueueFull(Exception):
+    """任务队列已满，调用方应在 retry_after 秒后重试"""
+
+    def __init__(self, message, retry_after=10):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobTimeout(Exception):
+    """任务在超时时间内没有完成"""
+
+
+def check_webhook(url):
+    """webhook 不是 http(s) 地址，或者解析到内网、本机等地址且主机不在 WEBHOOK_ALLOWED_HOSTS 中时抛出 ValueError"""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("webhook 必须是 http 或 https 地址")
+    host = parsed.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 80, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError(f"无法解析 webhook 地址: {host}")
+    for address in addresses:
+        # IPv6 地址可能带有 %网卡 后缀
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise ValueError(f"webhook 不能指向内网或本机地址: {host}")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """不跟随重定向，否则公网地址可以把回调转到内网地址"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class _Pending:
+    """提交任务的进程内用于等待结果的对象"""
+
+    def __init__(self, job_id, payload, webhook):
+        self.id = job_id
+        self.payload = payload
+        self.webhook = webhook
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # 在提交任务时的上下文中执行，渲染阶段的 span 挂在提交请求的 span 下
+        self.context = contextvars.copy_context()
+
+
+class JobQueue:
+    """
+    有界的后台任务队列
+
+    handler(payload) 在后台线程中执行，返回可以 JSON 序列化的结果，抛出的异常记为任务失败。
+    线程在第一次提交任务时按当前 PID 启动，gunicorn fork 出的每个 worker 各自持有一组线程。
+    """
+
+    DB_NAME = ".jobs.sqlite3"
+    # 每提交多少个任务清理一次过期的任务记录
+    PRUNE_EVERY = 100
+    # 任务耗时指数平均中新样本的权重
+    SMOOTHING = 0.2
+
+    def __init__(self, root, handler, workers=4, max_queue=32, timeout=120, ttl=24 * 3600, webhook_timeout=10):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.ttl = ttl
+        self.webhook_timeout = webhook_timeout
+        self.path = os.path.join(root, self.DB_NAME)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._submitted = itertools.count(1)
+        # 未结束的任务 {id: _Pending} 和按截止时间排列的 (截止时间, id)，由一个线程处理超时
+        self._active = {}
+        self._deadlines = []
+        self._deadline_changed = threading.Condition()
+        self._webhooks = None
+        # 最近任务耗时的指数平均值(秒)，用来估计排队的等待时间
+        self._average = 5.0
+        os.makedirs(root, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 出来的子进程不能复用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 之后继承来的队列和线程不属于当前进程
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._webhooks = queue.Queue(maxsize=WEBHOOK_MAX_PENDING)
+            self._active = {}
+            self._deadlines = []
+            for _ in range(self.workers):
+                threading.Thread(target=self._work, daemon=True).start()
+            if self.timeout:
+                threading.Thread(target=self._watch_deadlines, daemon=True).start()
+            threading.Thread(target=self._deliver_webhooks, daemon=True).start()
+            self._pid = os.getpid()
+
+    def depth(self):
+        """当前进程中排队等待执行的任务数"""
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def retry_after(self):
+        """按当前排队的任务数估计新任务需要等待多久"""
+        return estimate_wait(self.depth(), self.workers, self._average)
+
+    def admit(self):
+        """
+        队列已满时立即抛出 QueueFull，在接收请求体之前调用
+
+        只是提前拒绝，提交时仍可能因为其他线程先占满队列而失败。
+        """
+        if self._pid == os.getpid() and self._queue.full():
+            raise QueueFull(f"任务队列已满({self.max_queue})", self.retry_after())
+
+    def submit(self, payload, webhook=None):
+        """提交任务并返回任务 ID，队列已满时抛出 QueueFull，webhook 不是公网的 http(s) 地址时抛出 ValueError"""
+        return self._submit(payload, webhook).id
+
+    def _submit(self, payload, webhook):
+        if webhook:
+            check_webhook(webhook)
+        self._ensure_started()
+        job_id = uuid.uuid4().hex
+        pending = _Pending(job_id, payload, webhook)
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO jobs (id, status, created_at) VALUES (?, ?, ?)",
+            (job_id, QUEUED, time.time()),
+        )
+        with self._deadline_changed:
+            self._active[job_id] = pending
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._deadline_changed:
+                self._active.pop(job_id, None)
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            raise QueueFull(f"任务队列已满({self.max_queue})", self.retry_after())
+
+        if self.timeout:
+            with self._deadline_changed:
+                heapq.heappush(self._deadlines, (time.monotonic() + self.timeout, job_id))
+                # 新任务的截止时间最早时才需要唤醒，通常超时时间相同，新任务排在最后
+                if self._deadlines[0][1] == job_id:
+                    self._deadline_changed.notify()
+        if next(self._submitted) % self.PRUNE_EVERY == 0:
+            self._prune()
+        return pending
+
+    def get(self, job_id):
+        """查询任务状态，任务不存在时返回 None"""
+        row = self._connection().execute(
+            "SELECT id, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "status", "result", "error", "created_at", "started_at", "finished_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def run(self, payload):
+        """
+        提交任务并等待结果，用于同步接口
+
+        返回任务结果或重新抛出任务中的异常，任务超时时抛出 JobTimeout。
+        """
+        pending = self._submit(payload, None)
+        # 超时由截止时间线程处理，这里多等一会儿避免与它竞争
+        if not pending.done.wait(self.timeout + 5 if self.timeout else None):
+            raise JobTimeout(f"任务超过 {self.timeout} 秒未完成")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self):
+        """当前进程的队列长度和各状态的任务数"""
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "queued": self._queue.qsize() if self._pid == os.getpid() else 0,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "average_seconds": round(self._average, 3),
+            "jobs": counts,
+        }
+
+    def _work(self):
+        while True:
+            pending = self._queue.get()
+            try:
+                self._run(pending)
+            except Exception as e:
+                logger.error(f"执行任务 {pending.id} 时出错: {e}")
+
+    def _run(self, pending):
+        conn = self._connection()
+        started = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, time.time(), pending.id, QUEUED),
+        ).rowcount
+        # 排队期间已经超时
+        if not started:
+            return
+
+        start = time.monotonic()
+        try:
+            result = pending.context.run(self.handler, pending.payload)
+        except Exception as e:
+            self._finish(pending, FAILED, error=e)
+            return
+        finally:
+            self._average += self.SMOOTHING * (time.monotonic() - start - self._average)
+        self._finish(pending, SUCCEEDED, result=result)
+
+    def _watch_deadlines(self):
+        """按截止时间把到期仍未结束的任务记为超时，已结束的任务不在 _active 中，直接跳过"""
+        while True:
+            with self._deadline_changed:
+                while not self._deadlines or self._deadlines[0][0] > time.monotonic():
+                    self._deadline_changed.wait(self._deadlines[0][0] - time.monotonic() if self._deadlines else None)
+                _, job_id = heapq.heappop(self._deadlines)
+                pending = self._active.get(job_id)
+            if pending is not None:
+                try:
+                    self._finish(pending, TIMEOUT, error=JobTimeout(f"任务超过 {self.timeout} 秒未完成"))
+                except Exception as e:
+                    logger.error(f"记录任务 {job_id} 超时时出错: {e}")
+
+    def _finish(self, pending, status, result=None, error=None):
+        """记录任务结果，任务已经结束（例如已超时）时不做任何事"""
+        finished = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE id = ? AND status IN (?, ?)",
+            (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                str(error) if error is not None else None,
+                time.time(),
+                pending.id,
+                QUEUED,
+                RUNNING,
+            ),
+        ).rowcount
+        if not finished:
+            return
+
+        with self._deadline_changed:
+            self._active.pop(pending.id, None)
+        pending.result = result
+        pending.error = error
+        pending.done.set()
+        if pending.webhook:
+            try:
+                self._webhooks.put_nowait((pending.id, pending.webhook))
+            except queue.Full:
+                logger.warning(f"等待发送的 webhook 过多，丢弃任务 {pending.id} 的回调")
+
+    def _deliver_webhooks(self):
+        while True:
+            job_id, webhook = self._webhooks.get()
+            self._notify(job_id, webhook)
+
+    def _notify(self, job_id, webhook):
+        """把任务状态 POST 到 webhook，失败只记录日志"""
+        try:
+            # 提交之后域名可能已经解析到其他地址，发送前再检查一次
+            check_webhook(webhook)
+            job = self.get(job_id)
+            request = urllib.request.Request(
+                webhook,
+                data=json.dumps(job, ensure_ascii=False).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with _webhook_opener.open(request, timeout=self.webhook_timeout):
+                pass
+        except Exception as e:
+            logger.warning(f"任务 {job_id} 的 webhook 调用失败: {e}")
+
+    def _prune(self):
+        """删除已结束且超过保留时间的任务记录"""
+        try:
+            self._connection().execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - self.ttl,),
+            )
+        except sqlite3.Error as e:
+            logger.error(f"清理任务记录时出错: {e}")
@@ -0,0 +1,57 @@
+"""
+上传内容的检查结果
+
+各服务在启动渲染进程之前先在进程内检查内容（mermaid 的图表类型和结构、markmap 的标题和列表、大小和节点数），
+不通过时抛出 LintError，其中包含错误代码、出错的行号和修改建议，Dify 中的 Agent 可以据此修改内容后重试。
+渲染器报告的语法错误按内容哈希保存为 <hash>.error（JSON），与其他文件一样过期，相同内容再次上传时直接返回错误，不再渲染。
+"""
+import json
+
+
+class LintError(ValueError):
+    """上传的内容不能渲染，code 为错误代码，line 为出错的行号（从 1 开始），hint 为修改建议"""
+
+    def __init__(self, code, message, line=None, hint=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.line = line
+        self.hint = hint
+
+    def to_dict(self):
+        details = {"code": self.code, "message": self.message}
+        if self.line is not None:
+            details["line"] = self.line
+        if self.hint:
+            details["hint"] = self.hint
+        return details
+
+    def __str__(self):
+        text = f"[{self.code}] {self.message}"
+        if self.line is not None:
+            text += f"（第 {self.line} 行）"
+        if self.hint:
+            text += f"\n修改建议: {self.hint}"
+        return text
+
+
+class NegativeCache:
+    """按内容哈希记录渲染失败的内容"""
+
+    EXT = ".error"
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, digest):
+        """之前渲染失败时返回当时的 LintError，否则返回 None"""
+        if not self.store.exists(digest, self.EXT):
+            return None
+        try:
+            with open(self.store.path(digest, self.EXT), encoding="utf-8") as f:
+                return LintError(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def put(self, digest, error):
+        self.store.write(digest, self.EXT, json.dumps(error.to_dict(), ensure_ascii=False))
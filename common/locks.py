@@ -0,0 +1,29 @@
+"""
+按键加锁
+
+同一个文件同一时刻只生成一次：相同键的请求依次进入，后到的请求拿到锁之后应先检查文件是否已经生成。
+锁只在进程内有效，没有请求等待的键随即删除，不会随文件数增长。
+"""
+import threading
+from contextlib import contextmanager
+
+
+class KeyedLocks:
+    def __init__(self):
+        # {键: [锁, 等待和持有锁的请求数]}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
@@ -0,0 +1,502 @@
+"""
+Prometheus 指标和分阶段耗时追踪
+
+指标在进程内存中累加（一次加锁的字典更新），后台线程每隔 METRICS_FLUSH_INTERVAL 秒把当前进程的快照写到
+<数据目录>/.metrics/<主机名>-<pid>.json；/metrics 读取所有存活进程的快照合并后输出，gunicorn 任何一个 worker
+返回的都是整个服务的数据。长时间没有更新的快照属于已经退出的进程，读取时把其中的计数器和直方图累加到
+<数据目录>/.metrics/dead.json 后删除，合并结果中的总数不会因为 worker 重启而减少；gauge 只对存活的进程有意义，直接丢弃。
+
+stage() 记录处理流程中每一步的耗时（接收、查缓存、渲染、写文件等），同时作为一个 span；
+设置 SPAN_EXPORT_FILE 后，span 按 OpenTelemetry 的字段名逐行写入 JSON 文件，没有设置时不创建 span 对象。
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))  # 进程快照的写入间隔(秒)
+SPAN_EXPORT_FILE = os.environ.get("SPAN_EXPORT_FILE", "")  # span 导出文件(JSON Lines)，为空时不导出
+
+# 默认的耗时分桶(秒)，覆盖从缓存命中到 PDF 导出
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 文件大小分桶(字节)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames, aggregate="sum"):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 多个进程的值如何合并：sum 或 max（例如最近一次清理的时间）
+        self.aggregate = aggregate
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def reset(self):
+        self._values = {}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # 各分桶的计数（不累加）、+Inf 桶、总和、次数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    """进程内的指标集合，同名指标只注册一次（网关中多个服务共用一个进程）"""
+
+    # 已退出进程累计的计数器和直方图
+    DEAD_SNAPSHOT = "dead.json"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+        self.directory = None
+        self._pid = None
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), aggregate="sum"):
+        return self._register(Gauge, name, documentation, labelnames, aggregate=aggregate)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        """collector() 在生成快照前调用，用来刷新队列长度等只在读取时才有意义的值"""
+        self.collectors.append(collector)
+
+    def configure(self, data_dir):
+        """指定保存进程快照的数据目录并启动写入线程，第一次调用的目录生效"""
+        if self.directory is None:
+            self.directory = os.path.join(data_dir, ".metrics")
+            os.makedirs(self.directory, exist_ok=True)
+        self.ensure_started()
+
+    def ensure_started(self):
+        """每个进程启动一个写入线程；fork 之后继承来的计数属于父进程，清空后重新计数"""
+        if self._pid == os.getpid() or self.directory is None:
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                for metric in self.metrics.values():
+                    metric.reset()
+            self._pid = os.getpid()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def snapshot(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"收集指标时出错: {e}")
+        with self.lock:
+            return {
+                name: {
+                    "type": metric.type,
+                    "help": metric.documentation,
+                    "labels": metric.labelnames,
+                    "buckets": getattr(metric, "buckets", None),
+                    "aggregate": metric.aggregate,
+                    "values": [[list(key), _copy(value)] for key, value in metric._values.items()],
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    def _snapshot_name(self):
+        # 数据目录可能被多个容器共用，文件名中带上主机名避免 pid 冲突
+        return f"{socket.gethostname()}-{os.getpid()}.json"
+
+    def flush(self):
+        if self.directory is None or self._pid != os.getpid():
+            return
+        path = os.path.join(self.directory, self._snapshot_name())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                _exporter.flush()
+            except Exception as e:
+                logger.warning(f"写入指标快照时出错: {e}")
+
+    def _retire(self, path):
+        """把已退出进程的快照中的计数器和直方图累加到 DEAD_SNAPSHOT 后删除快照，多个进程同时发现时只累加一次"""
+        dead_path = os.path.join(self.directory, self.DEAD_SNAPSHOT)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                # 已由其他进程处理
+                return
+            except ValueError:
+                snapshot = {}
+            merged = {}
+            try:
+                with open(dead_path, encoding="utf-8") as f:
+                    _merge(merged, json.load(f))
+            except (FileNotFoundError, ValueError):
+                pass
+            _merge(merged, snapshot, gauges=False)
+            tmp_path = f"{dead_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({name: dict(data, values=[[list(key), value] for key, value in data["values"].items()])
+                           for name, data in merged.items()}, f)
+            os.replace(tmp_path, dead_path)
+            os.remove(path)
+
+    def _snapshots(self):
+        """当前进程的实时数据、其他存活进程的快照和已退出进程的累计值"""
+        yield self.snapshot()
+        if self.directory is None:
+            return
+        own = self._snapshot_name()
+        stale_before = time.time() - max(30, METRICS_FLUSH_INTERVAL * 6)
+        paths = []
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(".json") or entry in (own, self.DEAD_SNAPSHOT):
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    self._retire(path)
+                    continue
+            except OSError:
+                continue
+            paths.append(path)
+        # 退出的进程在上面累加到 DEAD_SNAPSHOT 中，之后再读取
+        paths.append(os.path.join(self.directory, self.DEAD_SNAPSHOT))
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def render(self):
+        """合并所有进程的数据，输出 Prometheus 文本格式"""
+        merged = {}
+        for snapshot in self._snapshots():
+            _merge(merged, snapshot)
+
+        lines = []
+        for name, data in sorted(merged.items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['type']}")
+            for key, value in sorted(data["values"].items()):
+                labels = list(zip(data["labels"], key))
+                if data["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(data["buckets"]) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged, snapshot, gauges=True):
+    """把一个快照累加到 merged（{指标名: 快照中的字段，values 为 {标签值: 值}}）中，gauges 为 False 时跳过 gauge"""
+    for name, data in snapshot.items():
+        if not gauges and data["type"] == "gauge":
+            continue
+        target = merged.setdefault(name, dict(data, values={}))
+        for key, value in data["values"]:
+            key = tuple(key)
+            if key not in target["values"]:
+                target["values"][key] = value
+            elif data["type"] == "histogram":
+                old = target["values"][key]
+                target["values"][key] = [[a + b for a, b in zip(old[0], value[0])],
+                                         old[1] + value[1], old[2] + value[2]]
+            elif data["aggregate"] == "max":
+                target["values"][key] = max(target["values"][key], value)
+            else:
+                target["values"][key] += value
+
+
+def _copy(value):
+    """直方图的值是可变列表，快照中复制一份"""
+    if isinstance(value, list):
+        return [list(value[0]), value[1], value[2]]
+    return value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+# 各服务共用的指标，tool 为服务名称
+REQUEST_SECONDS = REGISTRY.histogram(
+    "dify_tool_request_seconds", "HTTP 请求处理耗时(秒)", ("tool", "endpoint", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "dify_tool_stage_seconds", "上传处理各阶段的耗时(秒)", ("tool", "stage"))
+RENDER_SECONDS = REGISTRY.histogram(
+    "dify_tool_render_seconds", "渲染耗时(秒)", ("tool", "format", "renderer"))
+CACHE_REQUESTS = REGISTRY.counter(
+    "dify_tool_cache_requests_total", "查找已生成结果的次数，result 为 hit、miss 或 negative（之前渲染失败的内容）", ("tool", "result"))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "dify_tool_queue_depth", "排队等待渲染的任务数", ("tool",))
+INFLIGHT = REGISTRY.gauge(
+    "dify_tool_inflight_renders", "正在渲染或等待渲染进程的请求数", ("tool",))
+SUBPROCESS_SPAWNS = REGISTRY.counter(
+    "dify_tool_subprocess_spawns_total", "启动的外部进程数，kind 为 pool(常驻进程)、sidecar 或 cli", ("tool", "kind"))
+SUBPROCESS_FAILURES = REGISTRY.counter(
+    "dify_tool_subprocess_failures_total", "外部进程启动失败、崩溃、超时或返回错误的次数", ("tool", "kind", "reason"))
+ARTIFACT_BYTES = REGISTRY.counter(
+    "dify_tool_artifact_bytes_total", "写入内容存储的字节数", ("tool", "ext"))
+ARTIFACT_SIZE = REGISTRY.histogram(
+    "dify_tool_artifact_size_bytes", "写入内容存储的文件大小(字节)", ("tool", "ext"), buckets=SIZE_BUCKETS)
+SWEEP_SECONDS = REGISTRY.histogram(
+    "dify_tool_sweep_seconds", "过期文件清理耗时(秒)")
+SWEEP_DELETED = REGISTRY.counter(
+    "dify_tool_sweep_deleted_files_total", "清理删除的过期文件数")
+SWEEP_FREED = REGISTRY.counter(
+    "dify_tool_sweep_freed_bytes_total", "清理释放的字节数")
+SWEEP_PENDING = REGISTRY.gauge(
+    "dify_tool_sweep_pending_files", "最近一次清理后仍未删除的过期文件数", aggregate="max")
+SWEEP_LAST = REGISTRY.gauge(
+    "dify_tool_sweep_last_timestamp_seconds", "最近一次清理完成的时间", aggregate="max")
+EVICT_DELETED = REGISTRY.counter(
+    "dify_tool_evict_deleted_files_total", "超出容量上限时删除的文件数")
+EVICT_FREED = REGISTRY.counter(
+    "dify_tool_evict_freed_bytes_total", "超出容量上限时释放的字节数")
+STORAGE_READS = REGISTRY.counter(
+    "dify_tool_storage_reads_total", "读取文件时命中的存储层级，tier 为 memory、disk 或 remote", ("tier",))
+
+
+class _SpanExporter:
+    """把结束的 span 缓存在内存中，由写入线程定期追加到文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        with self._lock:
+            self._buffer.append(record)
+
+    def flush(self):
+        if not self.path:
+            return
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+
+_exporter = _SpanExporter(SPAN_EXPORT_FILE)
+atexit.register(_exporter.flush)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "attributes", "status")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time_ns()
+        self.attributes = attributes
+        self.status = "OK"
+
+    def end(self):
+        _exporter.export({
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start,
+            "endTimeUnixNano": time.time_ns(),
+            "attributes": self.attributes,
+            "status": self.status,
+        })
+
+
+@contextmanager
+def span(name, **attributes):
+    """当前上下文中的子 span，没有设置 SPAN_EXPORT_FILE 时什么也不做"""
+    if not _exporter.path:
+        yield None
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = f"ERROR: {type(e).__name__}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+@contextmanager
+def stage(tool, name, **attributes):
+    """记录处理流程中一个阶段的耗时，同时作为一个 span"""
+    start = time.perf_counter()
+    try:
+        with span(name, tool=tool, **attributes):
+            yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, tool=tool, stage=name)
+
+
+def start_request_span(name, **attributes):
+    """请求的根 span，返回值传给 end_request_span；没有设置 SPAN_EXPORT_FILE 时返回 None"""
+    if not _exporter.path:
+        return None
+    current = Span(name, None, attributes)
+    return current, _current_span.set(current)
+
+
+def end_request_span(started, status=None):
+    if started is None:
+        return
+    current, token = started
+    if status is not None:
+        current.attributes["http.status_code"] = status
+        if status >= 500:
+            current.status = "ERROR"
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # 在另一个上下文中结束（例如 Flask 在不同的线程中执行 teardown）
+        pass
+    current.end()
+
+
+def instrument(app, tool, data_dir):
+    """为 Flask 应用记录每个请求的耗时并提供 /metrics"""
+    from flask import Response, g, request
+
+    REGISTRY.configure(data_dir)
+
+    @app.before_request
+    def _start_timer():
+        REGISTRY.ensure_started()
+        g._metrics_start = time.perf_counter()
+        g._metrics_span = start_request_span(f"{request.method} {request.path}", tool=tool)
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, tool=tool, endpoint=endpoint,
+                                    method=request.method, status=response.status_code)
+        end_request_span(g.pop("_metrics_span", None), response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+def track(gauge, read, **labels):
+    """生成快照时用 read() 的返回值更新 gauge，例如任务队列的长度"""
+    REGISTRY.add_collector(lambda: gauge.set(read(), **labels))
@@ -0,0 +1,119 @@
+"""
+共享对象存储
+
+多个副本（容器）各自的 data 目录只作为本地缓存时，生成的文件同时写入共享的对象存储，
+本地没有的文件（其他副本生成的，或者按容量清理掉的）从对象存储下载到本地后返回。
+
+STORAGE_BACKEND_URL 指定对象存储：
+- s3://<bucket>/<前缀>：S3 兼容的存储（AWS S3、MinIO 等），需要安装 boto3；
+  访问密钥和地址使用 boto3 的标准配置，例如 AWS_ACCESS_KEY_ID、AWS_SECRET_ACCESS_KEY、AWS_ENDPOINT_URL
+- file:///<目录>：以目录模拟的对象存储，用于测试，也可以用于多个副本挂载的共享卷
+对象的过期由对象存储自己的生命周期规则处理，重复上传时最多每 STORAGE_REMOTE_TOUCH_SECONDS 秒刷新一次对象，
+保留时间应不短于 FILE_EXPIRY_HOURS 加上这个间隔。
+"""
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # 没有安装 boto3 时不能使用 s3://
+    boto3 = None
+    ClientError = ()
+
+# 下载时每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileBackend:
+    """以目录模拟的对象存储，对象的键就是相对路径"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, path):
+        target = self._path(key)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as dst, open(path, "rb") as src:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key, f):
+        """把对象写入文件对象 f，对象不存在时返回 False"""
+        try:
+            with open(self._path(key), "rb") as src:
+                shutil.copyfileobj(src, f, CHUNK_SIZE)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Backend:
+    """S3 兼容的对象存储"""
+
+    def __init__(self, bucket, prefix="", client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("使用 S3 存储需要安装 boto3")
+            client = boto3.client("s3")
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def put(self, key, path):
+        self.client.upload_file(path, self.bucket, self.prefix + key)
+
+    def get(self, key, f):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return False
+            raise
+        for chunk in iter(lambda: body.read(CHUNK_SIZE), b""):
+            f.write(chunk)
+        return True
+
+    def touch(self, key):
+        """把对象复制到自身，刷新最后修改时间，生命周期规则重新计算过期时间"""
+        key = self.prefix + key
+        try:
+            self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": key},
+                                    MetadataDirective="REPLACE")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+
+
+def open_backend(url):
+    """按 STORAGE_BACKEND_URL 创建对象存储，为空时返回 None"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return FileBackend(parsed.path)
+    if parsed.scheme == "s3":
+        return S3Backend(parsed.netloc, parsed.path)
+    raise ValueError(f"不支持的对象存储地址: {url}")
@@ -0,0 +1,267 @@
+"""
+同步模式下的常驻 Node 进程池
+
+markmap 和 marp 的 render_pool 都基于这里的 ProcessPool，各服务只提供进程的启动命令和任务内容。
+进程通过 stdin/stdout 按行交换 JSON：启动后输出 {"ready": true}，任务 {"id", ...} 对应响应 {"id", ...}
+或 {"id", "error"}，与 common.aio 的异步进程池使用同一套协议。
+
+进程池已禁用、启动失败或进程崩溃时抛出 PoolUnavailable，调用方回退到命令行；
+进程都在忙、等不到空闲进程时抛出 common.ratelimit.Overloaded，调用方返回 503 和 Retry-After，
+不再为每个排队的请求各启动一个命令行进程，让本来就满载的机器更慢。
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+
+from common.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SPAWNS
+from common.ratelimit import Overloaded, estimate_wait
+
+logger = logging.getLogger(__name__)
+
+# 平均任务耗时的指数平均中新样本的权重
+DURATION_SMOOTHING = 0.2
+
+
+class WorkerError(Exception):
+    """进程返回的任务错误，response 为完整的响应"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response or {}
+
+
+class WorkerTimeout(WorkerError):
+    """单个任务超时"""
+
+
+class PoolUnavailable(Exception):
+    """进程池没有在运行（已禁用、启动失败或进程崩溃），调用方应回退到命令行"""
+
+
+class _WorkerDied(Exception):
+    """进程在任务执行期间退出"""
+
+
+class _Worker:
+    """单个 Node 进程，同一时刻只执行一个任务"""
+
+    def __init__(self, command, start_timeout, name):
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self.jobs = 0
+        self._ids = itertools.count(1)
+        self._responses = queue.Queue()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+        try:
+            message = self._next_message(start_timeout)
+        except (queue.Empty, _WorkerDied, ValueError):
+            self.kill()
+            raise PoolUnavailable(f"{name} 进程启动失败")
+        if not message.get("ready"):
+            self.kill()
+            raise PoolUnavailable(f"{name} 进程未就绪")
+
+    def _read_loop(self):
+        for line in self.proc.stdout:
+            self._responses.put(line)
+        self._responses.put(None)
+
+    def _next_message(self, timeout):
+        line = self._responses.get(timeout=timeout)
+        if line is None:
+            raise _WorkerDied()
+        return json.loads(line)
+
+    def request(self, message, timeout):
+        job_id = next(self._ids)
+        try:
+            self.proc.stdin.write(json.dumps(dict(message, id=job_id), ensure_ascii=False) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise _WorkerDied()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty()
+            response = self._next_message(remaining)
+            # 丢弃之前超时任务遗留的响应
+            if response.get("id") == job_id:
+                break
+        self.jobs += 1
+        if "error" in response:
+            raise WorkerError(response["error"], response)
+        return response
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+class ProcessPool:
+    """
+    固定大小的 Node 进程池
+
+    进程在第一次使用时按当前 PID 启动，gunicorn fork 出的每个 worker 各自持有一组进程。
+    崩溃或超时的进程会被杀掉并重新拉起；处理满 max_jobs 个任务的进程会被回收，防止内存膨胀。
+    启动失败后在 retry_interval 秒内直接抛出 PoolUnavailable，由调用方回退到命令行；
+    等待 timeout 秒仍没有空闲进程时抛出 Overloaded，retry_after 按排队的请求数和平均任务耗时估计。
+    """
+
+    def __init__(self, command, size=2, timeout=30, max_jobs=500, start_timeout=30, retry_interval=60, name="node"):
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.start_timeout = start_timeout
+        self.retry_interval = retry_interval
+        self.name = name
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._workers = 0
+        self._disabled_until = 0
+        # 等待空闲进程的请求数和任务耗时的指数平均，用来估计 Overloaded 的 retry_after
+        self._waiting = 0
+        self._average = 1.0
+        self._stats_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _spawn(self):
+        SUBPROCESS_SPAWNS.inc(tool=self.name, kind="pool")
+        try:
+            return _Worker(self.command, self.start_timeout, self.name)
+        except (OSError, PoolUnavailable):
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="start")
+            raise
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._workers > 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._workers > 0:
+                return
+            if self.size <= 0:
+                raise PoolUnavailable(f"{self.name} 进程池已禁用")
+            if time.time() < self._disabled_until:
+                raise PoolUnavailable(f"{self.name} 进程池暂不可用")
+
+            # fork 之后继承来的进程不属于当前 worker，直接丢弃
+            self._idle = queue.Queue()
+            self._workers = 0
+            try:
+                for _ in range(self.size):
+                    self._idle.put(self._spawn())
+                    self._workers += 1
+            except (OSError, PoolUnavailable) as e:
+                logger.warning(f"{self.name} 进程池启动失败，{self.retry_interval} 秒内回退到命令行: {e}")
+                self._disabled_until = time.time() + self.retry_interval
+                self._close_idle()
+                raise PoolUnavailable(str(e))
+            self._pid = os.getpid()
+            logger.info(f"{self.name} 进程池已启动，进程数 {self.size}")
+
+    def _replace(self, worker):
+        """杀掉出问题的进程，并尽量补充一个新进程"""
+        worker.kill()
+        try:
+            self._idle.put(self._spawn())
+        except (OSError, PoolUnavailable) as e:
+            with self._lock:
+                self._workers -= 1
+                if self._workers <= 0:
+                    self._disabled_until = time.time() + self.retry_interval
+            logger.error(f"无法重启 {self.name} 进程: {e}")
+
+    def request(self, message):
+        """
+        提交任务并返回响应，任务出错时抛出 WorkerError，超时抛出 WorkerTimeout
+
+        进程池没有在运行时抛出 PoolUnavailable，所有进程都在忙时抛出 Overloaded。
+        """
+        self._ensure_started()
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._stats_lock:
+                retry_after = estimate_wait(self._waiting, self.size, self._average)
+            raise Overloaded(f"{self.name} 渲染进程繁忙，请稍后重试", retry_after)
+        finally:
+            with self._stats_lock:
+                self._waiting -= 1
+
+        start = time.monotonic()
+        try:
+            return self._run(worker, message)
+        finally:
+            duration = time.monotonic() - start
+            with self._stats_lock:
+                self._average += DURATION_SMOOTHING * (duration - self._average)
+
+    def _run(self, worker, message):
+        if not worker.alive():
+            self._replace(worker)
+            raise PoolUnavailable(f"{self.name} 进程已退出")
+
+        try:
+            response = worker.request(message, self.timeout)
+        except WorkerError:
+            self._release(worker)
+            raise
+        except queue.Empty:
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="timeout")
+            logger.error(f"{self.name} 任务超时({self.timeout} 秒)，重启进程")
+            self._replace(worker)
+            raise WorkerTimeout(f"任务超过 {self.timeout} 秒未完成")
+        except (_WorkerDied, ValueError):
+            SUBPROCESS_FAILURES.inc(tool=self.name, kind="pool", reason="crash")
+            logger.error(f"{self.name} 进程异常退出，重启进程")
+            self._replace(worker)
+            raise PoolUnavailable(f"{self.name} 进程异常退出")
+
+        self._release(worker)
+        return response
+
+    def _release(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+
+    def _close_idle(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+    def close(self):
+        """结束当前进程持有的所有进程"""
+        if self._pid == os.getpid():
+            self._close_idle()
+            self._workers = 0
@@ -0,0 +1,251 @@
+"""
+按租户限流和按渲染能力准入
+
+TokenBuckets：每个租户一个令牌桶，状态保存在数据目录下的 SQLite 中，gunicorn 的所有 worker 共用同一组计数，
+实际限额不会随 worker 数增加。请求都经过 Dify 的代理转发，远端地址对所有用户相同，
+租户优先按客户端凭证（Dify 工具配置的 API Key）识别；租户标识头由客户端随意填写，换一个值就能得到新的令牌桶，
+只在来自受信任代理（例如 Dify 或网关）的请求中采用。都没有时才退回到远端地址。
+
+Capacity：进程内渲染槽位的占用情况。渲染进程池每个 worker 各有一组，准入按进程判断；
+槽位和排队名额都用完时立即拒绝，不让请求在线程里等到超时。
+
+两者拒绝时都给出建议的重试等待时间，由调用方放到 Retry-After 响应头中。
+"""
+import hashlib
+import ipaddress
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+
+logger = logging.getLogger(__name__)
+
+# 识别租户的请求头，按顺序取第一个存在的：先取客户端凭证，再取只信任代理设置的租户标识头
+TENANT_HEADERS = [h.strip() for h in os.environ.get("TENANT_HEADERS", "Authorization").split(",") if h.strip()]
+PROXY_TENANT_HEADERS = [h.strip() for h in os.environ.get("PROXY_TENANT_HEADERS", "X-Tenant-Id,X-Dify-App-Id").split(",") if h.strip()]
+# 可以设置租户标识头的代理地址，逗号分隔的 IP 或网段，为空时不采用租户标识头
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False) for p in os.environ.get("TRUSTED_PROXIES", "").split(",") if p.strip()]
+# Retry-After 的上下限(秒)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+def tenant_key(headers, remote_addr=None):
+    """
+    请求所属的租户
+
+    请求头的值（可能是 API Key）只保存哈希，不写入数据库和日志。
+    """
+    return header_tenant(headers, remote_addr) or f"addr:{remote_addr or 'unknown'}"
+
+
+def header_tenant(headers, remote_addr=None):
+    """按请求头识别的租户，没有可以采用的请求头时返回 None"""
+    names = TENANT_HEADERS + PROXY_TENANT_HEADERS if _trusted_proxy(remote_addr) else TENANT_HEADERS
+    for name in names:
+        value = headers.get(name)
+        if value:
+            return f"{name.lower()}:{hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]}"
+    return None
+
+
+def _trusted_proxy(remote_addr):
+    if not TRUSTED_PROXIES or not remote_addr:
+        return False
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def retry_after_seconds(seconds):
+    """建议的等待时间取整到 Retry-After 允许的整数秒"""
+    return str(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(seconds))))
+
+
+def estimate_wait(backlog, slots, average):
+    """backlog 个请求排在 slots 个槽位前面、每个平均耗时 average 秒时，新请求大约要等多久"""
+    return (backlog + 1) * average / max(slots, 1)
+
+
+class RateLimited(Exception):
+    """租户的令牌已用完"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """
+    多进程共享的令牌桶
+
+    每个租户每分钟补充 per_minute 个令牌，最多积累 burst 个；per_minute 为 0 时不限流。
+    同一个数据目录可以被多个服务使用（例如网关），scope 区分各服务的计数。
+    数据库出错时放行请求并记录日志，限流不可用不影响正常服务。
+    """
+
+    DB_NAME = ".ratelimit.sqlite3"
+    # 每处理多少个请求清理一次已经回满的令牌桶
+    PRUNE_EVERY = 500
+
+    def __init__(self, root, scope, per_minute, burst=None, timeout=5):
+        self.scope = scope
+        self.rate = per_minute / 60
+        self.burst = burst or per_minute
+        self.timeout = timeout
+        self.path = os.path.join(root, self.DB_NAME)
+        self._local = threading.local()
+        self._calls = 0
+        if self.rate > 0:
+            os.makedirs(root, exist_ok=True)
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 出来的子进程不能复用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def acquire(self, tenant, cost=1, now=None):
+        """扣减 cost 个令牌，成功返回 0，令牌不足时不扣减并返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        # 超过桶容量的请求按装满一桶计算，否则永远无法通过
+        cost = min(cost, self.burst)
+        now = time.time() if now is None else now
+        key = f"{self.scope}:{tenant}"
+        try:
+            conn = self._connection()
+            # IMMEDIATE 事务在读之前拿到写锁，多个 worker 不会读到同一个旧值
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+                wait = 0 if tokens >= cost else (cost - tokens) / self.rate
+                if not wait:
+                    tokens -= cost
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    (key, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"限流计数不可用，放行请求: {e}")
+            return 0
+
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        return wait
+
+    def check(self, tenant, cost=1):
+        """令牌不足时抛出 RateLimited"""
+        wait = self.acquire(tenant, cost)
+        if wait:
+            raise RateLimited(f"请求过于频繁，请 {math.ceil(wait)} 秒后重试", wait)
+
+    def _prune(self, now):
+        """删除已经回满的令牌桶，它们与不存在的桶等价"""
+        try:
+            self._connection().execute(
+                "DELETE FROM buckets WHERE key LIKE ? AND updated_at < ?",
+                (f"{self.scope}:%", now - self.burst / self.rate),
+            )
+        except sqlite3.Error as e:
+            logger.error(f"清理限流计数时出错: {e}")
+
+
+def limit(buckets, reject):
+    """
+    Flask 视图装饰器：按请求的租户扣减令牌
+
+    buckets 可以是多组令牌桶（例如每分钟、每小时和每天的限额），依次检查。
+    令牌不足时返回 reject(error) 的结果，并加上 Retry-After 响应头。
+    """
+    groups = buckets if isinstance(buckets, (list, tuple)) else [buckets]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tenant = tenant_key(request.headers, request.remote_addr)
+            try:
+                for group in groups:
+                    group.check(tenant)
+            except RateLimited as e:
+                response = current_app.make_response(reject(e))
+                response.headers["Retry-After"] = retry_after_seconds(e.retry_after)
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Overloaded(Exception):
+    """渲染槽位和排队名额都已用完"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Capacity:
+    """
+    进程内的渲染能力
+
+    slots 个请求可以同时渲染，另外最多 max_pending 个请求排队等待；max_pending 为 None 时不限制。
+    记录最近渲染耗时的指数平均值，用来估计被拒绝的请求需要等待多久。
+    """
+
+    # 指数平均中新样本的权重
+    SMOOTHING = 0.2
+
+    def __init__(self, slots, max_pending=None, name="render", initial_duration=5.0):
+        self.slots = slots
+        self.max_pending = max_pending
+        self.name = name
+        self.average = initial_duration
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return estimate_wait(max(0, self.active - self.slots), self.slots, self.average)
+
+    @contextmanager
+    def admit(self):
+        """占用一个槽位，没有可用的槽位和排队名额时抛出 Overloaded"""
+        with self._lock:
+            if self.max_pending is not None and self.active >= self.slots + self.max_pending:
+                raise Overloaded(f"{self.name} 繁忙，请稍后重试", self.retry_after())
+            self.active += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            with self._lock:
+                self.active -= 1
+                self.average += self.SMOOTHING * (duration - self.average)
+
+    def stats(self):
+        return {"slots": self.slots, "active": self.active, "max_pending": self.max_pending,
+                "average_seconds": round(self.average, 3)}
@@ -0,0 +1,106 @@
+"""
+按内容哈希命名的文件的 HTTP 缓存
+
+文件写入后不会再改变，ETag 直接使用文件名（内容哈希 + 扩展名），不需要读取文件计算；
+响应带 Cache-Control: immutable，浏览器在有效期内不会再次请求，If-None-Match 命中时返回 304，不打开文件。
+ContentStore 写入时生成的 .br/.gz 压缩版本按 Accept-Encoding 直接返回，不在请求时压缩。
+
+不超过 STORAGE_MEMORY_MAX_ITEM 的文件从进程内的 hot_tier 返回，不打开文件；更大的文件交给 send_file，
+gunicorn 通过 wsgi.file_wrapper 用 sendfile 把文件从页缓存直接发送到 socket，内容不经过 Python。
+"""
+import io
+import mimetypes
+import os
+
+from flask import current_app, request, send_file
+
+from common.metrics import STORAGE_READS
+from common.storage import ENCODINGS, HASH_NAME_RE, PRECOMPRESS_EXTS, hot_tier
+
+# 浏览器缓存时间(秒)，文件内容不会变化，过期后服务端已删除的文件会得到404
+MAX_AGE = 365 * 24 * 3600
+
+
+def _cache_headers(response, etag, max_age, vary):
+    response.set_etag(etag)
+    # send_file 在没有指定 max_age 时会加上 no-cache
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    if vary:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def _send(path, mimetype, as_attachment, download_name):
+    """返回内容哈希命名的文件，小文件使用内存缓存，文件不存在时抛出 FileNotFoundError"""
+    body = hot_tier.get(path)
+    if body is None:
+        body = hot_tier.load(path)
+        if body is None:
+            response = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                                 download_name=download_name, conditional=True, etag=False)
+            STORAGE_READS.inc(tier="disk")
+            return response
+        STORAGE_READS.inc(tier="disk")
+    else:
+        STORAGE_READS.inc(tier="memory")
+    if as_attachment:
+        # 由 send_file 生成 Content-Disposition（包括非 ASCII 文件名的编码）
+        return send_file(io.BytesIO(body), mimetype=mimetype, as_attachment=True,
+                         download_name=download_name, conditional=True, etag=False)
+    response = current_app.response_class(body, mimetype=mimetype)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=len(body))
+
+
+def send_artifact(path, mimetype=None, as_attachment=False, download_name=None, max_age=MAX_AGE):
+    """
+    返回文件响应，文件不存在时返回 None
+
+    path 不是内容哈希文件名（旧版本按原文件名保存的文件）时内容可能变化，只使用 Werkzeug 默认的 ETag，不设置长期缓存。
+    """
+    name = os.path.basename(path)
+    match = HASH_NAME_RE.match(name)
+    if not match:
+        try:
+            return send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                             download_name=download_name, conditional=True)
+        except FileNotFoundError:
+            return None
+
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    vary = match.group(2) in PRECOMPRESS_EXTS
+    # 客户端接受的压缩版本，最后是原文件；每种版本有各自的 ETag
+    candidates = [(None, "")]
+    if vary:
+        candidates[:0] = [(encoding, suffix) for encoding, suffix in ENCODINGS
+                          if request.accept_encodings[encoding]]
+
+    for encoding, suffix in candidates:
+        etag = name + suffix
+        if etag in request.if_none_match:
+            return _cache_headers(current_app.response_class(status=304), etag, max_age, vary)
+
+    for encoding, suffix in candidates:
+        try:
+            response = _send(path + suffix, mimetype, as_attachment, download_name or name)
+        except FileNotFoundError:
+            # 压缩版本不存在时尝试下一个，原文件不存在时返回 None
+            continue
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return _cache_headers(response, name + suffix, max_age, vary)
+    return None
+
+
+def send_variant(body, etag, mimetype="text/html", max_age=MAX_AGE):
+    """
+    返回由内容确定的动态生成的响应
+
+    etag 必须唯一确定响应内容（例如内容哈希加上生成参数），If-None-Match 命中时返回 304。
+    """
+    if etag in request.if_none_match:
+        return _cache_headers(current_app.response_class(status=304), etag, max_age, False)
+    return _cache_headers(current_app.response_class(body, mimetype=mimetype), etag, max_age, False)
@@ -0,0 +1,418 @@
+"""
+按内容哈希存储的文件仓库
+
+文件保存在 <root>/ab/cd/<sha256><扩展名>，两级目录分散文件，避免单个目录过大。
+写入先写临时文件再 rename，并发写入同一内容不会产生半截文件；相同内容只保存一份。
+可以为文件设置别名（例如用户指定的文件名），别名保存在 <root>/aliases/ 下，指向同一个文件。
+传入 ExpiryIndex 时，每次写入或刷新文件都会登记新的过期时间。
+写入的字节数按 tool（服务名称）和扩展名记入指标。
+HTML、SVG 等文本文件写入时同时生成 .gz（以及安装了 Brotli 时的 .br）压缩版本，由 common.static 按需返回。
+
+文件分三层保存：
+- 内存：每个进程在 hot_tier 中按最近使用缓存刚写入或读取过的小文件，返回时不需要打开文件
+- 本地目录：ExpiryIndex 设置了容量上限时，超出上限按最近读取时间删除
+- 对象存储（可选，见 common.objectstore）：写入时同时上传，本地没有的文件在 exists/resolve 时下载到本地，
+  多个副本共用同一个对象存储时，任何一个副本生成的文件都可以从其他副本下载。
+  重复上传时本地文件每次都刷新过期时间，对象存储中的文件（S3 需要把对象复制到自身）每 STORAGE_REMOTE_TOUCH_SECONDS 秒最多刷新一次
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from common.metrics import ARTIFACT_BYTES, ARTIFACT_SIZE, STORAGE_READS
+
+try:
+    import brotli
+except ImportError:  # 没有安装 Brotli 时只生成 gzip
+    brotli = None
+
+HASH_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.[\w.\-]+)$")
+SAFE_NAME_RE = re.compile(r"^[\w\-][\w\-.]*$")
+
+# 写入时预先压缩的扩展名
+PRECOMPRESS_EXTS = (".html", ".svg")
+# 小于这个大小的文件压缩收益不大
+PRECOMPRESS_MIN_SIZE = 1024
+# Content-Encoding 与压缩文件后缀，按优先级排列
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+STORAGE_MEMORY_BYTES = int(os.environ.get("STORAGE_MEMORY_BYTES", str(64 * 1024 * 1024)))  # 每个进程在内存中缓存的文件总大小(字节)，0表示不缓存
+STORAGE_MEMORY_MAX_ITEM = int(os.environ.get("STORAGE_MEMORY_MAX_ITEM", str(256 * 1024)))  # 内存中缓存的单个文件大小上限(字节)，更大的文件用 sendfile 从磁盘发送
+# 内存中的文件每隔这么多秒确认一次磁盘上仍然存在，过期或按容量删除之后不再返回
+MEMORY_RECHECK_SECONDS = 60
+STORAGE_REMOTE_TOUCH_SECONDS = int(os.environ.get("STORAGE_REMOTE_TOUCH_SECONDS", "3600"))  # 同一个文件在这么多秒内只刷新一次对象存储中的修改时间，0表示每次都刷新
+# 每个进程记录最近刷新时间的对象数上限
+REMOTE_TOUCH_MAX_ENTRIES = 100000
+
+logger = logging.getLogger(__name__)
+
+
+def hash_content(data):
+    """计算内容的 SHA-256 哈希值"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class MemoryTier:
+    """
+    进程内的文件缓存，按路径保存文件内容，超出 max_bytes 时淘汰最久未使用的
+
+    只用于内容哈希命名的文件，内容写入后不会变化，不需要检查修改时间。
+    """
+
+    def __init__(self, max_bytes, max_item):
+        self.max_bytes = max_bytes
+        self.max_item = min(max_item, max_bytes)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, path, data):
+        if len(data) > self.max_item:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[path] = [data, time.monotonic()]
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, path):
+        """返回缓存的内容，没有缓存或文件已被删除时返回 None"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+        if time.monotonic() - entry[1] > MEMORY_RECHECK_SECONDS:
+            if not os.path.isfile(path):
+                self.discard(path)
+                return None
+            entry[1] = time.monotonic()
+        return entry[0]
+
+    def load(self, path):
+        """读取文件并缓存，文件太大或没有启用缓存时返回 None，文件不存在时抛出 FileNotFoundError"""
+        if not self.max_item:
+            return None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > self.max_item:
+                return None
+            data = f.read()
+        self.put(path, data)
+        return data
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._size -= len(entry[0])
+
+    def stats(self):
+        return {"files": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+# 当前进程的内存缓存，网关中所有服务共用
+hot_tier = MemoryTier(STORAGE_MEMORY_BYTES, STORAGE_MEMORY_MAX_ITEM)
+
+
+class ContentStore:
+    """按内容哈希存储文件"""
+
+    ALIAS_DIR = "aliases"
+
+    def __init__(self, root, index=None, tool="", backend=None):
+        self.root = root
+        self.index = index
+        self.tool = tool
+        self.backend = backend
+        # 对象存储中的键 -> 最近一次上传或刷新的时间
+        self._remote_touched = OrderedDict()
+        self._remote_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _written(self, ext, size):
+        ARTIFACT_BYTES.inc(size, tool=self.tool, ext=ext)
+        ARTIFACT_SIZE.observe(size, tool=self.tool, ext=ext)
+
+    def _track(self, path):
+        if self.index is not None:
+            self.index.track(path)
+
+    def _key(self, path):
+        """文件在对象存储中的键：服务名称/相对路径，网关中多个服务可以共用一个对象存储"""
+        relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+        return f"{self.tool}/{relpath}" if self.tool else relpath
+
+    def _stored(self, path, data=None):
+        """新写入的文件：登记过期时间，上传到对象存储，小文件放入内存缓存"""
+        self._track(path)
+        if data is not None:
+            hot_tier.put(path, data)
+        if self.backend is not None:
+            try:
+                self.backend.put(self._key(path), path)
+                self._remote_touch_due(self._key(path))
+            except Exception as e:
+                # 本地文件仍然可用，只是其他副本读不到
+                logger.error(f"无法上传文件到对象存储 {path}: {e}")
+
+    def _remote_touch_due(self, key):
+        """对象在 STORAGE_REMOTE_TOUCH_SECONDS 秒内没有上传或刷新过时返回 True，并记为已刷新"""
+        now = time.monotonic()
+        with self._remote_lock:
+            last = self._remote_touched.get(key)
+            if last is not None and now - last < STORAGE_REMOTE_TOUCH_SECONDS:
+                return False
+            self._remote_touched[key] = now
+            self._remote_touched.move_to_end(key)
+            while len(self._remote_touched) > REMOTE_TOUCH_MAX_ENTRIES:
+                self._remote_touched.popitem(last=False)
+        return True
+
+    def _accessed(self, path, ext):
+        if self.index is not None:
+            self.index.accessed(path)
+            if ext in PRECOMPRESS_EXTS:
+                for _, suffix in ENCODINGS:
+                    self.index.accessed(path + suffix)
+
+    def _download(self, path):
+        """从对象存储下载文件到本地，对象不存在或下载失败时返回 False"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        found = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                found = self.backend.get(self._key(path), f)
+            if found:
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"无法从对象存储下载文件 {path}: {e}")
+            found = False
+        finally:
+            if not found:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        if found:
+            self._track(path)
+        return found
+
+    def _fetch(self, digest, ext):
+        """本地没有的文件连同压缩版本从对象存储下载，返回是否下载成功"""
+        path = self.path(digest, ext)
+        if not self._download(path):
+            return False
+        STORAGE_READS.inc(tier="remote")
+        if ext in PRECOMPRESS_EXTS:
+            for _, suffix in ENCODINGS:
+                self._download(path + suffix)
+        return True
+
+    @staticmethod
+    def name(digest, ext):
+        """文件对外使用的名称"""
+        return f"{digest}{ext}"
+
+    def path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], self.name(digest, ext))
+
+    def relpath(self, digest, ext):
+        """相对于仓库根目录的路径（使用 / 分隔，可直接拼接到URL中）"""
+        return f"{digest[:2]}/{digest[2:4]}/{self.name(digest, ext)}"
+
+    def exists(self, digest, ext):
+        """文件是否存在，本地没有时从对象存储下载"""
+        path = self.path(digest, ext)
+        if os.path.isfile(path):
+            self._accessed(path, ext)
+            return True
+        return self.backend is not None and self._fetch(digest, ext)
+
+    def touch(self, digest, ext):
+        """刷新文件修改时间，重复上传的内容重新计算过期时间"""
+        path = self.path(digest, ext)
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        self._track(path)
+        paths = [path]
+        if ext in PRECOMPRESS_EXTS:
+            # 压缩版本与原文件同时过期
+            for _, suffix in ENCODINGS:
+                try:
+                    os.utime(path + suffix)
+                except OSError:
+                    continue
+                self._track(path + suffix)
+                paths.append(path + suffix)
+        if self.backend is not None:
+            try:
+                for touched in paths:
+                    key = self._key(touched)
+                    if self._remote_touch_due(key):
+                        self.backend.touch(key)
+            except Exception as e:
+                logger.error(f"无法刷新对象存储中的文件 {path}: {e}")
+        return True
+
+    def _atomic_write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp 创建的文件只有属主可读，其他容器（如 marp）需要读取
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def write(self, digest, ext, data):
+        """保存内容，文件已存在时只刷新修改时间，返回文件路径"""
+        path = self.path(digest, ext)
+        if self.touch(digest, ext):
+            return path
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._atomic_write(path, data)
+        self._stored(path, data)
+        self._written(ext, len(data))
+        if ext in PRECOMPRESS_EXTS:
+            self._precompress(path, data)
+        return path
+
+    def write_file(self, digest, ext, src_path):
+        """把渲染器生成的文件移动到仓库中，返回文件路径"""
+        path = self.path(digest, ext)
+        if self.touch(digest, ext):
+            os.remove(src_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        self._stored(path)
+        self._written(ext, os.path.getsize(path))
+        if ext in PRECOMPRESS_EXTS:
+            with open(path, "rb") as f:
+                self._precompress(path, f.read())
+        return path
+
+    def _precompress(self, path, data):
+        """生成压缩版本，压缩后没有变小的不保存"""
+        if len(data) < PRECOMPRESS_MIN_SIZE:
+            return
+        for encoding, suffix in ENCODINGS:
+            if encoding == "br":
+                if brotli is None:
+                    continue
+                compressed = brotli.compress(data, mode=brotli.MODE_TEXT)
+            else:
+                # mtime 固定为 0，相同内容生成相同的压缩文件
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                self._atomic_write(path + suffix, compressed)
+                self._stored(path + suffix, compressed)
+                self._written(os.path.splitext(path)[1] + suffix, len(compressed))
+
+    def put(self, data, ext):
+        """按内容本身的哈希保存，返回哈希值"""
+        digest = hash_content(data)
+        self.write(digest, ext, data)
+        return digest
+
+    def tempdir(self):
+        """在仓库所在文件系统上创建临时目录，保证 write_file 可以直接 rename"""
+        return tempfile.TemporaryDirectory(dir=self.root, prefix=".tmp-")
+
+    def _alias_path(self, alias):
+        bucket = hashlib.sha256(alias.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.root, self.ALIAS_DIR, bucket, alias)
+
+    def alias(self, alias, digest, ext):
+        """为文件设置别名，别名已存在时指向新文件"""
+        if not SAFE_NAME_RE.match(alias):
+            raise ValueError(f"非法的文件名: {alias}")
+        alias_path = self._alias_path(alias)
+        self._atomic_write(alias_path, self.name(digest, ext).encode("utf-8"))
+        self._stored(alias_path)
+
+    def _read_alias(self, alias):
+        alias_path = self._alias_path(alias)
+        try:
+            with open(alias_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            pass
+        if self.backend is None or not self._download(alias_path):
+            return None
+        with open(alias_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def lookup(self, name):
+        """把内容哈希文件名或别名解析为 (内容哈希, 扩展名)，不检查文件是否存在，无法解析时返回 None"""
+        if not SAFE_NAME_RE.match(name):
+            return None
+        match = HASH_NAME_RE.match(name)
+        if not match:
+            target = self._read_alias(name)
+            match = HASH_NAME_RE.match(target) if target else None
+        return (match.group(1), match.group(2)) if match else None
+
+    def resolve(self, name, check=True):
+        """
+        把对外的文件名解析为实际路径，文件不存在时返回 None
+
+        依次尝试：内容哈希文件名、别名、旧版本直接保存在根目录下的文件。
+        check 为 False 时内容哈希文件名不检查文件是否存在，由调用方打开文件时处理，省去一次 stat；
+        使用对象存储时总是检查，本地没有时下载。
+        """
+        if not SAFE_NAME_RE.match(name):
+            return None
+
+        match = HASH_NAME_RE.match(name)
+        if match:
+            if check or self.backend is not None:
+                return self.path(*match.groups()) if self.exists(*match.groups()) else None
+            path = self.path(*match.groups())
+            self._accessed(path, match.group(2))
+            return path
+
+        target = self.lookup(name)
+        if target and self.exists(*target):
+            return self.path(*target)
+
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    def iter_files(self):
+        """遍历仓库中的所有文件（跳过隐藏文件和目录），返回 (路径, 修改时间)"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    yield path, os.path.getmtime(path)
+                except OSError:
+                    continue
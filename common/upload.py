@@ -0,0 +1,185 @@
+"""
+流式接收上传内容
+
+按块读取请求体并直接写入数据目录下的临时文件，同时计算 SHA-256、增量校验 UTF-8，
+整个请求体不会在内存中保存多份。Content-Length 超过上限的请求在读取之前就被拒绝，
+分块传输等没有 Content-Length 的请求在读到超过上限时立即停止。
+"""
+import codecs
+import hashlib
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """上传内容不合法，status 为对应的 HTTP 状态码"""
+
+    status = 400
+
+
+class UploadTooLarge(UploadError):
+    """请求体超过大小上限"""
+
+    status = 413
+
+
+class InvalidEncoding(UploadError):
+    """请求体不是合法的 UTF-8"""
+
+
+class Upload:
+    """
+    已经写入临时文件的上传内容
+
+    digest 与对全部内容调用 hash_content 的结果相同。保存到 ContentStore 时直接 rename，不再复制；
+    没有保存的临时文件在离开 with 语句时删除。
+    """
+
+    def __init__(self, path, digest, size, blank):
+        self.path = path
+        self.digest = digest
+        self.size = size
+        # 内容为空或只有空白字符
+        self.blank = blank
+
+    def read_text(self):
+        # 保留原始换行符，与 request.get_data(as_text=True) 的结果一致
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def contains(self, needle):
+        """按块在内容中查找字节串，不把整个文件读入内存"""
+        overlap = len(needle) - 1
+        tail = b""
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return False
+                if needle in tail + chunk:
+                    return True
+                tail = chunk[-overlap:] if overlap else b""
+
+    def wrap(self, prefix, suffix):
+        """在内容前后加上 prefix 和 suffix，返回新的 Upload，原临时文件被删除"""
+        hasher = hashlib.sha256(prefix)
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out, open(self.path, "rb") as f:
+                out.write(prefix)
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    out.write(chunk)
+                out.write(suffix)
+            hasher.update(suffix)
+            shutil.copymode(self.path, path)
+        except BaseException:
+            _remove(path)
+            raise
+        self.discard()
+        return Upload(path, hasher.hexdigest(), self.size + len(prefix) + len(suffix), self.blank)
+
+    def save(self, store, ext):
+        """移动到 ContentStore 中（相同内容已存在时只刷新过期时间），返回文件路径"""
+        return store.write_file(self.digest, ext, self.path)
+
+    def discard(self):
+        _remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def receive_request(request, directory, max_bytes=None):
+    """接收 Flask 请求的请求体，Content-Length 超过上限时不读取直接拒绝"""
+    if max_bytes is not None and request.content_length is not None and request.content_length > max_bytes:
+        raise UploadTooLarge(f"请求体超过 {max_bytes} 字节")
+    return receive(request.stream, directory, max_bytes)
+
+
+def receive(stream, directory, max_bytes=None):
+    """
+    把 stream 中的内容写入 directory 下的临时文件并返回 Upload
+
+    超过 max_bytes 时抛出 UploadTooLarge，不是合法 UTF-8 时抛出 InvalidEncoding。
+    directory 应与 ContentStore 位于同一文件系统，保存时才能直接 rename。
+    """
+    writer = _Writer(directory, max_bytes)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.feed(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+async def receive_async(chunks, directory, max_bytes=None):
+    """receive 的协程版本，chunks 为请求体分块的异步迭代器（例如 ASGI 的 http.request 消息）"""
+    writer = _Writer(directory, max_bytes)
+    try:
+        async for chunk in chunks:
+            writer.feed(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class _Writer:
+    """边写临时文件边计算哈希和校验 UTF-8"""
+
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.hasher = hashlib.sha256()
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.size = 0
+        self.blank = True
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        self.file = os.fdopen(fd, "wb")
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(f"请求体超过 {self.max_bytes} 字节")
+        try:
+            text = self.decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise InvalidEncoding("请求体不是合法的 UTF-8 文本")
+        if self.blank and text.strip():
+            self.blank = False
+        self.hasher.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        self.file.close()
+        try:
+            self.decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise InvalidEncoding("请求体不是合法的 UTF-8 文本")
+        # mkstemp 创建的文件只有属主可读，其他容器（如 marp）需要读取
+        os.chmod(self.path, 0o644)
+        return Upload(self.path, self.hasher.hexdigest(), self.size, self.blank)
+
+    def abort(self):
+        self.file.close()
+        _remove(self.path)
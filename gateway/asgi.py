@@ -0,0 +1,369 @@
+"""
+网关的 ASGI 入口
+
+同步模式下每个等待渲染结果的请求占用一个 gunicorn 线程，mermaid 和 marp 的请求大部分时间都在等待
+Chromium 渲染。ASGI 模式下这两类请求在事件循环中处理：请求体以异步方式写入临时文件，
+mermaid 通过异步 Unix socket 连接常驻渲染服务，marp 通过 asyncio 管理的常驻转换进程导出，
+等待期间不占用线程，一个 worker 可以同时挂起成百上千个请求。
+
+其他请求（markmap、quiz、文件下载、任务查询等）仍由原来的 Flask 应用在线程池中处理：
+markmap 的大多数导图由进程内模板直接生成，不需要等待 Node；quiz 的渲染是纯 CPU 计算，放进事件循环没有收益。
+
+启动方式：
+    uvicorn asgi:app --port 5000
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import Headers
+
+from main import ROOT_DIR, SERVICES, app as wsgi_app
+
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, ROOT_DIR)
+from common.aio import AsyncProcessPool, PoolUnavailable, WorkerError
+from common.metrics import (CACHE_REQUESTS, REGISTRY, RENDER_SECONDS, REQUEST_SECONDS, end_request_span,
+                            stage, start_request_span)
+from common.ratelimit import Overloaded, RateLimited, retry_after_seconds, tenant_key
+from common.storage import HASH_NAME_RE
+from common.upload import receive_async, UploadError
+
+logger = logging.getLogger(__name__)
+
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "8"))  # 处理同步请求（markmap、quiz、文件下载等）的线程数
+
+
+class ClientDisconnected(Exception):
+    """客户端在请求体传输完成前断开"""
+
+
+async def request_body(receive):
+    """按 http.request 消息逐块返回请求体"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        if chunk:
+            yield chunk
+        if not message.get("more_body"):
+            break
+
+
+async def send_text(send, text, status=200, headers=None):
+    """与 Flask 返回字符串时相同的文本响应"""
+    body = text.encode("utf-8")
+    response_headers = [
+        (b"content-type", b"text/html; charset=utf-8"),
+        (b"content-length", str(len(body)).encode("ascii")),
+    ]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def check_rate_limit(module, scope):
+    """与同步接口相同的按租户限流，令牌不足时抛出 RateLimited"""
+    headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+    client = scope.get("client")
+    await asyncio.to_thread(module.rate_limits.check, tenant_key(headers, client[0] if client else None))
+
+
+async def send_retry_later(send, e, status):
+    await send_text(send, str(e), status, {'Retry-After': retry_after_seconds(e.retry_after)})
+
+
+def read_text(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+class MermaidHandler:
+    """mermaid 上传接口的异步实现，与同步接口返回相同的内容"""
+
+    def __init__(self, module):
+        self.m = module
+
+    def match(self, method, path):
+        """返回 (路由规则, 处理函数)，路由规则与同步接口相同，用作指标的 endpoint 标签"""
+        if method == "POST" and path == "/upload":
+            return "/upload", self.upload
+        return None
+
+    async def upload(self, scope, receive, send):
+        m = self.m
+        try:
+            await check_rate_limit(m, scope)
+            with stage("mermaid", "receive"):
+                upload = await receive_async(request_body(receive), m.DATA_DIR, m.MAX_UPLOAD_BYTES)
+            with upload:
+                content_hash = await asyncio.to_thread(m.save_diagram, upload)
+        except RateLimited as e:
+            return await send_retry_later(send, e, 429)
+        except UploadError as e:
+            return await send_text(send, str(e), e.status)
+        except m.LintError as e:
+            return await send_text(send, str(e), 400)
+
+        try:
+            result = await self.render(content_hash)
+        except m.LintError as e:
+            return await send_text(send, str(e), 400)
+        except m.RendererBusy:
+            return await send_text(send, '渲染服务繁忙，请稍后重试', 503, {'Retry-After': '5'})
+        except m.QueueFull as e:
+            return await send_text(send, '服务繁忙，请稍后重试', 429, {'Retry-After': retry_after_seconds(e.retry_after)})
+        except m.JobTimeout:
+            return await send_text(send, 'Mermaid 图表生成超时', 504)
+        except m.DiagramFailed as e:
+            return await send_text(send, str(e), 500)
+        await send_text(send, f'Markdown 文件已保存\n预览链接: {result["url"]}')
+
+    async def render(self, content_hash):
+        m = self.m
+        # 文件读写和对象存储请求在线程中执行，不阻塞事件循环
+        if await asyncio.to_thread(m.store.exists, content_hash, '.svg'):
+            CACHE_REQUESTS.inc(tool="mermaid", result="hit")
+            return m.diagram_result(content_hash)
+        if m.renderer is not None:
+            match = m.MERMAID_BLOCK_RE.search(await asyncio.to_thread(read_text, m.store.path(content_hash, '.md')))
+            if match:
+                start = time.perf_counter()
+                try:
+                    with stage("mermaid", "render"):
+                        svg = await m.renderer.render_async(match.group(1), 'svg')
+                except m.RenderSyntaxError as e:
+                    CACHE_REQUESTS.inc(tool="mermaid", result="miss")
+                    logger.warning(f"Mermaid 图表语法错误: {e}")
+                    raise m.render_failed(content_hash, m.syntax_error(str(e), strict=False))
+                except m.RenderError as e:
+                    CACHE_REQUESTS.inc(tool="mermaid", result="miss")
+                    logger.warning(f"Mermaid 图表渲染失败: {e}")
+                    raise m.DiagramFailed('Mermaid 图表生成失败')
+                except m.RendererUnavailable as e:
+                    logger.warning(f"常驻渲染服务不可用，使用mmdc: {e}")
+                else:
+                    CACHE_REQUESTS.inc(tool="mermaid", result="miss")
+                    RENDER_SECONDS.observe(time.perf_counter() - start, tool="mermaid", format="svg",
+                                           renderer="sidecar")
+                    with stage("mermaid", "write"):
+                        await asyncio.to_thread(m.store.write, content_hash, '.svg', svg)
+                    return m.diagram_result(content_hash)
+        # 渲染服务不可用时交给同步接口的任务队列，由 mmdc 渲染，缓存未命中由任务记录
+        return await asyncio.to_thread(m.upload_jobs.run, {"content_hash": content_hash})
+
+
+class MarpHandler:
+    """marp 上传和导出的异步实现，文件已经存在时交给同步接口返回"""
+
+    def __init__(self, module):
+        self.m = module
+        self.pool = AsyncProcessPool(
+            module.render_pool.command,
+            size=module.MARP_POOL_SIZE,
+            timeout=module.MARP_RENDER_TIMEOUT,
+            max_jobs=module.MARP_WORKER_MAX_JOBS,
+            name="marp"
+        )
+        # 同一个文件同一时刻只转换一次，{(content_hash, ext): 转换任务}
+        self._exports = {}
+
+    def match(self, method, path):
+        if method == "POST" and path == "/upload":
+            return "/upload", self.upload
+        match = HASH_NAME_RE.match(path[1:])
+        if method == "GET" and match and match.group(2) in self.m.EXPORT_FORMATS:
+            return "/<filename>", self.get_slides
+        return None
+
+    async def upload(self, scope, receive, send):
+        m = self.m
+        try:
+            await check_rate_limit(m, scope)
+            with stage("marp", "receive"):
+                upload = await receive_async(request_body(receive), m.DATA_DIR, m.MAX_UPLOAD_BYTES)
+            with upload, stage("marp", "save"):
+                await asyncio.to_thread(upload.save, m.store, '.md')
+                content_hash = upload.digest
+        except RateLimited as e:
+            return await send_retry_later(send, e, 429)
+        except UploadError as e:
+            return await send_text(send, str(e), e.status)
+        try:
+            with stage("marp", "render"):
+                await self.export(content_hash, '.html')
+        except Overloaded as e:
+            return await send_retry_later(send, e, 503)
+        except m.RenderError as e:
+            logger.error(f"生成 PPT 预览失败: {e}")
+            return await send_text(send, 'PPT 预览生成失败', 500)
+        await send_text(send, m.upload_message(content_hash))
+
+    async def get_slides(self, scope, receive, send):
+        """文件不存在时先在事件循环中生成，再由同步接口返回文件"""
+        m = self.m
+        filename = scope["path"][1:]
+        content_hash, ext = HASH_NAME_RE.match(filename).groups()
+        exported = await asyncio.to_thread(m.store.exists, content_hash, ext)
+        if exported or not await asyncio.to_thread(m.store.exists, content_hash, '.md'):
+            return False
+        try:
+            # 只有需要转换时才消耗令牌
+            await check_rate_limit(m, scope)
+            await self.export(content_hash, ext)
+        except RateLimited as e:
+            return await send_retry_later(send, e, 429)
+        except Overloaded as e:
+            return await send_retry_later(send, e, 503)
+        except m.RenderError as e:
+            logger.error(f"生成 {filename} 失败: {e}")
+            return await send_text(send, 'PPT 生成失败', 500)
+        return False
+
+    async def export(self, content_hash, ext):
+        m = self.m
+        if await asyncio.to_thread(m.store.exists, content_hash, ext):
+            CACHE_REQUESTS.inc(tool="marp", result="hit")
+            return
+        if not await asyncio.to_thread(m.store.exists, content_hash, '.md'):
+            return
+        CACHE_REQUESTS.inc(tool="marp", result="miss")
+        key = (content_hash, ext)
+        task = self._exports.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._convert(content_hash, ext))
+            self._exports[key] = task
+            task.add_done_callback(lambda _: self._exports.pop(key, None))
+        # 一个请求断开不影响等待同一个转换的其他请求
+        await asyncio.shield(task)
+
+    async def _convert(self, content_hash, ext):
+        m = self.m
+        md_path = os.path.abspath(m.store.path(content_hash, '.md'))
+        with m.store.tempdir() as tmp_dir:
+            out_path = os.path.abspath(os.path.join(tmp_dir, 'slides' + ext))
+            fmt = ext.lstrip('.')
+            # 与同步接口共用转换槽位的准入限制
+            with m.export_capacity.admit():
+                start = time.perf_counter()
+                renderer = 'pool'
+                try:
+                    await self.pool.request({"input": md_path, "output": out_path, "format": fmt})
+                except WorkerError as e:
+                    raise m.RenderError(str(e))
+                except PoolUnavailable as e:
+                    logger.info(f"转换进程池不可用，使用marp命令行: {e}")
+                    start = time.perf_counter()
+                    renderer = 'cli'
+                    await asyncio.to_thread(m.convert_with_cli, md_path, out_path, fmt)
+                RENDER_SECONDS.observe(time.perf_counter() - start, tool="marp", format=fmt, renderer=renderer)
+            if not os.path.isfile(out_path):
+                raise m.RenderError("marp-cli 没有生成输出文件")
+            logger.info(f"已生成 {m.store.name(content_hash, ext)}")
+            await asyncio.to_thread(m.store.write_file, content_hash, ext, out_path)
+
+    def close(self):
+        self.pool.close()
+
+
+HANDLERS = {"mermaid": MermaidHandler, "marp": MarpHandler}
+
+
+class GatewayASGI:
+    """
+    按端口或路径前缀找到服务的异步处理函数，没有异步实现的请求交给同步的网关应用
+
+    处理函数返回 False 表示只做了准备工作（例如生成文件），请求继续交给同步应用。
+    """
+
+    def __init__(self, wsgi, handlers):
+        self.wsgi = wsgi
+        self.handlers = handlers
+        self.ports = {SERVICES[name][1]: name for name in handlers}
+
+    def _resolve(self, scope):
+        path = scope["path"]
+        server = scope.get("server")
+        name = self.ports.get(server[1]) if server else None
+        if name is None:
+            for candidate in self.handlers:
+                if path.startswith(f"/{candidate}/"):
+                    name, path = candidate, path[len(candidate) + 1:]
+                    break
+        if name is None:
+            return None
+        route = self.handlers[name].match(scope["method"], path)
+        return (name, *route, path) if route else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http":
+            resolved = self._resolve(scope)
+            if resolved:
+                if await self.dispatch(scope, receive, send, *resolved):
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def dispatch(self, scope, receive, send, name, rule, handler, path):
+        """
+        调用异步处理函数，返回请求是否已经处理完
+
+        已经处理完的请求在这里记录耗时和 span；交给同步应用的请求由 Flask 应用自己记录。
+        """
+        REGISTRY.ensure_started()
+        start = time.perf_counter()
+        started = start_request_span(f"{scope['method']} {path}", tool=name)
+        status = []
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        handled = True
+        try:
+            handled = await handler(dict(scope, path=path), receive, send_and_record) is not False
+        except ClientDisconnected:
+            # 客户端已断开，记为 499（与 nginx 相同）
+            status.append(499)
+        finally:
+            code = status[0] if status else 500
+            if handled:
+                REQUEST_SECONDS.observe(time.perf_counter() - start, tool=name, endpoint=rule,
+                                        method=scope["method"], status=code)
+            elif started is not None:
+                # 这个 span 只包含准备工作，响应由同步应用的 span 记录
+                started[0].attributes["gateway.handoff"] = "wsgi"
+            end_request_span(started, code if handled else None)
+        return handled
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for handler in self.handlers.values():
+                    if hasattr(handler, "close"):
+                        handler.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app():
+    handlers = {}
+    for name, handler_class in HANDLERS.items():
+        module = sys.modules.get(f"{name}_main")
+        if module is not None:
+            handlers[name] = handler_class(module)
+    return GatewayASGI(WSGIMiddleware(wsgi_app, workers=ASGI_WSGI_THREADS), handlers)
+
+
+app = create_asgi_app()
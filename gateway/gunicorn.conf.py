@@ -0,0 +1,14 @@
+"""
+网关的 gunicorn 配置
+
+除了网关自己的端口，同时监听各服务原来的端口，原来的地址不需要修改。
+"""
+import os
+
+PORT = int(os.environ.get("PORT", "5000"))  # 网关端口，按路径前缀分发
+LEGACY_PORTS = [5002, 5003, 5004, 5006]  # mermaid、markmap、marp、quiz 原来的端口
+
+bind = [f"0.0.0.0:{port}" for port in [PORT] + LEGACY_PORTS]
+workers = int(os.environ.get("GATEWAY_WORKERS", "2"))  # worker 进程数，所有工具共用
+threads = int(os.environ.get("GATEWAY_THREADS", "8"))  # 每个 worker 的线程数
+timeout = 120
@@ -0,0 +1,157 @@
+"""
+mermaid 上传接口的并发压测：同步模式（gunicorn gthread）与 ASGI 模式对比
+
+用一个按固定延迟返回结果的模拟渲染服务代替 Chromium，测量的是服务端在等待渲染期间能同时处理多少请求，
+与图表本身的渲染速度无关。每个请求上传不同的图表，不会命中已生成的文件。
+
+    python loadtest.py --concurrency 200 --requests 1000 --latency 0.5
+    python loadtest.py --mode asgi --workers 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+GATEWAY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+async def start_stub_renderer(socket_path, latency):
+    """模拟 mermaid 渲染服务：每个任务等待 latency 秒后返回一个 SVG，同时处理的任务数不限"""
+    async def handle(reader, writer):
+        async def reply(job):
+            await asyncio.sleep(latency)
+            result = {"id": job["id"], "svg": f"<svg>{job['code']}</svg>"}
+            writer.write((json.dumps(result) + "\n").encode("utf-8"))
+
+        tasks = []
+        while line := await reader.readline():
+            tasks.append(asyncio.ensure_future(reply(json.loads(line))))
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    return await asyncio.start_unix_server(handle, socket_path)
+
+
+def start_server(mode, port, workers, threads, env):
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers)]
+    if mode == "asgi":
+        command += ["-k", "uvicorn.workers.UvicornWorker", "asgi:app"]
+    else:
+        command += ["--threads", str(threads), "main:app"]
+    proc = subprocess.Popen(command, cwd=GATEWAY_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} 服务启动失败")
+
+
+def process_tree_rss(pid):
+    """进程及其子进程的常驻内存(MiB)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+
+async def post(port, path, body):
+    """发送一个 HTTP/1.1 POST 请求，返回状态码"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: text/plain\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def run_load(port, total, concurrency, run_id):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(i):
+        async with semaphore:
+            body = f"graph TD; A{run_id}_{i}-->B".encode("utf-8")
+            start = time.perf_counter()
+            try:
+                status = await post(port, "/mermaid/upload", body)
+            except OSError:
+                status = "error"
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - start, sorted(latencies), statuses
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sync", "asgi", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=1000, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时发出的请求数")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟渲染耗时(秒)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker 进程数")
+    parser.add_argument("--threads", type=int, default=4, help="同步模式每个 worker 的线程数")
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    modes = ["sync", "asgi"] if args.mode == "both" else [args.mode]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "renderer.sock")
+        renderer = await start_stub_renderer(socket_path, args.latency)
+        env = dict(
+            os.environ,
+            GATEWAY_SERVICES="mermaid",
+            MERMAID_RENDERER_SOCKET=socket_path,
+            # 排队上限足够大，测量排队带来的延迟而不是拒绝的请求数
+            JOB_MAX_QUEUE=str(args.requests),
+        )
+        for mode in modes:
+            env["DATA_DIR"] = os.path.join(tmp_dir, mode)
+            os.makedirs(env["DATA_DIR"])
+            proc = start_server(mode, args.port, args.workers, args.threads, env)
+            try:
+                # 预热：建立各 worker 的连接和线程
+                await run_load(args.port, args.workers * 4, args.workers * 4, f"warmup_{mode}")
+                elapsed, latencies, statuses = await run_load(args.port, args.requests, args.concurrency, mode)
+                rss = process_tree_rss(proc.pid)
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(
+                f"{mode:5} 吞吐 {args.requests / elapsed:7.1f} 请求/秒  "
+                f"p50 {percentile(latencies, 50) * 1000:7.0f}ms  p95 {percentile(latencies, 95) * 1000:7.0f}ms  "
+                f"p99 {percentile(latencies, 99) * 1000:7.0f}ms  内存 {rss:6.1f}MiB  状态码 {statuses}"
+            )
+        renderer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
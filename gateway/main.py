@@ -0,0 +1,141 @@
+"""
+多工具网关
+
+在一个进程中加载 markmap、mermaid、marp 和 quiz 四个服务的 Flask 应用，共用一组 gunicorn worker
+以及各服务的常驻渲染进程。
+
+每个服务使用 DATA_DIR 下以服务名命名的子目录（例如 data/markmap），文件都按 Markdown 内容的哈希命名，
+markmap、marp 和 quiz 都会生成 <hash>.html，放在同一个目录中时相同内容的上传会互相当作缓存命中。
+所有服务的指标在同一个进程中，快照保存在 DATA_DIR/.metrics。
+
+请求按两种方式分发：
+- 路径前缀：/markmap/...、/mermaid/...、/marp/...、/quiz/...
+- 监听端口：gunicorn 同时监听各服务原来的端口，发到 5002/5003/5004/5006 的请求整个交给对应服务，
+  原来的 /upload、/upload_markdown、/svg、/html、/get_html 等地址和返回的链接都不需要修改
+
+服务在导入时读取环境变量，名称冲突的配置（例如 PUBLIC_URL）可以用 <服务名>__<变量名> 单独指定，
+例如 MARKMAP__PUBLIC_URL 只在加载 markmap 时覆盖 PUBLIC_URL。
+"""
+import importlib.util
+import logging
+import os
+import sys
+
+from flask import Flask, Response, jsonify
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.serving import run_simple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, ROOT_DIR)
+from common.metrics import REGISTRY
+
+# 服务名称: (服务目录, 原来的端口)
+SERVICES = {
+    "mermaid": ("mermaid-flask-service", 5002),
+    "markmap": ("markmap-flask-service", 5003),
+    "marp": ("marp-flask-service", 5004),
+    "quiz": ("quiz-flask-service", 5006),
+}
+GATEWAY_SERVICES = [s.strip() for s in os.environ.get("GATEWAY_SERVICES", ",".join(SERVICES)).split(",") if s.strip()]  # 加载的服务，逗号分隔
+DATA_DIR = os.environ.get("DATA_DIR", "data")  # 各服务的数据目录为其下以服务名命名的子目录
+
+
+def _local_modules(directory):
+    """服务目录下可以直接导入的模块和包名，main.py 以 <服务名>_main 导入，不在其中"""
+    names = set()
+    for entry in os.listdir(directory):
+        if entry == "main.py":
+            continue
+        if entry.endswith(".py"):
+            names.add(entry[:-3])
+        elif os.path.isfile(os.path.join(directory, entry, "__init__.py")):
+            names.add(entry)
+    return names
+
+
+def load_service(name):
+    """
+    以 <服务名>_main 的名字导入服务的 main.py，返回其中的 Flask 应用
+
+    服务的 DATA_DIR 为网关 DATA_DIR 下以服务名命名的子目录，也可以用 <服务名>__DATA_DIR 单独指定。
+
+    不同服务的同名模块（例如 markmap 和 marp 都有 render_pool）互不影响：导入前先从 sys.modules 中移除
+    其他服务导入的同名模块，已经导入的服务持有自己模块的引用，不受影响。
+    """
+    directory = os.path.join(ROOT_DIR, SERVICES[name][0])
+    for module_name in _local_modules(directory):
+        for key in [k for k in sys.modules if k == module_name or k.startswith(module_name + ".")]:
+            module_file = getattr(sys.modules[key], "__file__", None) or ""
+            if module_file.startswith(ROOT_DIR + os.sep) and not module_file.startswith(directory + os.sep):
+                del sys.modules[key]
+
+    prefix = f"{name.upper()}__"
+    overrides = {key[len(prefix):]: value for key, value in os.environ.items() if key.startswith(prefix)}
+    overrides.setdefault("DATA_DIR", os.path.join(DATA_DIR, name))
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(directory, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    logger.info(f"已加载服务 {name}")
+    return module.app
+
+
+class PortDispatcher:
+    """按监听端口把请求整个交给对应服务，其他端口的请求交给 default"""
+
+    def __init__(self, default, ports):
+        self.default = default
+        self.ports = {str(port): app for port, app in ports.items()}
+
+    def __call__(self, environ, start_response):
+        app = self.ports.get(environ.get("SERVER_PORT"), self.default)
+        return app(environ, start_response)
+
+
+def create_app(names=GATEWAY_SERVICES):
+    # 指标快照保存在网关的数据目录中，第一次指定的目录生效，各服务不再另外指定
+    os.makedirs(DATA_DIR, exist_ok=True)
+    REGISTRY.configure(DATA_DIR)
+    apps = {name: load_service(name) for name in names}
+
+    index = Flask(__name__)
+
+    @index.route('/', methods=['GET'])
+    def list_services():
+        return jsonify({
+            "success": True,
+            "services": {
+                name: {"prefix": f"/{name}", "port": SERVICES[name][1]}
+                for name in apps
+            }
+        })
+
+    # 所有服务的指标在同一个进程中，与各服务的 /metrics 返回相同的内容
+    @index.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    prefixed = DispatcherMiddleware(index, {f"/{name}": app for name, app in apps.items()})
+    return PortDispatcher(prefixed, {SERVICES[name][1]: app for name, app in apps.items()})
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    run_simple('0.0.0.0', int(os.environ.get("PORT", "5000")), app, threaded=True)
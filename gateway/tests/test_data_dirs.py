@@ -0,0 +1,70 @@
+"""
+网关中各服务的文件互不影响
+
+markmap、marp 和 quiz 都按 Markdown 内容的哈希生成 <hash>.html，相同内容上传给两个服务时，
+各自返回自己生成的页面，不会把另一个服务的文件当作缓存命中。
+
+使用 benchmarks/stubs 中的模拟渲染器，不需要安装 Node 和 Chromium。
+"""
+import hashlib
+import importlib
+import os
+import sys
+
+import pytest
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(GATEWAY_DIR)
+STUBS_DIR = os.path.join(ROOT_DIR, "benchmarks", "stubs")
+
+MARKDOWN = "# 测试\n\n## 第一章\n\n- 要点一\n- 要点二\n"
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    env = {
+        "DATA_DIR": str(data_dir),
+        "PATH": STUBS_DIR + os.pathsep + os.environ.get("PATH", ""),
+        "STUB_LATENCY": "0",
+        "STUB_LATENCY_PER_KB": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+        "GATEWAY_SERVICES": "markmap,quiz",
+        "MARKMAP_POOL_SIZE": "0",
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    sys.path.insert(0, GATEWAY_DIR)
+    try:
+        gateway = importlib.import_module("main")
+        from werkzeug.test import Client
+        yield Client(gateway.app), data_dir
+    finally:
+        sys.path.remove(GATEWAY_DIR)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_same_markdown_uploaded_to_two_tools(client):
+    client, data_dir = client
+    digest = hashlib.sha256(MARKDOWN.encode("utf-8")).hexdigest()
+
+    response = client.post("/markmap/upload", data=MARKDOWN.encode("utf-8"), content_type="text/markdown")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()["base_name"] == digest
+    markmap_page = client.get(f"/markmap/html/{digest}.html").get_data(as_text=True)
+
+    response = client.post("/quiz/upload_markdown", data=MARKDOWN.encode("utf-8"), content_type="text/markdown")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert digest in response.get_json()["message"]
+    quiz_page = client.get(f"/quiz/get_html/{digest}").get_data(as_text=True)
+
+    assert quiz_page != markmap_page
+    assert "markmap" not in quiz_page
+    # 两个服务的文件分别保存在各自的子目录中
+    assert os.path.isdir(os.path.join(data_dir, "markmap"))
+    assert os.path.isdir(os.path.join(data_dir, "quiz"))
+    assert client.get(f"/markmap/html/{digest}.html").get_data(as_text=True) == markmap_page
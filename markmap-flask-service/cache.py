@@ -0,0 +1,268 @@
+"""
+渲染结果缓存
+
+按内容哈希缓存上传接口的响应数据，提供两种后端：
+- memory: 进程内 LRU，重启后丢失，每个 gunicorn worker 各有一份
+- sqlite: DATA_DIR 下的 SQLite 文件，所有 worker 共享，跨进程安全
+
+两种后端都按条目数和字节数限制大小，条目在 ttl 秒后过期，并统计命中/未命中/淘汰次数。
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# SQLite 后端的读取时间和命中计数先放在内存中，每隔这么多秒批量写入
+ACCESS_FLUSH_INTERVAL = 5
+# 超出限制时每次取出的淘汰候选条目数
+EVICT_BATCH = 64
+
+
+class MemoryCache:
+    """进程内 LRU 缓存"""
+
+    backend = "memory"
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # {key: (value, size, expires_at)}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                    self._evictions += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return json.loads(entry[0])
+
+    def set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (data, size, time.time() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+class SQLiteCache:
+    """
+    基于 SQLite 的共享 LRU 缓存
+
+    使用 WAL 模式，多个进程可以同时读；写操作在 BEGIN IMMEDIATE 事务中完成，
+    由 SQLite 的文件锁保证跨进程一致。每个线程使用独立连接。
+    读取不加写锁：命中时的访问时间和命中/未命中计数先记在进程内，每隔 ACCESS_FLUSH_INTERVAL 秒
+    或下一次写入时批量更新，LRU 顺序和统计最多滞后这么久。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=24 * 3600, timeout=10):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        # {key: 最近一次命中的时间}，{计数器: 增量}
+        self._accessed = {}
+        self._counts = {"hits": 0, "misses": 0}
+        self._pending_lock = threading.Lock()
+        self._flushed_at = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.executemany(
+                "INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)",
+                [("hits",), ("misses",), ("evictions",)],
+            )
+        atexit.register(self.flush)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 出来的子进程不能复用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    class _Transaction:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _transaction(self):
+        return self._Transaction(self._connection())
+
+    @staticmethod
+    def _count(conn, name, amount=1):
+        if amount:
+            conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def _record(self, counter, now, key=None):
+        """记录一次查找，距上次写入超过 ACCESS_FLUSH_INTERVAL 秒时批量写入"""
+        with self._pending_lock:
+            self._counts[counter] += 1
+            if key is not None:
+                self._accessed[key] = now
+            due = now - self._flushed_at >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def _write_pending(self, conn):
+        """在 conn 的事务中写入内存中的访问时间和计数"""
+        with self._pending_lock:
+            accessed, self._accessed = self._accessed, {}
+            counts, self._counts = self._counts, {"hits": 0, "misses": 0}
+            self._flushed_at = time.time()
+        if accessed:
+            conn.executemany("UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                             [(at, key) for key, at in accessed.items()])
+        for name, amount in counts.items():
+            self._count(conn, name, amount)
+
+    def flush(self):
+        """把内存中的访问时间和命中计数写入数据库"""
+        with self._pending_lock:
+            if not self._accessed and not any(self._counts.values()):
+                return
+        try:
+            with self._transaction() as conn:
+                self._write_pending(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"写入缓存访问记录时出错: {e}")
+
+    def get(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                with self._transaction() as conn:
+                    evicted = conn.execute(
+                        "DELETE FROM entries WHERE key = ? AND expires_at < ?", (key, now)).rowcount
+                    self._count(conn, "evictions", evicted)
+            self._record("misses", now)
+            return None
+        self._record("hits", now, key)
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            # 先写入积累的访问时间，淘汰按最新的 LRU 顺序进行
+            self._write_pending(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now + self.ttl, now),
+            )
+            evicted = conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,)).rowcount
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            # 按最近访问时间从旧到新淘汰，直到满足条目数和字节数限制；每次只按索引取出一批最旧的条目
+            while count > self.max_entries or total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed_at LIMIT ?", (EVICT_BATCH,)
+                ).fetchall()
+                if not rows:
+                    break
+                for old_key, old_size in rows:
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                    count -= 1
+                    total -= old_size
+                    evicted += 1
+            self._count(conn, "evictions", evicted)
+
+    def delete(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def stats(self):
+        self.flush()
+        conn = self._connection()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "backend": self.backend,
+            "entries": count,
+            "bytes": total,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+        }
+
+
+def create_cache(backend, data_dir, max_entries, max_bytes, ttl):
+    """按配置创建缓存后端，SQLite 不可用时退回进程内缓存"""
+    if backend == "sqlite":
+        path = os.path.join(data_dir, ".markmap-cache.sqlite3")
+        try:
+            return SQLiteCache(path, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        except sqlite3.Error as e:
+            logger.error(f"无法打开缓存数据库 {path}，使用进程内缓存: {e}")
+    elif backend != "memory":
+        logger.warning(f"未知的缓存后端 {backend}，使用进程内缓存")
+    return MemoryCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
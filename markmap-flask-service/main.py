@@ -1,17 +1,31 @@
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, request, jsonify
 import time
 import subprocess
 import os
-import threading
-import shutil
 import logging
 import re
-import fcntl
-import hashlib
-import json
-from functools import wraps
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+import sys
+import tempfile
+
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import ContentStore, hot_tier
+from common.expiry import ExpiryIndex, start_sweeper
+from common.objectstore import open_backend
+from common.jobs import JobQueue, QueueFull, JobTimeout
+from common.upload import receive_request, UploadError
+from common.static import send_artifact, send_variant
+from common.metrics import (CACHE_REQUESTS, QUEUE_DEPTH, RENDER_SECONDS, SUBPROCESS_FAILURES,
+                            SUBPROCESS_SPAWNS, instrument, stage, track)
+from common.ratelimit import TokenBuckets, Overloaded, limit, retry_after_seconds
+from common.lint import LintError, NegativeCache
+from common.pool import PoolUnavailable
+from render_pool import MarkmapRenderPool, RenderError, RenderSyntaxError
+from transformer import MarkmapTemplate, SectionCache
+from revisions import DELTA_SUFFIX, RevisionStore, start_compactor
+from cache import create_cache
+from singleflight import SingleFlight, SharedError
+from validation import validate
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,83 +33,145 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# 配置最大请求大小为5MB
+# 配置最大请求大小为5MB，上传接口在流式读取时按同样的上限拒绝
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
 
-# 配置请求限流器
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
-)
-
 # 配置
 DATA_DIR = os.environ.get("DATA_DIR", "data")
 FILE_EXPIRY_HOURS = int(os.environ.get("FILE_EXPIRY_HOURS", "24"))  # 文件过期时间(小时)
 CLEANUP_INTERVAL_HOURS = int(os.environ.get("CLEANUP_INTERVAL_HOURS", "1"))  # 清理间隔(小时)
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", "0"))  # 数据目录的容量上限(字节)，超出时删除最久未读取的文件，0表示不限
+STORAGE_BACKEND_URL = os.environ.get("STORAGE_BACKEND_URL", "")  # 多个副本共用的对象存储，s3://bucket/前缀 或 file:///目录，为空时只使用本地目录
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "5003"))
 # 对外提供的固定链接地址
 PUBLIC_URL = os.environ.get("PUBLIC_URL", "http://localhost:5003")
+# 常驻渲染进程池配置
+MARKMAP_POOL_SIZE = int(os.environ.get("MARKMAP_POOL_SIZE", "2"))  # 每个gunicorn worker的渲染进程数，0表示禁用
+MARKMAP_RENDER_TIMEOUT = int(os.environ.get("MARKMAP_RENDER_TIMEOUT", "30"))  # 单次渲染超时(秒)
+MARKMAP_WORKER_MAX_JOBS = int(os.environ.get("MARKMAP_WORKER_MAX_JOBS", "500"))  # 渲染进程处理多少任务后重启
+# 渲染结果缓存配置
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "sqlite")  # sqlite(多worker共享) 或 memory
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1000"))  # 最多缓存条目数
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 缓存最大字节数
+MARKMAP_PYTHON_TRANSFORMER = os.environ.get("MARKMAP_PYTHON_TRANSFORMER", "false").lower() == "true"  # 纯大纲内容在Python中渲染，黄金文件用markmap-cli生成并通过测试之前默认关闭
+MARKMAP_SECTION_CACHE_SIZE = int(os.environ.get("MARKMAP_SECTION_CACHE_SIZE", "4096"))  # 进程内缓存的大纲段解析结果数，0表示不缓存
+MARKMAP_MAX_NODES = int(os.environ.get("MARKMAP_MAX_NODES", "10000"))  # 标题和列表项数上限，超出时不渲染直接返回400
+# 修订版本增量存储配置
+REVISION_MAX_CHAIN = int(os.environ.get("REVISION_MAX_CHAIN", "8"))  # 差异链的最大长度，超出时保存完整文件
+REVISION_COMPACT_AFTER_MINUTES = int(os.environ.get("REVISION_COMPACT_AFTER_MINUTES", "60"))  # 差异保存多久后还原为完整文件(分钟)
+REVISION_COMPACT_INTERVAL_MINUTES = int(os.environ.get("REVISION_COMPACT_INTERVAL_MINUTES", "10"))  # 压缩检查间隔(分钟)
+# 后台任务队列配置
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # 每个gunicorn worker执行渲染任务的线程数
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", "32"))  # 每个gunicorn worker最多排队的任务数，超出时返回429
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", "110"))  # 单个任务超时(秒)，小于gunicorn的--timeout
+# 按租户限流配置，所有worker共用计数
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))  # 每个租户每分钟可以提交的渲染数，0表示不限流
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MINUTE)))  # 短时间内最多连续提交的渲染数
+RATE_LIMIT_PER_HOUR = int(os.environ.get("RATE_LIMIT_PER_HOUR", "50"))  # 每个租户每小时可以提交的渲染数，0表示不限
+RATE_LIMIT_PER_DAY = int(os.environ.get("RATE_LIMIT_PER_DAY", "200"))  # 每个租户每天可以提交的渲染数，0表示不限
 
 # 确保数据目录存在
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# 内容缓存，存储结构为 {content_hash: {file_info}}
-content_cache = {}
-# 缓存锁，防止并发写入
-cache_lock = threading.Lock()
+# 文件过期索引，清理时只处理已过期的文件
+expiry_index = ExpiryIndex(DATA_DIR, ttl=FILE_EXPIRY_HOURS * 3600, max_bytes=STORAGE_MAX_BYTES)
+# 按内容哈希保存生成的文件: data/ab/cd/<hash>.md|.html
+store = ContentStore(DATA_DIR, index=expiry_index, tool="markmap", backend=open_backend(STORAGE_BACKEND_URL))
+# 渲染失败的内容按哈希记录为 <hash>.error，相同内容再次上传时直接返回错误
+failures = NegativeCache(store)
+# 请求耗时和渲染指标，通过 /metrics 提供
+instrument(app, "markmap", DATA_DIR)
+
+# 修订版本保存为相对于父版本的差异，读取时重建，定期还原为完整文件
+revisions = RevisionStore(
+    store,
+    DATA_DIR,
+    ttl=FILE_EXPIRY_HOURS * 3600,
+    max_chain=REVISION_MAX_CHAIN,
+    compact_after=REVISION_COMPACT_AFTER_MINUTES * 60
+)
+
+# 内容缓存，存储结构为 {content_hash: {file_info}}，条目与文件同时过期
+content_cache = create_cache(
+    CACHE_BACKEND,
+    DATA_DIR,
+    max_entries=CACHE_MAX_ENTRIES,
+    max_bytes=CACHE_MAX_BYTES,
+    ttl=FILE_EXPIRY_HOURS * 3600
+)
+
+# 相同内容的并发上传只渲染一次，跨worker通过数据目录下的文件锁协调
+render_flight = SingleFlight(
+    os.path.join(DATA_DIR, ".singleflight"),
+    lock_timeout=MARKMAP_RENDER_TIMEOUT * 2,
+    shared_errors=(RenderError,)
+)
+
+# 常驻渲染进程池，在第一次上传时启动
+render_pool = MarkmapRenderPool(
+    size=MARKMAP_POOL_SIZE,
+    timeout=MARKMAP_RENDER_TIMEOUT,
+    max_jobs=MARKMAP_WORKER_MAX_JOBS
+)
 
-def get_content_hash(content):
-    """计算内容的SHA-256哈希值"""
-    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+def render_with_node(content):
+    """
+    使用Node渲染Markdown并返回HTML
 
-def clean_old_files():
-    """定时清理过期文件，使用文件锁避免并发问题"""
-    while True:
+    进程池没有在运行（已禁用、启动失败或进程崩溃）时回退到markmap-cli；
+    进程都在忙时抛出 Overloaded，由上传接口返回503，不为排队的请求另外启动 npx。
+    """
+    start = time.perf_counter()
+    try:
+        html = render_pool.render(content)
+        RENDER_SECONDS.observe(time.perf_counter() - start, tool="markmap", format="html", renderer="pool")
+        return html
+    except PoolUnavailable as e:
+        logger.info(f"渲染进程池不可用，使用markmap-cli: {e}")
+    except RenderSyntaxError as e:
+        # 只有渲染进程标记为内容错误的才返回400并记录，其他错误（包括 markmap-cli 的）可能与内容无关
+        raise LintError("SYNTAX_ERROR", str(e)[:1000], None, "检查开头 --- 之间的 markmap 配置，应为 YAML 格式")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_path = os.path.join(tmp_dir, "input.md")
+        html_path = os.path.join(tmp_dir, "output.html")
+        with open(md_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        SUBPROCESS_SPAWNS.inc(tool="markmap", kind="cli")
         try:
-            now = time.time()
-            expiry_time = now - (FILE_EXPIRY_HOURS * 3600)
-            count = 0
-            
-            # 创建一个锁文件
-            lock_file = os.path.join(DATA_DIR, ".cleanup.lock")
-            with open(lock_file, 'w') as f:
-                try:
-                    # 尝试获取文件锁
-                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    
-                    # 执行清理操作
-                    for filename in os.listdir(DATA_DIR):
-                        if filename == ".cleanup.lock":
-                            continue
-                            
-                        file_path = os.path.join(DATA_DIR, filename)
-                        if os.path.isfile(file_path):
-                            # 获取文件的修改时间
-                            file_time = os.path.getmtime(file_path)
-                            if file_time < expiry_time:
-                                try:
-                                    os.remove(file_path)
-                                    count += 1
-                                except (OSError, PermissionError) as e:
-                                    logger.error(f"无法删除文件 {file_path}: {e}")
-                    
-                    if count > 0:
-                        logger.info(f"已清理 {count} 个过期文件")
-                        
-                    # 释放锁
-                    fcntl.flock(f, fcntl.LOCK_UN)
-                except IOError:
-                    # 无法获取锁，说明另一个进程正在执行清理
-                    logger.info("另一个清理进程正在运行，跳过本次清理")
-            
-            # 等待下一次清理
-            time.sleep(CLEANUP_INTERVAL_HOURS * 3600)
-        except Exception as e:
-            logger.error(f"清理文件时出错: {e}")
-            time.sleep(300)  # 发生错误后等待5分钟再尝试
+            with RENDER_SECONDS.time(tool="markmap", format="html", renderer="cli"):
+                subprocess.run(
+                    ['npx', 'markmap-cli', md_path, '--no-open', '-o', html_path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    timeout=MARKMAP_RENDER_TIMEOUT
+                )
+        except subprocess.CalledProcessError as e:
+            SUBPROCESS_FAILURES.inc(tool="markmap", kind="cli", reason="exit")
+            raise RenderError(e.stderr)
+        except subprocess.TimeoutExpired:
+            SUBPROCESS_FAILURES.inc(tool="markmap", kind="cli", reason="timeout")
+            raise
+        with open(html_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+# 纯大纲内容直接在Python中套用模板渲染，其余内容交给Node；按段缓存解析结果，修改过的文档只解析改动的段
+section_cache = SectionCache(max_entries=MARKMAP_SECTION_CACHE_SIZE)
+markmap_template = MarkmapTemplate(render_with_node, sections=section_cache)
+
+def render_markmap(content):
+    """将Markdown渲染为思维导图HTML"""
+    html = None
+    if MARKMAP_PYTHON_TRANSFORMER:
+        start = time.perf_counter()
+        html = markmap_template.render(content)
+        if html is not None:
+            RENDER_SECONDS.observe(time.perf_counter() - start, tool="markmap", format="html", renderer="python")
+    if html is None:
+        html = render_with_node(content)
+    return html
 
 def sanitize_filename(filename):
     """
@@ -114,96 +190,277 @@ def sanitize_filename(filename):
     
     return filename
 
+def artifact_exists(filename):
+    """文件以完整文件或修订差异的形式存在"""
+    if store.resolve(filename):
+        return True
+    target = store.lookup(filename)
+    return bool(target) and revisions.exists(*target)
+
+def send_revision(filename, mimetype='text/html', as_attachment=False):
+    """返回以差异保存的修订版本重建后的内容，不是差异或无法重建时返回 None"""
+    target = store.lookup(filename)
+    if not target or not revisions.is_delta(*target):
+        return None
+    content = revisions.read(*target)
+    if content is None:
+        return None
+    response = send_variant(content, store.name(*target), mimetype=mimetype)
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+def get_cached_result(content_hash):
+    """从缓存中获取已生成的思维导图，文件已被清理时返回None"""
+    cache_data = content_cache.get(content_hash)
+    if not cache_data:
+        return None
+    
+    # 检查文件是否仍然存在
+    if artifact_exists(cache_data['files']['html']) and artifact_exists(cache_data['files']['markdown']):
+        return cache_data
+    
+    content_cache.delete(content_hash)
+    return None
+
+def create_markmap(content, content_hash, custom_filename, parent=None):
+    """生成思维导图HTML，返回响应数据；指定父版本的内容哈希时把Markdown保存为相对于父版本的差异"""
+    # 等待期间其他请求可能已经生成了相同内容
+    cache_data = get_cached_result(content_hash)
+    if cache_data:
+        return cache_data
+    
+    # 没有父版本时 Markdown 已经在接收请求时保存，修订版本在这里保存相对于父版本的差异
+    if parent:
+        revisions.write(content_hash, '.md', content, parent)
+    
+    # 转换 Markdown 为 HTML，缓存过期但文件仍在时不必重新渲染
+    if store.exists(content_hash, '.html'):
+        store.touch(content_hash, '.html')
+    elif revisions.exists(content_hash, '.html'):
+        store.touch(content_hash, '.html' + DELTA_SUFFIX)
+    else:
+        with stage("markmap", "render"):
+            try:
+                html = render_markmap(content)
+            except LintError as e:
+                # 相同内容再次上传时直接返回错误，不再渲染
+                failures.put(content_hash, e)
+                raise
+        with stage("markmap", "write"):
+            if parent:
+                revisions.write(content_hash, '.html', html, parent)
+            else:
+                store.write(content_hash, '.html', html)
+    
+    # 指定了文件名时创建别名，别名中带上内容哈希前缀，不同内容不会互相覆盖
+    if custom_filename and custom_filename.strip():
+        base_filename = f"{sanitize_filename(custom_filename)}_{content_hash[:12]}"
+        file_name = f"{base_filename}.md"
+        html_name = f"{base_filename}.html"
+        store.alias(file_name, content_hash, '.md')
+        store.alias(html_name, content_hash, '.html')
+    else:
+        base_filename = content_hash
+        file_name = store.name(content_hash, '.md')
+        html_name = store.name(content_hash, '.html')
+    timestamp = int(time.time())
+    
+    # 使用固定的公共URL
+    preview_url = f"{PUBLIC_URL}/html/{html_name}"
+    download_urls = {
+        "html": f"{PUBLIC_URL}/download/{html_name}",
+        "markdown": f"{PUBLIC_URL}/download/{file_name}"
+    }
+    
+    response_data = {
+        "success": True,
+        "message": "思维导图HTML文件已生成",
+        "preview_url": preview_url,
+        "download_urls": download_urls,
+        "files": {
+            "html": html_name,
+            "markdown": file_name
+        },
+        "base_name": base_filename,
+        "timestamp": timestamp
+    }
+    if parent:
+        response_data["parent"] = parent
+    
+    # 将结果存入缓存，超出大小限制时按LRU淘汰
+    content_cache.set(content_hash, response_data)
+    
+    return response_data
+
+def run_upload_job(payload):
+    """后台任务：渲染上传的Markdown并返回响应数据"""
+    content = payload["content"]
+    content_hash = payload["content_hash"]
+    
+    # 排队期间其他请求可能已经生成了相同内容
+    cache_data = get_cached_result(content_hash)
+    if cache_data:
+        return cache_data
+    
+    # 相同内容的并发请求共享同一次渲染的结果或错误
+    return render_flight.do(
+        content_hash,
+        lambda: create_markmap(content, content_hash, payload["filename"], payload.get("parent"))
+    )
+
+# 渲染任务队列，同步上传接口也通过它执行渲染
+upload_jobs = JobQueue(
+    DATA_DIR,
+    run_upload_job,
+    workers=JOB_WORKERS,
+    max_queue=JOB_MAX_QUEUE,
+    timeout=JOB_TIMEOUT,
+    ttl=FILE_EXPIRY_HOURS * 3600
+)
+track(QUEUE_DEPTH, upload_jobs.depth, tool="markmap")
+
+# 按租户限流，租户由请求头中的API Key或租户标识确定；每小时、每天的限额与原来 flask-limiter 的默认限额相同
+# 计数范围不能以 "markmap:" 开头，否则会被每分钟限额清理已回满的令牌桶时一起删除
+rate_limits = [
+    TokenBuckets(DATA_DIR, "markmap", RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST),
+    TokenBuckets(DATA_DIR, "markmap-hour", RATE_LIMIT_PER_HOUR / 60, RATE_LIMIT_PER_HOUR),
+    TokenBuckets(DATA_DIR, "markmap-day", RATE_LIMIT_PER_DAY / 1440, RATE_LIMIT_PER_DAY),
+]
+
+def rate_limited(e):
+    return jsonify({
+        "success": False,
+        "message": "请求过于频繁，请稍后重试",
+        "error": str(e)
+    }), 429
+
+# 启动清理线程：gunicorn的每个worker都会启动，但只有拿到文件锁的一个进程执行清理
+start_sweeper(expiry_index, CLEANUP_INTERVAL_HOURS * 3600, bootstrap_files=store.iter_files)
+# 修订差异的压缩线程同样只在一个进程中执行
+start_compactor(revisions, REVISION_COMPACT_INTERVAL_MINUTES * 60)
+logger.info(f"文件保留 {FILE_EXPIRY_HOURS} 小时")
+
+class ParentNotFound(Exception):
+    """修订版本指定的父版本不存在"""
+
+def resolve_parent():
+    """
+    修订版本：parent 参数是上一版的 base_name，返回上一版的内容哈希，没有指定时返回 None
+
+    Markdown 和 HTML 都保存为相对于上一版的差异，上一版不存在时抛出 ParentNotFound。
+    """
+    base_name = request.args.get('parent')
+    if not base_name:
+        return None
+    target = store.lookup(f"{base_name}.md")
+    if not target or not revisions.exists(*target):
+        raise ParentNotFound(f"parent 指定的思维导图未找到或已过期: {base_name}")
+    return target[0]
+
+def check_content(content, content_hash):
+    """渲染前检查内容，不通过或之前渲染失败过时抛出 LintError"""
+    with stage("markmap", "lint"):
+        validate(content, MARKMAP_MAX_NODES)
+        error = failures.get(content_hash)
+    if error is not None:
+        CACHE_REQUESTS.inc(tool="markmap", result="negative")
+        raise error
+
+def lint_failed(e):
+    return jsonify({
+        "success": False,
+        "message": "Markdown 内容检查未通过",
+        "error": str(e),
+        "details": e.to_dict()
+    }), 400
+
+def parent_not_found(e):
+    return jsonify({
+        "success": False,
+        "message": "父版本不存在",
+        "error": str(e)
+    }), 404
+
 @app.route('/upload', methods=['POST'])
-@limiter.limit("10 per minute")
+@limit(rate_limits, rate_limited)
 def upload_markdown():
     try:
-        content = request.get_data(as_text=True)
-        if not content.strip():
-            return jsonify({
-                "success": False,
-                "message": "上传内容为空",
-                "error": "内容不能为空"
-            }), 400
-        
-        # 计算内容哈希值
-        content_hash = get_content_hash(content)
-        
-        # 检查缓存中是否已有此内容
-        with cache_lock:
-            if content_hash in content_cache:
-                cache_data = content_cache[content_hash]
-                # 检查文件是否仍然存在
-                html_path = os.path.join(DATA_DIR, cache_data['files']['html'])
-                md_path = os.path.join(DATA_DIR, cache_data['files']['markdown'])
-                
-                if (os.path.exists(html_path) and os.path.exists(md_path)):
-                    logger.info(f"使用缓存的思维导图: {cache_data['base_name']}")
-                    return jsonify(cache_data)
+        # 队列已满时在读取请求体之前拒绝
+        upload_jobs.admit()
+        # 请求体流式写入临时文件，边读边计算内容哈希值
+        with stage("markmap", "receive"):
+            upload = receive_request(request, DATA_DIR, app.config['MAX_CONTENT_LENGTH'])
+        with upload:
+            if upload.blank:
+                return jsonify({
+                    "success": False,
+                    "message": "上传内容为空",
+                    "error": "内容不能为空"
+                }), 400
+            content_hash = upload.digest
+            
+            # 检查缓存中是否已有此内容，命中时不需要读取内容
+            with stage("markmap", "cache"):
+                cache_data = get_cached_result(content_hash)
+            if cache_data:
+                CACHE_REQUESTS.inc(tool="markmap", result="hit")
+                logger.info(f"使用缓存的思维导图: {cache_data['base_name']}")
+                return jsonify(cache_data)
+            CACHE_REQUESTS.inc(tool="markmap", result="miss")
+            
+            parent = resolve_parent()
+            content = upload.read_text()
+            check_content(content, content_hash)
+            
+            with stage("markmap", "save"):
+                # 保存 Markdown 文件，相同内容只保存一份；修订版本在渲染时保存差异
+                if not parent:
+                    upload.save(store, '.md')
         
         # 获取自定义文件名参数
         custom_filename = request.args.get('filename', '')
         
-        # 处理并清理文件名
-        safe_filename = sanitize_filename(custom_filename)
-        timestamp = int(time.time())
-        
-        # 构建文件名
-        if safe_filename:
-            base_filename = f"{safe_filename}_{timestamp}"
-        else:
-            base_filename = str(timestamp)
-        
-        file_name = f"{base_filename}.md"
-        html_name = f"{base_filename}.html"
-        file_path = os.path.join(DATA_DIR, file_name)
-        
-        # 保存 Markdown 文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        # 转换 Markdown 为 HTML
-        html_path = os.path.join(DATA_DIR, html_name)
-        result = subprocess.run(
-            ['npx', 'markmap-cli', file_path, '--no-open', '-o', html_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        # 使用固定的公共URL
-        preview_url = f"{PUBLIC_URL}/html/{html_name}"
-        download_urls = {
-            "html": f"{PUBLIC_URL}/download/{html_name}",
-            "markdown": f"{PUBLIC_URL}/download/{file_name}"
-        }
-        
-        response_data = {
-            "success": True,
-            "message": "思维导图HTML文件已生成",
-            "preview_url": preview_url,
-            "download_urls": download_urls,
-            "files": {
-                "html": html_name,
-                "markdown": file_name
-            },
-            "base_name": base_filename,
-            "timestamp": timestamp
-        }
-        
-        # 将结果存入缓存
-        with cache_lock:
-            content_cache[content_hash] = response_data
-            # 限制缓存大小，最多保存100项
-            if len(content_cache) > 100:
-                # 移除最早的缓存项
-                oldest_key = next(iter(content_cache))
-                del content_cache[oldest_key]
+        # 提交到任务队列并等待结果
+        with stage("markmap", "job"):
+            response_data = upload_jobs.run({"content": content, "content_hash": content_hash,
+                                             "filename": custom_filename, "parent": parent})
         
         return jsonify(response_data)
     
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr
+    except UploadError as e:
+        return jsonify({
+            "success": False,
+            "message": "上传内容不合法",
+            "error": str(e)
+        }), e.status
+    except ParentNotFound as e:
+        return parent_not_found(e)
+    except LintError as e:
+        return lint_failed(e)
+    except QueueFull as e:
+        logger.warning(f"渲染任务队列已满: {e}")
+        return jsonify({
+            "success": False,
+            "message": "服务繁忙，请稍后重试",
+            "error": str(e)
+        }), 429, {'Retry-After': retry_after_seconds(e.retry_after)}
+    except Overloaded as e:
+        logger.warning(f"渲染进程繁忙: {e}")
+        return jsonify({
+            "success": False,
+            "message": "服务繁忙，请稍后重试",
+            "error": str(e)
+        }), 503, {'Retry-After': retry_after_seconds(e.retry_after)}
+    except JobTimeout as e:
+        logger.error(f"渲染任务超时: {e}")
+        return jsonify({
+            "success": False,
+            "message": "转换 Markdown 超时",
+            "error": str(e)
+        }), 504
+    except (RenderError, SharedError) as e:
+        error_msg = str(e)
         logger.error(f"转换 Markdown 失败: {error_msg}")
         return jsonify({
             "success": False,
@@ -219,22 +476,94 @@ def upload_markdown():
             "error": error_msg
         }), 500
 
+@app.route('/jobs', methods=['POST'])
+@limit(rate_limits, rate_limited)
+def create_job():
+    """提交异步渲染任务，立即返回任务ID，可通过 /jobs/<job_id> 查询状态"""
+    try:
+        upload_jobs.admit()
+        with receive_request(request, DATA_DIR, app.config['MAX_CONTENT_LENGTH']) as upload:
+            if upload.blank:
+                return jsonify({
+                    "success": False,
+                    "message": "上传内容为空",
+                    "error": "内容不能为空"
+                }), 400
+            parent = resolve_parent()
+            content = upload.read_text()
+            check_content(content, upload.digest)
+            if not parent:
+                upload.save(store, '.md')
+        job_id = upload_jobs.submit(
+            {"content": content, "content_hash": upload.digest, "filename": request.args.get('filename', ''),
+             "parent": parent},
+            webhook=request.args.get('webhook')
+        )
+    except UploadError as e:
+        return jsonify({
+            "success": False,
+            "message": "上传内容不合法",
+            "error": str(e)
+        }), e.status
+    except ParentNotFound as e:
+        return parent_not_found(e)
+    except LintError as e:
+        return lint_failed(e)
+    except QueueFull as e:
+        logger.warning(f"渲染任务队列已满: {e}")
+        return jsonify({
+            "success": False,
+            "message": "服务繁忙，请稍后重试",
+            "error": str(e)
+        }), 429, {'Retry-After': retry_after_seconds(e.retry_after)}
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": "参数错误",
+            "error": str(e)
+        }), 400
+    
+    return jsonify({
+        "success": True,
+        "message": "任务已提交",
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"{PUBLIC_URL}/jobs/{job_id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步渲染任务的状态，成功时 result 与 /upload 的响应相同"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "message": "任务不存在",
+            "error": "请求的任务未找到或已过期"
+        }), 404
+    return jsonify({
+        "success": True,
+        "job": job
+    })
+
 @app.route('/html/<filename>', methods=['GET'])
 def get_html(filename):
-    return send_from_directory(DATA_DIR, filename)
+    file_path = store.resolve(filename, check=False)
+    response = send_artifact(file_path) if file_path else None
+    if response is None:
+        response = send_revision(filename)
+    if response is None:
+        return jsonify({
+            "success": False,
+            "message": "文件不存在",
+            "error": "请求的文件未找到"
+        }), 404
+    return response
 
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     """提供文件下载服务"""
     try:
-        file_path = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(file_path):
-            return jsonify({
-                "success": False,
-                "message": "文件不存在",
-                "error": "请求的文件未找到"
-            }), 404
-        
         # 根据文件扩展名设置合适的MIME类型
         if filename.endswith('.html'):
             mimetype = 'text/html'
@@ -243,12 +572,22 @@ def download_file(filename):
         else:
             mimetype = 'application/octet-stream'
         
-        return send_from_directory(
-            DATA_DIR, 
-            filename, 
+        file_path = store.resolve(filename, check=False)
+        response = send_artifact(
+            file_path,
+            mimetype=mimetype,
             as_attachment=True,
-            mimetype=mimetype
-        )
+            download_name=filename
+        ) if file_path else None
+        if response is None:
+            response = send_revision(filename, mimetype=mimetype, as_attachment=True)
+        if response is None:
+            return jsonify({
+                "success": False,
+                "message": "文件不存在",
+                "error": "请求的文件未找到"
+            }), 404
+        return response
     except Exception as e:
         logger.error(f"下载文件时出错: {e}")
         return jsonify({
@@ -257,6 +596,41 @@ def download_file(filename):
             "error": str(e)
         }), 500
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """查看渲染结果缓存的命中、未命中和淘汰统计"""
+    try:
+        return jsonify({
+            "success": True,
+            "stats": content_cache.stats(),
+            "sections": section_cache.stats(),
+            "pending_revisions": revisions.pending(),
+            "memory": hot_tier.stats()
+        })
+    except Exception as e:
+        logger.error(f"获取缓存统计时出错: {e}")
+        return jsonify({
+            "success": False,
+            "message": "获取缓存统计时出错",
+            "error": str(e)
+        }), 500
+
+@app.route('/cleanup/stats', methods=['GET'])
+def get_cleanup_stats():
+    """查看过期文件索引和最近一次清理的统计"""
+    try:
+        return jsonify({
+            "success": True,
+            "stats": expiry_index.stats()
+        })
+    except Exception as e:
+        logger.error(f"获取清理统计时出错: {e}")
+        return jsonify({
+            "success": False,
+            "message": "获取清理统计时出错",
+            "error": str(e)
+        }), 500
+
 @app.route('/files/<base_name>', methods=['GET'])
 def get_file_info(base_name):
     """获取指定基础名称的所有相关文件信息"""
@@ -267,14 +641,25 @@ def get_file_info(base_name):
         for file_type in file_types:
             extension = '.html' if file_type == 'html' else '.md'
             filename = f"{base_name}{extension}"
-            file_path = os.path.join(DATA_DIR, filename)
-            if os.path.exists(file_path):
+            file_path = store.resolve(filename)
+            if file_path:
                 files_info[file_type] = {
                     "filename": filename,
                     "download_url": f"{PUBLIC_URL}/download/{filename}",
                     "size": os.path.getsize(file_path),
                     "modified_time": os.path.getmtime(file_path)
                 }
+                continue
+            # 以差异保存的修订版本，大小为重建后的内容
+            target = store.lookup(filename)
+            content = revisions.read(*target) if target and revisions.is_delta(*target) else None
+            if content is not None:
+                files_info[file_type] = {
+                    "filename": filename,
+                    "download_url": f"{PUBLIC_URL}/download/{filename}",
+                    "size": len(content.encode('utf-8')),
+                    "modified_time": os.path.getmtime(store.path(target[0], target[1] + DELTA_SUFFIX))
+                }
         
         if not files_info:
             return jsonify({
@@ -299,11 +684,6 @@ def get_file_info(base_name):
         }), 500
 
 if __name__ == '__main__':
-    # 启动清理线程
-    cleanup_thread = threading.Thread(target=clean_old_files, daemon=True)
-    cleanup_thread.start()
-    logger.info(f"文件清理服务已启动，每 {CLEANUP_INTERVAL_HOURS} 小时清理一次，文件保留 {FILE_EXPIRY_HOURS} 小时")
-    
     # 启动 Flask 应用
     logger.info(f"服务器正在启动于 {HOST}:{PORT}")
     logger.info(f"对外公开URL: {PUBLIC_URL}")
@@ -0,0 +1,49 @@
+"""
+markmap 常驻渲染进程池
+
+每个工作进程是一个长期运行的 Node 进程（worker/render_worker.mjs），
+通过 stdin/stdout 按行交换 JSON，避免每次上传都执行 npx 查找和 Node 冷启动。
+进程的启动、回收和超时处理见 common.pool，这里只定义任务内容和响应的解析。
+"""
+import os
+
+from common.pool import ProcessPool, WorkerError, WorkerTimeout
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker", "render_worker.mjs")
+
+
+class RenderError(Exception):
+    """渲染进程返回的转换错误"""
+
+
+class RenderSyntaxError(RenderError):
+    """渲染进程报告的内容错误（front matter 的 YAML 格式错误），相同内容总是失败"""
+
+
+class RenderTimeout(RenderError):
+    """单次渲染超时"""
+
+
+class MarkmapRenderPool(ProcessPool):
+    """markmap 渲染进程池，不可用时调用方回退到 markmap-cli"""
+
+    def __init__(self, size=2, timeout=30, max_jobs=500, start_timeout=30, retry_interval=60, command=None):
+        super().__init__(
+            command or ["node", WORKER_SCRIPT],
+            size=size,
+            timeout=timeout,
+            max_jobs=max_jobs,
+            start_timeout=start_timeout,
+            retry_interval=retry_interval,
+            name="markmap"
+        )
+
+    def render(self, content):
+        """渲染 Markdown 并返回思维导图 HTML"""
+        try:
+            response = self.request({"content": content})
+        except WorkerTimeout as e:
+            raise RenderTimeout(str(e))
+        except WorkerError as e:
+            raise (RenderSyntaxError if e.response.get("syntax") else RenderError)(str(e))
+        return response["html"]
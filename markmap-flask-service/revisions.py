@@ -0,0 +1,238 @@
+"""
+修订版本的增量存储
+
+POST /upload?parent=<base_name> 上传的修订版本通常只比上一版多改了几行，不再保存完整的 .md 和 .html，
+而是保存相对于父版本的差异 <hash>.md.delta / <hash>.html.delta（JSON：父版本哈希、链长度、操作列表），
+读取时从父版本重建。父版本本身也可以是差异；链长度超过 max_chain 或差异不比完整文件小很多时直接保存完整文件。
+
+差异登记在 data/.revisions/ 中，后台线程定期把创建超过 compact_after 秒的差异还原为完整文件并删除差异，
+写入差异时会刷新父版本的过期时间，压缩在父版本过期之前完成。只有拿到文件锁的进程执行压缩。
+"""
+import difflib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DELTA_SUFFIX = ".delta"
+
+# 支持差异保存的扩展名
+DELTA_EXTS = (".md", ".html")
+
+
+def _chunks(text, ext):
+    """差异比较的单位：Markdown 按行；HTML 中的节点树 JSON 在一行中，再按节点之间的 "}," 切分"""
+    lines = text.splitlines(keepends=True)
+    if ext != ".html":
+        return lines
+    chunks = []
+    for line in lines:
+        pieces = line.split("},")
+        chunks.extend(piece + "}," for piece in pieces[:-1])
+        if pieces[-1]:
+            chunks.append(pieces[-1])
+    return chunks
+
+
+def diff(parent, text, ext):
+    """
+    计算从 parent 得到 text 的操作列表
+
+    每个操作是复制父版本中一段内容的 [起始位置, 长度]，或者新插入的字符串。
+    """
+    a, b = _chunks(parent, ext), _chunks(text, ext)
+    offsets = [0]
+    for chunk in a:
+        offsets.append(offsets[-1] + len(chunk))
+    # 修改通常集中在一处，相同的开头和结尾直接复制，只比较中间部分
+    head = 0
+    while head < min(len(a), len(b)) and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < min(len(a), len(b)) - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+    matcher = difflib.SequenceMatcher(None, a[head:len(a) - tail], b[head:len(b) - tail], autojunk=False)
+    opcodes = [("equal", 0, head, 0, head)] if head else []
+    opcodes += [(tag, i1 + head, i2 + head, j1 + head, j2 + head) for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+    if tail:
+        opcodes.append(("equal", len(a) - tail, len(a), len(b) - tail, len(b)))
+    ops = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            start, length = offsets[i1], offsets[i2] - offsets[i1]
+            if ops and isinstance(ops[-1], list) and sum(ops[-1]) == start:
+                ops[-1][1] += length
+            else:
+                ops.append([start, length])
+        elif j2 > j1:
+            inserted = "".join(b[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += inserted
+            else:
+                ops.append(inserted)
+    return ops
+
+
+def apply(parent, ops):
+    """按操作列表从 parent 重建内容"""
+    return "".join(parent[op[0]:op[0] + op[1]] if isinstance(op, list) else op for op in ops)
+
+
+class RevisionStore:
+    """在 ContentStore 之上按父版本保存差异"""
+
+    def __init__(self, store, data_dir, ttl, max_chain=8, max_ratio=0.5, compact_after=3600):
+        self.store = store
+        self.directory = os.path.join(data_dir, ".revisions")
+        self.ttl = ttl
+        self.max_chain = max_chain
+        self.max_ratio = max_ratio
+        self.compact_after = compact_after
+        os.makedirs(self.directory, exist_ok=True)
+
+    def exists(self, digest, ext):
+        return self.store.exists(digest, ext) or self.store.exists(digest, ext + DELTA_SUFFIX)
+
+    def is_delta(self, digest, ext):
+        return not self.store.exists(digest, ext) and self.store.exists(digest, ext + DELTA_SUFFIX)
+
+    def _open(self, digest, name):
+        """打开仓库中的文件，本地没有时由 ContentStore 从对象存储下载"""
+        try:
+            return open(self.store.path(digest, name), encoding="utf-8", newline="")
+        except FileNotFoundError:
+            if not self.store.exists(digest, name):
+                raise
+            return open(self.store.path(digest, name), encoding="utf-8", newline="")
+
+    def _load(self, digest, ext, depth=0):
+        """返回 (内容, 链长度)，文件或链上的某个父版本不存在时返回 (None, 0)"""
+        try:
+            with self._open(digest, ext) as f:
+                return f.read(), 0
+        except FileNotFoundError:
+            pass
+        try:
+            with self._open(digest, ext + DELTA_SUFFIX) as f:
+                delta = json.load(f)
+        except FileNotFoundError:
+            return None, 0
+        if depth > self.max_chain:
+            logger.error(f"修订版本链过长: {digest}{ext}")
+            return None, 0
+        parent, _ = self._load(delta["parent"], ext, depth + 1)
+        if parent is None:
+            return None, 0
+        return apply(parent, delta["ops"]), delta["depth"]
+
+    def read(self, digest, ext):
+        """读取完整内容（必要时从父版本重建），不存在时返回 None"""
+        return self._load(digest, ext)[0]
+
+    def _marker(self, digest, ext):
+        return os.path.join(self.directory, f"{digest}{ext}")
+
+    def write(self, digest, ext, text, parent_digest):
+        """保存修订版本，能够以差异保存时返回 True，否则保存完整文件并返回 False"""
+        if self.exists(digest, ext):
+            self.store.touch(digest, ext) or self.store.touch(digest, ext + DELTA_SUFFIX)
+            return self.is_delta(digest, ext)
+        depth = 0
+        if self.is_delta(parent_digest, ext):
+            with self._open(parent_digest, ext + DELTA_SUFFIX) as f:
+                depth = json.load(f)["depth"]
+        parent_text = self.read(parent_digest, ext) if depth < self.max_chain else None
+        if parent_text is None:
+            self.store.write(digest, ext, text)
+            return False
+
+        delta = json.dumps({"parent": parent_digest, "depth": depth + 1, "ops": diff(parent_text, text, ext)},
+                           ensure_ascii=False, separators=(",", ":"))
+        if len(delta) > len(text) * self.max_ratio:
+            self.store.write(digest, ext, text)
+            return False
+        self._keep_alive(parent_digest, ext)
+        self.store.write(digest, ext + DELTA_SUFFIX, delta)
+        with open(self._marker(digest, ext), "w"):
+            pass
+        return True
+
+    def _keep_alive(self, digest, ext):
+        """父版本至少要保留到差异被压缩之后，剩余时间不够时刷新过期时间"""
+        name = ext if self.store.exists(digest, ext) else ext + DELTA_SUFFIX
+        try:
+            age = time.time() - os.path.getmtime(self.store.path(digest, name))
+        except FileNotFoundError:
+            return
+        if age > self.ttl - 2 * self.compact_after:
+            self.store.touch(digest, name)
+
+    def compact(self, now=None):
+        """把创建超过 compact_after 秒的差异还原为完整文件，返回处理的文件数"""
+        now = time.time() if now is None else now
+        compacted = 0
+        for entry in os.listdir(self.directory):
+            marker = os.path.join(self.directory, entry)
+            try:
+                if os.path.getmtime(marker) > now - self.compact_after:
+                    continue
+            except FileNotFoundError:
+                continue
+            digest, ext = entry[:64], entry[64:]
+            if ext not in DELTA_EXTS:
+                continue
+            text = self.read(digest, ext)
+            if text is None:
+                logger.warning(f"无法重建修订版本，父版本已不存在: {entry}")
+            elif not self.store.exists(digest, ext):
+                self.store.write(digest, ext, text)
+                compacted += 1
+            try:
+                os.remove(self.store.path(digest, ext + DELTA_SUFFIX))
+            except FileNotFoundError:
+                pass
+            os.remove(marker)
+        return compacted
+
+    def pending(self):
+        return len(os.listdir(self.directory))
+
+
+# 当前进程中已经启动的压缩线程，网关中同一个数据目录只启动一个
+_compactors = {}
+_compactors_lock = threading.Lock()
+
+
+def start_compactor(revisions, interval):
+    """启动后台压缩线程，与文件清理相同，只有拿到 .revisions.lock 文件锁的进程执行压缩"""
+    lock_path = revisions.directory + ".lock"
+
+    def run():
+        lock_file = open(lock_path, "a")
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(interval)
+
+        while True:
+            try:
+                count = revisions.compact()
+                if count:
+                    logger.info(f"已把 {count} 个修订版本还原为完整文件")
+            except Exception as e:
+                logger.error(f"压缩修订版本时出错: {e}")
+            time.sleep(interval)
+
+    key = (os.getpid(), os.path.realpath(lock_path))
+    with _compactors_lock:
+        if key in _compactors:
+            return _compactors[key]
+        thread = _compactors[key] = threading.Thread(target=run, daemon=True)
+        thread.start()
+    return thread
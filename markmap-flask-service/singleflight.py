@@ -0,0 +1,166 @@
+"""
+相同内容的并发渲染合并
+
+同一个内容哈希同一时刻只渲染一次：
+- 同一进程内，后到的线程等待第一个线程的结果或异常
+- 不同 gunicorn worker 之间，通过 lock_dir 下每个 key 一个的文件锁串行化，先完成的进程把结果写入结果文件，
+  其他进程拿到锁后直接读取，不再重复渲染；不同内容的渲染互不等待
+
+锁文件由持有锁的进程在释放前删除，等待者拿到的如果是已删除的文件，重新打开路径上的新文件再加锁。
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SharedError(Exception):
+    """其他进程中同一次渲染抛出的错误"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    按 key 合并并发调用
+
+    shared_errors 中的异常类型会写入结果文件供其他进程复用（以 SharedError 重新抛出），
+    其他异常只在本进程内共享，其他进程会自行重试。
+    """
+
+    # 结果文件保留时间(秒)，只用于把结果交给正在等待的进程
+    OUTCOME_TTL = 300
+
+    def __init__(self, lock_dir, lock_timeout=60, shared_errors=()):
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self.shared_errors = tuple(shared_errors)
+        self._calls = {}
+        self._lock = threading.Lock()
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, fn):
+        """执行 fn()，同一 key 的并发调用只执行一次并共享结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_locked(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _outcome_path(self, key):
+        return os.path.join(self.lock_dir, f"{key}.json")
+
+    def _acquire(self, lock_path):
+        """给 key 的锁文件加锁并返回打开的文件，超时返回 None"""
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            f = open(lock_path, "a")
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        f.close()
+                        return None
+                    time.sleep(0.05)
+            # 上一个持有者释放前删除了锁文件，拿到的锁已经不在路径上，需要锁路径上的新文件
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _do_locked(self, key, fn):
+        started = time.time()
+        lock_path = os.path.join(self.lock_dir, f"{key}.lock")
+        f = self._acquire(lock_path)
+        if f is None:
+            logger.warning(f"等待其他进程渲染超时，直接渲染: {key}")
+            return fn()
+        with f:
+            try:
+                # 等锁期间其他进程已经完成了同一次渲染
+                outcome = self._read_outcome(key, started)
+                if outcome is not None:
+                    if "error" in outcome:
+                        raise SharedError(outcome["error"])
+                    return outcome["result"]
+
+                try:
+                    result = fn()
+                except self.shared_errors as e:
+                    self._write_outcome(key, {"error": str(e)})
+                    raise
+                self._write_outcome(key, {"result": result})
+                return result
+            finally:
+                # 先删除再解锁，之后到达的进程创建新的锁文件，锁文件不会随内容数量累积
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_outcome(self, key, started):
+        path = self._outcome_path(key)
+        try:
+            # 只接受开始等待之后写入的结果，更早的结果属于已经结束的调用
+            if os.path.getmtime(path) < started:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_outcome(self, key, outcome):
+        path = self._outcome_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(outcome, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"无法写入渲染结果文件 {path}: {e}")
+        self._prune()
+
+    def _prune(self):
+        """删除过期的结果文件"""
+        expiry_time = time.time() - self.OUTCOME_TTL
+        try:
+            with os.scandir(self.lock_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json") and entry.stat().st_mtime < expiry_time:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+        except OSError as e:
+            logger.error(f"清理渲染结果文件时出错: {e}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# 测试直接导入服务目录下的模块（transformer、singleflight 等）和仓库根目录下的 common 包
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
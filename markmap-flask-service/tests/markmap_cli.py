@@ -0,0 +1,62 @@
+"""
+用 markmap-cli 渲染黄金文件语料，取出渲染结果中的节点树
+
+与服务回退到命令行时的调用方式相同；优先使用 worker 目录中安装的 markmap-cli（cd worker && npm install），
+没有时使用 npx markmap-cli。
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+from transformer import _find_root_json, dumps
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+LOCAL_CLI = os.path.join(SERVICE_DIR, "worker", "node_modules", ".bin", "markmap")
+# 黄金文件对应的 markmap-cli 版本，与 worker/package.json 中的依赖一致
+CLI_VERSION = "0.18."
+
+
+def cli_command():
+    """markmap-cli 的命令，没有安装时返回 None"""
+    if os.path.exists(LOCAL_CLI):
+        return [LOCAL_CLI]
+    if os.environ.get("MARKMAP_GOLDEN_NPX") and shutil.which("npx"):
+        return ["npx", "markmap-cli"]
+    return None
+
+
+def cli_version(command):
+    result = subprocess.run(command + ["--version"], capture_output=True, text=True, check=True, timeout=120)
+    return result.stdout.strip()
+
+
+def has_expected(name):
+    """update_golden.py 是否已经用 markmap-cli 生成了这个文档的节点树"""
+    return os.path.exists(os.path.join(GOLDEN_DIR, name + ".json"))
+
+
+def corpus():
+    """语料的名称列表，每个文档的第一行标题为 golden-<名称>，用来在渲染结果中定位节点树"""
+    return sorted(name[:-3] for name in os.listdir(GOLDEN_DIR) if name.endswith(".md"))
+
+
+def read(name, ext):
+    with open(os.path.join(GOLDEN_DIR, name + ext), encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def render(name, command):
+    """用 markmap-cli 渲染语料中的文档，返回节点树的 JSON（与 transformer.dumps 的格式相同）"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_path = os.path.join(tmp_dir, "input.md")
+        html_path = os.path.join(tmp_dir, "output.html")
+        with open(md_path, "w", encoding="utf-8", newline="") as f:
+            f.write(read(name, ".md"))
+        subprocess.run(command + [md_path, "--no-open", "-o", html_path], capture_output=True, check=True, timeout=120)
+        with open(html_path, encoding="utf-8") as f:
+            found = _find_root_json(f.read(), f"golden-{name}")
+    if found is None:
+        raise RuntimeError(f"markmap-cli 的输出中找不到 {name} 的节点树")
+    return dumps(found[0])
@@ -0,0 +1,200 @@
+"""
+相同内容的并发渲染只启动一次渲染进程
+
+SingleFlight 在同一进程的线程之间、以及多个进程（gunicorn worker）之间合并相同 key 的调用，
+不同 key 的调用互不等待。最后一个测试通过上传接口并发提交相同内容，统计模拟的 markmap-cli 的启动次数。
+"""
+import importlib
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from singleflight import SharedError, SingleFlight
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STUBS_DIR = os.path.join(ROOT_DIR, "benchmarks", "stubs")
+
+KEY = "ab" + "0" * 62
+# 模拟渲染进程：记录一次启动，等待一段时间后输出结果
+RENDER_SCRIPT = "import sys, time; open(sys.argv[1], 'a').write('render\\n'); time.sleep(float(sys.argv[2])); print('<html>')"
+
+
+def spawn_render(log_path, seconds):
+    output = subprocess.run([sys.executable, "-c", RENDER_SCRIPT, str(log_path), str(seconds)],
+                            capture_output=True, text=True, check=True).stdout
+    return output.strip()
+
+
+def render_count(log_path):
+    if not os.path.exists(log_path):
+        return 0
+    with open(log_path) as f:
+        return len(f.readlines())
+
+
+def run_threads(flight, key, count, fn):
+    """count 个线程同时调用 flight.do(key, fn)，返回各自的结果或异常"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def call(index):
+        barrier.wait()
+        try:
+            results[index] = flight.do(key, fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_threads_share_one_render(tmp_path):
+    flight = SingleFlight(str(tmp_path / "locks"))
+    log_path = tmp_path / "renders.log"
+    results = run_threads(flight, KEY, 16, lambda: spawn_render(log_path, 0.5))
+    assert results == ["<html>"] * 16
+    assert render_count(log_path) == 1
+
+
+def test_threads_share_the_error(tmp_path):
+    flight = SingleFlight(str(tmp_path / "locks"))
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.3)
+        raise ValueError("渲染失败")
+
+    results = run_threads(flight, KEY, 8, fail)
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def _worker(lock_dir, log_path, barrier, output, threads, seconds, key):
+    # 与 gunicorn worker 相同：每个进程有自己的 SingleFlight，通过数据目录下的文件锁协调
+    flight = SingleFlight(lock_dir, shared_errors=(ValueError,))
+    barrier.wait()
+    for result in run_threads(flight, key, threads, lambda: spawn_render(log_path, seconds)):
+        output.put(result if isinstance(result, str) else repr(result))
+
+
+def run_processes(tmp_path, keys, threads, seconds):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(len(keys))
+    output = context.Queue()
+    lock_dir = str(tmp_path / "locks")
+    log_path = str(tmp_path / "renders.log")
+    processes = [context.Process(target=_worker, args=(lock_dir, log_path, barrier, output, threads, seconds, key))
+                 for key in keys]
+    start = time.monotonic()
+    for process in processes:
+        process.start()
+    results = [output.get(timeout=60) for _ in range(len(keys) * threads)]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    return results, time.monotonic() - start, render_count(log_path)
+
+
+def test_processes_share_one_render(tmp_path):
+    results, _, renders = run_processes(tmp_path, [KEY] * 4, threads=4, seconds=1.0)
+    assert results == ["<html>"] * 16
+    assert renders == 1
+    # 锁文件在释放前删除，不随内容数量累积
+    assert not [name for name in os.listdir(tmp_path / "locks") if name.endswith(".lock")]
+
+
+def test_processes_share_the_error(tmp_path):
+    lock_dir = str(tmp_path / "locks")
+    log_path = tmp_path / "renders.log"
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(3)
+    output = context.Queue()
+
+    def fail():
+        spawn_render(log_path, 0.5)
+        raise ValueError("语法错误")
+
+    def worker():
+        flight = SingleFlight(lock_dir, shared_errors=(ValueError,))
+        barrier.wait()
+        try:
+            flight.do(KEY, fail)
+        except (ValueError, SharedError) as e:
+            output.put(str(e))
+
+    processes = [context.Process(target=worker) for _ in range(3)]
+    for process in processes:
+        process.start()
+    assert [output.get(timeout=30) for _ in processes] == ["语法错误"] * 3
+    for process in processes:
+        process.join(timeout=30)
+    assert render_count(log_path) == 1
+
+
+def test_different_keys_do_not_wait(tmp_path):
+    # 两个 key 的前缀相同，按 key 加锁时两次渲染同时进行
+    keys = ["ab" + "1" * 62, "ab" + "2" * 62]
+    results, elapsed, renders = run_processes(tmp_path, keys, threads=1, seconds=1.0)
+    assert results == ["<html>"] * 2
+    assert renders == 2
+    assert elapsed < 1.8
+
+
+@pytest.fixture
+def markmap_app(tmp_path):
+    """用模拟的 markmap-cli 加载 markmap 服务，所有内容都交给命令行渲染"""
+    env = {
+        "DATA_DIR": str(tmp_path / "data"),
+        "PATH": STUBS_DIR + os.pathsep + os.environ.get("PATH", ""),
+        "STUB_LATENCY": "1",
+        "STUB_LATENCY_PER_KB": "0",
+        "STUB_CALL_LOG": str(tmp_path / "renders.log"),
+        "RATE_LIMIT_PER_MINUTE": "0",
+        "MARKMAP_POOL_SIZE": "0",
+        "MARKMAP_PYTHON_TRANSFORMER": "false",
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    sys.modules.pop("main", None)
+    try:
+        yield importlib.import_module("main").app, tmp_path / "renders.log"
+    finally:
+        sys.modules.pop("main", None)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_concurrent_identical_uploads_render_once(markmap_app):
+    app, log_path = markmap_app
+    content = "# 并发上传\n\n## 第一章\n\n- 要点\n".encode("utf-8")
+    count = 12
+    barrier = threading.Barrier(count)
+    responses = [None] * count
+
+    def upload(index):
+        client = app.test_client()
+        barrier.wait()
+        responses[index] = client.post("/upload", data=content, content_type="text/markdown")
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [200] * count
+    assert len({response.get_json()["base_name"] for response in responses}) == 1
+    assert render_count(log_path) == 1
@@ -0,0 +1,68 @@
+"""
+Python 转换器与 markmap-cli 的黄金文件对比
+
+tests/golden/<名称>.md 是语料，<名称>.json 是 markmap-cli 渲染结果中的节点树，只能由 update_golden.py 生成。
+Python 转换器（整篇转换和按段缓存转换）的输出必须与之逐字相同，否则服务会生成与 Node 渲染不同的导图。
+还没有生成 .json 的文档跳过对比；安装了 markmap-cli 时（worker 目录中 npm install 之后）还会直接与命令行的输出对比。
+"""
+import pytest
+
+from markmap_cli import cli_command, corpus, has_expected, read, render
+from transformer import SectionCache, Unsupported, dumps, transform
+
+CORPUS = corpus()
+
+
+def expected(name):
+    if not has_expected(name):
+        pytest.skip(f"{name}.json 还没有用 markmap-cli 生成，运行 tests/update_golden.py")
+    return read(name, ".json").strip()
+
+
+def test_corpus_is_complete():
+    assert CORPUS
+    for name in CORPUS:
+        assert read(name, ".md").splitlines()[0].lstrip("# ") == f"golden-{name}"
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_transform_matches_golden(name):
+    assert dumps(transform(read(name, ".md"))) == expected(name)
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_section_cache_matches_golden(name):
+    sections = SectionCache()
+    content = read(name, ".md")
+    assert sections.transform_json(content) == expected(name)
+    # 第二次全部命中段缓存，结果不变
+    assert sections.transform_json(content) == expected(name)
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_section_cache_matches_transform(name):
+    """按段缓存与整篇转换的结果相同，与是否已经生成黄金文件无关"""
+    sections = SectionCache()
+    content = read(name, ".md")
+    assert sections.transform_json(content) == dumps(transform(content))
+    assert sections.transform_json(content) == dumps(transform(content))
+
+
+@pytest.mark.parametrize("content", [
+    "# 代码\n```python\nprint(1)\n```\n",
+    "# 链接\n- [文档](https://example.com)\n",
+    "# 公式\n- $E = mc^2$\n",
+    "# 表格\n| a | b |\n|---|---|\n| 1 | 2 |\n",
+    "# 松散列表\n- a\n\n- b\n",
+    "# 标题结尾 ##\n",
+    "---\nmarkmap:\n  colorFreezeLevel: 2\n---\n# 配置\n",
+])
+def test_unsupported_content_falls_back_to_node(content):
+    with pytest.raises(Unsupported):
+        transform(content)
+
+
+@pytest.mark.skipif(cli_command() is None, reason="没有安装 markmap-cli")
+@pytest.mark.parametrize("name", CORPUS)
+def test_golden_matches_markmap_cli(name):
+    assert render(name, cli_command()) == expected(name)
@@ -0,0 +1,32 @@
+"""
+重新生成黄金文件：用 markmap-cli 渲染 tests/golden/*.md，节点树写入同名的 .json
+
+.json 只能由这里用 markmap-cli 生成，不能用 Python 转换器的输出代替，否则测试只是在和自己比较。
+升级 markmap-cli / markmap-lib 之后运行，再用 pytest 检查 Python 转换器是否仍然一致：
+    cd markmap-flask-service/worker && npm install && cd .. && python tests/update_golden.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from markmap_cli import CLI_VERSION, GOLDEN_DIR, cli_command, cli_version, corpus, render
+
+
+def main():
+    command = cli_command()
+    if command is None:
+        sys.exit("没有找到 markmap-cli，先在 worker 目录中执行 npm install，或设置 MARKMAP_GOLDEN_NPX=1 使用 npx")
+    version = cli_version(command)
+    if not version.lstrip("v").startswith(CLI_VERSION):
+        sys.exit(f"markmap-cli 版本为 {version}，黄金文件需要 {CLI_VERSION}x 的输出")
+    for name in corpus():
+        with open(os.path.join(GOLDEN_DIR, name + ".json"), "w", encoding="utf-8") as f:
+            f.write(render(name, command) + "\n")
+        print(f"已更新 {name}.json")
+    print(f"markmap-cli {version}")
+
+
+if __name__ == "__main__":
+    main()
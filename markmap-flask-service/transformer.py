@@ -0,0 +1,473 @@
+"""
+纯 Python 的 markmap 转换器
+
+只处理由 ATX 标题和紧凑列表组成的大纲类 Markdown（Dify agent 生成的思维导图基本都是这种），
+按 markmap-lib 的规则生成节点树，再填入从 markmap 渲染结果中截取的 HTML 模板。
+公式、代码块、表格、链接、图片、HTML 等内容交给 Node 渲染。
+
+模板在第一次使用时通过渲染探测文档获得，并用探测文档校验本模块的输出与 markmap-lib 一致，
+校验不通过时自动停用，所有内容都回退到 Node 渲染。
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.+?)[ \t]*$")
+_ITEM_RE = re.compile(r"^( *)([-+*]|(\d{1,9})([.)]))( {1,4})(\S.*)$")
+# 块级结构标记：出现在列表项文字开头时交给 Node 处理
+_BLOCK_START_RE = re.compile(r"^(#{1,6}(\s|$)|[-+*>](\s|$)|\d{1,9}[.)](\s|$)|```|~~~)")
+# 不支持的行内语法：HTML/实体、转义、链接/图片/复选框、公式、表格、下划线强调、自动链接
+_UNSUPPORTED_CHARS_RE = re.compile(r"[<>&\"\\\[\]$|_\t]|://|www\.")
+_DELIMITER_RE = re.compile(r"`[^`]*`|\*+|~+")
+_HTML_ESCAPE = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}
+
+
+class Unsupported(Exception):
+    """内容超出本转换器的支持范围"""
+
+
+def _is_blank(line):
+    return not line.strip()
+
+
+def _split_lines(content):
+    """按 markdown-it 的方式切分行（末尾换行不产生新行）"""
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
+    lines = content.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def _is_punct(ch):
+    return unicodedata.category(ch).startswith("P") or (ch.isascii() and not ch.isalnum() and not ch.isspace())
+
+
+def _check_neighbour(ch):
+    # 不同版本的 markdown-it 对非 ASCII 符号（如 ￥）是否算标点的判断不同，直接放弃
+    if not ch.isascii() and unicodedata.category(ch).startswith("S"):
+        raise Unsupported("强调标记旁的符号字符")
+
+
+def _render_inline(text):
+    """渲染行内 Markdown：仅支持加粗、斜体、删除线和行内代码"""
+    if _UNSUPPORTED_CHARS_RE.search(text):
+        raise Unsupported("行内语法")
+
+    tokens = []
+    pos = 0
+    for match in _DELIMITER_RE.finditer(text):
+        if match.start() > pos:
+            tokens.append(("text", text[pos:match.start()]))
+        run = match.group(0)
+        if run.startswith("`"):
+            code = run[1:-1]
+            if not code or code != code.strip() or run.count("`") != 2:
+                raise Unsupported("行内代码")
+            tokens.append(("code", code))
+        else:
+            if run not in ("*", "**", "~~"):
+                raise Unsupported("强调标记")
+            last = text[match.start() - 1] if match.start() > 0 else " "
+            nxt = text[match.end()] if match.end() < len(text) else " "
+            _check_neighbour(last)
+            _check_neighbour(nxt)
+            last_space, next_space = last.isspace(), nxt.isspace()
+            last_punct, next_punct = _is_punct(last), _is_punct(nxt)
+            can_open = not next_space and (not next_punct or last_space or last_punct)
+            can_close = not last_space and (not last_punct or next_space or next_punct)
+            tokens.append(("delim", run, can_open, can_close))
+        pos = match.end()
+    if pos < len(text):
+        tokens.append(("text", text[pos:]))
+
+    # 按 markdown-it 的 balance_pairs 规则配对，遇到需要拆分或交错的情况直接放弃
+    openers = []
+    pairs = {}
+    for i, token in enumerate(tokens):
+        if token[0] != "delim":
+            continue
+        _, run, can_open, can_close = token
+        same_marker = [j for j in openers if tokens[j][1][0] == run[0]]
+        if can_close and same_marker:
+            j = same_marker[-1]
+            if tokens[j][1] != run or openers[-1] != j:
+                raise Unsupported("强调标记嵌套")
+            openers.pop()
+            pairs[j] = i
+            pairs[i] = j
+        elif can_open:
+            openers.append(i)
+        else:
+            raise Unsupported("未配对的强调标记")
+    if openers:
+        raise Unsupported("未配对的强调标记")
+
+    tags = {"*": "em", "**": "strong", "~~": "s"}
+    html = []
+    for i, token in enumerate(tokens):
+        if token[0] == "text":
+            html.append("".join(_HTML_ESCAPE.get(c, c) for c in token[1]))
+        elif token[0] == "code":
+            html.append(f"<code>{token[1]}</code>")
+        else:
+            tag = tags[token[1]]
+            html.append(f"<{tag}>" if pairs[i] > i else f"</{tag}>")
+    return "".join(html)
+
+
+def _node(content, tag, start, end):
+    return {"content": content, "children": [], "payload": {"tag": tag, "lines": f"{start},{end}"}}
+
+
+def _clean_node(node):
+    """与 markmap-lib 的 cleanNode 相同：合并空根节点和只有一个空子节点的层级"""
+    while not node["content"] and len(node["children"]) == 1:
+        node = node["children"][0]
+    while len(node["children"]) == 1 and not node["children"][0]["content"]:
+        node = {**node, "children": node["children"][0]["children"]}
+    return {**node, "children": [_clean_node(child) for child in node["children"]]}
+
+
+def _parse(lines, offset=0):
+    """
+    把大纲类 Markdown 的行解析为未清理的节点树，offset 是第一行在文档中的行号
+
+    不支持的内容抛出 Unsupported。
+    """
+    if lines and lines[0].strip() == "---":
+        raise Unsupported("frontmatter")
+
+    root = {"content": "", "children": []}
+    headings = [(0, root)]
+    # 当前打开的列表项：[(内容起始列, 列表标记, 节点, 起始行)]
+    items = []
+    # 列表项结束行需要等到遇到下一个不属于它的非空行时才能确定
+    pending = []
+    in_list = False
+    after_blank = False
+
+    def close_items(level, end):
+        while len(items) > level:
+            _, _, node, _ = items.pop()
+            pending.append(node)
+        for node in pending:
+            node["payload"]["lines"] = node["payload"]["lines"].split(",")[0] + f",{offset + end}"
+        pending.clear()
+
+    for index, line in enumerate(lines):
+        if _is_blank(line):
+            after_blank = True
+            continue
+
+        heading = _HEADING_RE.match(line)
+        if heading and items and line.startswith(" "):
+            raise Unsupported("列表项内的标题")
+        if heading:
+            close_items(0, index)
+            in_list = False
+            level = len(heading.group(1))
+            text = heading.group(2)
+            if text.endswith("#"):
+                raise Unsupported("标题结尾的 #")
+            node = _node(_render_inline(text), f"h{level}", offset + index, offset + index + 1)
+            while headings[-1][0] >= level:
+                headings.pop()
+            headings[-1][1]["children"].append(node)
+            headings.append((level, node))
+            after_blank = False
+            continue
+
+        item = _ITEM_RE.match(line)
+        if not item:
+            raise Unsupported("非标题/列表内容")
+        if in_list and after_blank:
+            raise Unsupported("松散列表")
+
+        indent = len(item.group(1))
+        marker = item.group(2)
+        number, delimiter = item.group(3), item.group(4)
+        text = item.group(6).rstrip()
+        if _BLOCK_START_RE.match(text):
+            raise Unsupported("列表项内的块级结构")
+
+        # 找到新列表项的父级：缩进小于内容起始列的列表项都已结束
+        while items and indent < items[-1][0]:
+            _, _, node, _ = items.pop()
+            pending.append(node)
+        base = items[-1][0] if items else 0
+        if indent - base > 3:
+            raise Unsupported("缩进代码块")
+
+        kind = delimiter if number is not None else marker
+        parent_items = items[-1][2]["children"] if items else headings[-1][1]["children"]
+        starts_list = not (pending and parent_items and parent_items[-1] is pending[-1]
+                           and pending[-1]["_kind"] == kind)
+        if items and starts_list and number is not None and int(number) != 1:
+            # 嵌套的有序列表只有从 1 开始才能打断上一行段落
+            raise Unsupported("嵌套有序列表起始序号")
+
+        close_items(len(items), index)
+        node = _node(_render_inline(text), "li", offset + index, offset + index + 1)
+        node["_kind"] = kind
+        parent_items.append(node)
+        content_col = indent + len(marker) + len(item.group(5))
+        items.append((content_col, kind, node, index))
+        in_list = True
+        after_blank = False
+
+    close_items(0, len(lines))
+
+    def strip_private(node):
+        node.pop("_kind", None)
+        for child in node["children"]:
+            strip_private(child)
+
+    strip_private(root)
+    return root
+
+
+def transform(content):
+    """
+    将大纲类 Markdown 转换为 markmap 节点树
+
+    不支持的内容抛出 Unsupported。
+    """
+    return _clean_node(_parse(_split_lines(content)))
+
+
+def _heading_level(line):
+    match = _HEADING_RE.match(line)
+    return len(match.group(1)) if match else None
+
+
+def split_sections(lines, levels=None):
+    """
+    按最高一级的标题把文档切分为若干段，返回 [(起始行号, 行), ...]
+
+    这一级的标题总是挂在同一个父节点下，每一段可以单独解析，得到的顶层节点与整篇解析时相同；
+    第一个这样的标题之前的内容是单独的一段。缩进的标题不作为分段位置。
+    levels 是每一行的标题级别（不是标题时为 None），没有传入时计算。
+    """
+    if levels is None:
+        levels = [_heading_level(line) for line in lines]
+    present = [level for level in levels if level]
+    if not present:
+        return [(0, lines)]
+    top = min(present)
+    starts = [0] + [i for i, level in enumerate(levels)
+                    if i and level == top and not lines[i].startswith(" ")]
+    return [(start, lines[start:end]) for start, end in zip(starts, starts[1:] + [len(lines)])]
+
+
+class SectionCache:
+    """
+    按段缓存解析结果，编辑后的文档只重新解析改动过的段
+
+    文档按最高一级的标题分段；以标题开始、正文中还有更低一级标题的段继续按正文分段，
+    标题节点的子节点由各个子段拼接而成。只有列表的段（叶子段）整段解析，
+    键是段的内容和起始行号（节点中记录了行号），值是这一段顶层节点的 JSON；
+    在某一段中间插入或删除行时，之后各段的行号改变，需要重新解析。
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _leaf(self, start, lines):
+        key = (start, hashlib.sha1("\n".join(lines).encode("utf-8")).digest())
+        with self._lock:
+            nodes = self._entries.get(key)
+            if nodes is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return nodes
+            self.misses += 1
+        try:
+            nodes = [dumps(_clean_node(node)) for node in _parse(lines, start)["children"]]
+        except Unsupported as e:
+            # 不支持的段也缓存，再次出现时直接交给 Node
+            nodes = e
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = nodes
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return nodes
+
+    def _nodes(self, lines, levels, offset):
+        """
+        lines 解析后的顶层节点（已清理）的 JSON 列表
+
+        levels 是每一行的标题级别，lines 的第一行在文档中的行号为 offset。
+        """
+        nodes = []
+        for start, section in split_sections(lines, levels):
+            section_levels = levels[start:start + len(section)]
+            level = section_levels[0] if section and not section[0].startswith(" ") else None
+            body_levels = [lvl for lvl in section_levels[1:] if lvl]
+            # 正文中的标题都比段标题低一级以上时，标题节点的子节点就是正文单独解析的顶层节点
+            if level and body_levels and min(body_levels) > level:
+                heading = _parse(section[:1], offset + start)["children"][0]
+                children = self._nodes(section[1:], section_levels[1:], offset + start + 1)
+                nodes.append('{"content":' + json.dumps(heading["content"], ensure_ascii=False)
+                             + ',"children":[' + ",".join(children) + '],"payload":'
+                             + dumps(heading["payload"]) + "}")
+                continue
+            leaf = self._leaf(offset + start, section)
+            if isinstance(leaf, Unsupported):
+                raise leaf
+            nodes.extend(leaf)
+        return nodes
+
+    def transform_json(self, content):
+        """与 dumps(transform(content)) 的结果相同，不支持的内容抛出 Unsupported"""
+        lines = _split_lines(content)
+        if lines and lines[0].strip() == "---":
+            raise Unsupported("frontmatter")
+        nodes = self._nodes(lines, [_heading_level(line) for line in lines], 0)
+        # 根节点只有一个子节点时被合并为这个子节点
+        if len(nodes) == 1:
+            return nodes[0]
+        return '{"content":"","children":[' + ",".join(nodes) + "]}"
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def dumps(root):
+    """与 JSON.stringify 相同的紧凑序列化"""
+    return json.dumps(root, ensure_ascii=False, separators=(",", ":"))
+
+
+def _find_root_json(html, sentinel):
+    """在渲染结果中定位包含 sentinel 的最外层节点树 JSON，返回 (对象, 起始位置, 结束位置)"""
+    index = html.find(sentinel)
+    if index < 0:
+        return None
+    decoder = json.JSONDecoder()
+    found = None
+    start = html.rfind("{", 0, index)
+    while start >= 0 and index - start < 8192:
+        try:
+            obj, end = decoder.raw_decode(html, start)
+        except ValueError:
+            obj, end = None, start
+        if isinstance(obj, dict) and "children" in obj and end > index:
+            found = (obj, start, end)
+        start = html.rfind("{", 0, start)
+    return found
+
+
+# 探测文档：第一行标题是在渲染结果中定位节点树用的标记，第一个文档同时用于截取模板
+PROBES = [
+    """# markmap-probe-a
+
+## 标题 **加粗**
+
+- 列表项 `代码`
+  - 子项 *斜体*
+- **要点**：说明
+
+## 第二节 ~~删除~~
+
+1. 有序项
+2. 第二项
+   - 嵌套
+
+
+""",
+    """## markmap-probe-b
+- 没有一级标题
+#### 跳级标题
+* 星号列表
+  + 加号列表
+- 换一种标记
+### 另一个
+## 结尾
+""",
+]
+
+
+def _probe_title(probe):
+    return probe.split("\n", 1)[0].lstrip("# ")
+
+
+class MarkmapTemplate:
+    """
+    从 markmap 渲染结果中截取的 HTML 模板
+
+    render_node 是使用 Node 渲染 Markdown 并返回 HTML 的函数，只在第一次需要模板时调用；
+    传入 sections（SectionCache）时按段解析并复用未修改的段。
+    """
+
+    def __init__(self, render_node, sections=None):
+        self.render_node = render_node
+        self.sections = sections
+        self._lock = threading.Lock()
+        self._parts = None
+        self._ready = False
+        self._retry_at = 0
+
+    def _load(self):
+        html = self.render_node(PROBES[0])
+        found = _find_root_json(html, _probe_title(PROBES[0]))
+        if not found:
+            raise Unsupported("渲染结果中找不到节点树")
+        _, start, end = found
+        prefix, suffix = html[:start], html[end:]
+        if _probe_title(PROBES[0]) in prefix or _probe_title(PROBES[0]) in suffix:
+            raise Unsupported("模板中包含文档内容")
+
+        checks = [(PROBES[0], found[0])]
+        for probe in PROBES[1:]:
+            located = _find_root_json(self.render_node(probe), _probe_title(probe))
+            checks.append((probe, located[0] if located else None))
+        for probe, expected in checks:
+            if transform(probe) != expected:
+                raise Unsupported(f"转换结果与 markmap-lib 不一致: {_probe_title(probe)}")
+        return prefix, suffix
+
+    def parts(self):
+        """返回 (模板前缀, 模板后缀)，转换器不可用时返回 None"""
+        if self._ready:
+            return self._parts
+        with self._lock:
+            if not self._ready:
+                if time.monotonic() < self._retry_at:
+                    return None
+                try:
+                    self._parts = self._load()
+                    logger.info("markmap 模板已加载，纯大纲内容将直接在 Python 中渲染")
+                except Unsupported as e:
+                    logger.warning(f"markmap 转换器校验失败，所有内容使用 Node 渲染: {e}")
+                except Exception as e:
+                    # 渲染器暂时不可用时下次再试
+                    logger.warning(f"无法获取 markmap 模板: {e}")
+                    self._retry_at = time.monotonic() + 60
+                    return None
+                self._ready = True
+        return self._parts
+
+    def render(self, content):
+        """渲染 Markdown，内容不受支持或模板不可用时返回 None"""
+        try:
+            root = self.sections.transform_json(content) if self.sections is not None else dumps(transform(content))
+        except Unsupported:
+            return None
+        parts = self.parts()
+        if parts is None:
+            return None
+        prefix, suffix = parts
+        return prefix + root + suffix
@@ -0,0 +1,55 @@
+"""
+思维导图 Markdown 的快速检查
+
+在渲染之前检查：内容中至少有一个标题或列表项（否则只能得到一个节点），代码块是否闭合
+（没有闭合时之后的所有内容都会变成代码，不再是节点），节点数（标题和列表项）是否超过上限。
+开头的 front matter（markmap 的配置）和代码块中的内容不计入节点。行号从 1 开始。
+"""
+import re
+
+from common.lint import LintError
+
+_HEADING_RE = re.compile(r"^ {0,3}#{1,6}(?:[ \t]|$)")
+_LIST_ITEM_RE = re.compile(r"^[ \t]*(?:[-*+]|\d{1,9}[.)])[ \t]+\S")
+_FENCE_RE = re.compile(r"^[ \t]*(`{3,}|~{3,})(.*)$")
+
+
+def _skip_front_matter(lines):
+    """返回正文开始的行序号，front matter 没有结束时按普通内容处理"""
+    if lines and lines[0].strip() == "---":
+        for index in range(1, len(lines)):
+            if lines[index].strip() == "---":
+                return index + 1
+    return 0
+
+
+def validate(content, max_nodes=10000):
+    """检查思维导图的 Markdown，返回节点数，不通过时抛出 LintError"""
+    lines = content.splitlines()
+    fence = None
+    nodes = 0
+    for index in range(_skip_front_matter(lines), len(lines)):
+        line = lines[index]
+        match = _FENCE_RE.match(line)
+        if fence is not None:
+            marker, length, _ = fence
+            # 结束标记使用相同的字符，长度不短于开始标记，后面只能有空白
+            if match and match.group(1)[0] == marker and len(match.group(1)) >= length and not match.group(2).strip():
+                fence = None
+            continue
+        # 反引号代码块的说明文字中不能有反引号，否则是行内代码
+        if match and not (match.group(1)[0] == "`" and "`" in match.group(2)):
+            fence = (match.group(1)[0], len(match.group(1)), index + 1)
+            continue
+        if _HEADING_RE.match(line) or _LIST_ITEM_RE.match(line):
+            nodes += 1
+            if nodes > max_nodes:
+                raise LintError("TOO_MANY_NODES", f"标题和列表项超过 {max_nodes} 个", index + 1,
+                                "拆分为多个思维导图，或者删减细节层级")
+    if fence is not None:
+        raise LintError("UNCLOSED_FENCE", "代码块没有结束标记，之后的内容都不会成为节点", fence[2],
+                        f"在代码之后加上一行 {fence[0] * fence[1]}")
+    if not nodes:
+        raise LintError("NO_STRUCTURE", "没有标题或列表项，思维导图只有一个节点", None,
+                        "用 # 标题表示层级，或者用 - 列表组织要点，例如 # 主题 换行后写 ## 分支 和 - 要点")
+    return nodes
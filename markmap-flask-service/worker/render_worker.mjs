@@ -0,0 +1,74 @@
+// markmap 常驻渲染进程
+// 从 stdin 按行读取 {"id", "content"}，向 stdout 按行写回 {"id", "html"} 或 {"id", "error", "syntax"}
+// syntax 为 true 表示内容本身的错误（开头 front matter 的 YAML 格式错误），相同内容总是失败
+import readline from 'node:readline';
+import { mkdtempSync, rmSync } from 'node:fs';
+import { readFile, rm } from 'node:fs/promises';
+import { tmpdir } from 'node:os';
+import { join } from 'node:path';
+
+function send(message) {
+  process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+async function createRenderer() {
+  // 优先复用 markmap-cli 的生成逻辑，保证输出与命令行一致（包括工具栏）
+  const cli = await import('markmap-cli').catch(() => null);
+  if (cli && typeof cli.createMarkmap === 'function') {
+    const dir = mkdtempSync(join(tmpdir(), 'markmap-worker-'));
+    process.on('exit', () => rmSync(dir, { recursive: true, force: true }));
+    let seq = 0;
+    return async (content) => {
+      const output = join(dir, `${seq++}.html`);
+      try {
+        await cli.createMarkmap({ content, output, open: false });
+        return await readFile(output, 'utf8');
+      } finally {
+        await rm(output, { force: true });
+      }
+    };
+  }
+
+  const { Transformer } = await import('markmap-lib');
+  const { fillTemplate } = await import('markmap-render');
+  const transformer = new Transformer();
+  return async (content) => {
+    const { root, features, frontmatter } = transformer.transform(content);
+    const assets = transformer.getUsedAssets(features);
+    return fillTemplate(root, assets, { jsonOptions: frontmatter?.markmap });
+  };
+}
+
+let render;
+try {
+  render = await createRenderer();
+} catch (err) {
+  process.stderr.write(`markmap 渲染进程初始化失败: ${err.stack || err}\n`);
+  process.exit(1);
+}
+
+// 同一进程内的任务按顺序执行，避免共享的 transformer 状态互相干扰
+let chain = Promise.resolve();
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+rl.on('line', (line) => {
+  chain = chain.then(async () => {
+    let job;
+    try {
+      job = JSON.parse(line);
+    } catch (err) {
+      send({ id: null, error: `无法解析任务: ${err.message}` });
+      return;
+    }
+    try {
+      send({ id: job.id, html: await render(job.content || '') });
+    } catch (err) {
+      const syntax = Boolean(err && err.name === 'YAMLException');
+      send({ id: job.id, error: String((syntax ? err.message : err && err.stack) || err), syntax });
+    }
+  });
+});
+rl.on('close', () => {
+  chain.then(() => process.exit(0));
+});
+
+send({ ready: true });
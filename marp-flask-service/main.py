@@ -1,17 +1,199 @@
 from flask import Flask, request
+import os
+import sys
+import logging
+import subprocess
 import time
 
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import ContentStore, HASH_NAME_RE
+from common.expiry import ExpiryIndex, start_sweeper
+from common.objectstore import open_backend
+from common.upload import receive_request, UploadError
+from common.static import send_artifact
+from common.metrics import (CACHE_REQUESTS, INFLIGHT, RENDER_SECONDS, SUBPROCESS_FAILURES,
+                            SUBPROCESS_SPAWNS, instrument, stage, track)
+from common.ratelimit import TokenBuckets, RateLimited, Capacity, Overloaded, limit, retry_after_seconds, tenant_key
+from common.pool import PoolUnavailable
+from common.locks import KeyedLocks
+from render_pool import MarpRenderPool, RenderError
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+PUBLIC_URL = os.environ.get("PUBLIC_URL", "http://127.0.0.1:5004").rstrip('/')  # 返回给用户的链接前缀
+FILE_EXPIRY_HOURS = int(os.environ.get("FILE_EXPIRY_HOURS", "24"))  # 文件过期时间(小时)
+CLEANUP_INTERVAL_HOURS = int(os.environ.get("CLEANUP_INTERVAL_HOURS", "1"))  # 清理间隔(小时)
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", "0"))  # 数据目录的容量上限(字节)，超出时删除最久未读取的文件，0表示不限
+STORAGE_BACKEND_URL = os.environ.get("STORAGE_BACKEND_URL", "")  # 多个副本共用的对象存储，s3://bucket/前缀 或 file:///目录，为空时只使用本地目录
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))  # 上传内容大小上限(字节)，超出返回413
+# marp 转换进程池配置
+MARP_POOL_SIZE = int(os.environ.get("MARP_POOL_SIZE", "2"))  # 常驻转换进程数，0表示每次都调用marp命令行
+MARP_RENDER_TIMEOUT = int(os.environ.get("MARP_RENDER_TIMEOUT", "120"))  # 单次转换超时(秒)
+MARP_WORKER_MAX_JOBS = int(os.environ.get("MARP_WORKER_MAX_JOBS", "200"))  # 转换进程处理多少个任务后重启
+MARP_MAX_PENDING = int(os.environ.get("MARP_MAX_PENDING", "8"))  # 转换进程都在忙时最多排队的转换数，超出时返回503
+# 按租户限流配置，所有worker共用计数
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "30"))  # 每个租户每分钟可以发起的转换数，0表示不限流
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MINUTE)))  # 短时间内最多连续发起的转换数
+# 文件过期索引，清理时只处理已过期的文件
+expiry_index = ExpiryIndex(DATA_DIR, ttl=FILE_EXPIRY_HOURS * 3600, max_bytes=STORAGE_MAX_BYTES)
+# 按内容哈希保存文件: data/ab/cd/<hash>.md|.html|.pdf|.pptx
+store = ContentStore(DATA_DIR, index=expiry_index, tool="marp", backend=open_backend(STORAGE_BACKEND_URL))
+# 请求耗时和转换指标，通过 /metrics 提供
+instrument(app, "marp", DATA_DIR)
+# 只有拿到文件锁的一个进程执行清理
+start_sweeper(expiry_index, CLEANUP_INTERVAL_HOURS * 3600, bootstrap_files=store.iter_files)
+
+# 常驻转换进程池，在第一次转换时启动
+render_pool = MarpRenderPool(
+    size=MARP_POOL_SIZE,
+    timeout=MARP_RENDER_TIMEOUT,
+    max_jobs=MARP_WORKER_MAX_JOBS
+)
+
+# 每个转换进程是一个槽位，都在忙时最多 MARP_MAX_PENDING 个转换排队
+export_capacity = Capacity(max(MARP_POOL_SIZE, 1), MARP_MAX_PENDING, name="PPT 转换", initial_duration=10.0)
+track(INFLIGHT, lambda: export_capacity.active, tool="marp")
+
+# 按租户限流，租户由请求头中的API Key或租户标识确定
+rate_limits = TokenBuckets(DATA_DIR, "marp", RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
+# 可以导出的格式，html 在上传时生成，pdf 和 pptx 在第一次下载时生成
+EXPORT_FORMATS = ('.html', '.pdf', '.pptx')
+DOWNLOAD_NAMES = {'.pdf': 'slides.pdf', '.pptx': 'slides.pptx'}
+
+# 进程池不可用时使用的 marp 命令行，默认与转换进程使用同一份 marp-cli
+MARP_CLI = os.environ.get("MARP_CLI") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'worker', 'node_modules', '.bin', 'marp')
+
+# 同一个文件同一时刻只转换一次，后到的请求等待转换完成后直接使用结果
+export_locks = KeyedLocks()
+
+
+def convert_with_cli(md_path, out_path, fmt):
+    """进程池不可用时直接调用 marp 命令行转换"""
+    flags = {'html': [], 'pdf': ['--pdf'], 'pptx': ['--pptx']}[fmt]
+    SUBPROCESS_SPAWNS.inc(tool="marp", kind="cli")
+    try:
+        subprocess.run(
+            [MARP_CLI, md_path, '--no-stdin', *flags, '-o', out_path],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=MARP_RENDER_TIMEOUT
+        )
+    except subprocess.CalledProcessError as e:
+        SUBPROCESS_FAILURES.inc(tool="marp", kind="cli", reason="exit")
+        raise RenderError(e.stderr)
+    except subprocess.TimeoutExpired:
+        SUBPROCESS_FAILURES.inc(tool="marp", kind="cli", reason="timeout")
+        raise RenderError(f"转换超过 {MARP_RENDER_TIMEOUT} 秒未完成")
+    except OSError as e:
+        SUBPROCESS_FAILURES.inc(tool="marp", kind="cli", reason="start")
+        raise RenderError(f"无法执行 marp 命令行: {e}")
+
+
+def export(content_hash, ext):
+    """
+    生成 markdown 对应的 html/pdf/pptx 文件并返回路径，已经生成过时直接返回
+
+    markdown 不存在（未上传或已过期）时返回 None，转换失败时抛出 RenderError。
+    """
+    if store.exists(content_hash, ext):
+        CACHE_REQUESTS.inc(tool="marp", result="hit")
+        return store.path(content_hash, ext)
+    if not store.exists(content_hash, '.md'):
+        return None
+    CACHE_REQUESTS.inc(tool="marp", result="miss")
+
+    with export_locks.hold((content_hash, ext)):
+        # 等待期间其他请求可能已经生成
+        if store.exists(content_hash, ext):
+            return store.path(content_hash, ext)
+        md_path = store.path(content_hash, '.md')
+        with export_capacity.admit(), store.tempdir() as tmp_dir:
+            out_path = os.path.join(tmp_dir, 'slides' + ext)
+            fmt = ext.lstrip('.')
+            start = time.perf_counter()
+            renderer = 'pool'
+            try:
+                render_pool.convert(md_path, out_path, fmt)
+            except PoolUnavailable as e:
+                logger.info(f"转换进程池不可用，使用marp命令行: {e}")
+                start = time.perf_counter()
+                renderer = 'cli'
+                convert_with_cli(md_path, out_path, fmt)
+            RENDER_SECONDS.observe(time.perf_counter() - start, tool="marp", format=fmt, renderer=renderer)
+            if not os.path.isfile(out_path):
+                raise RenderError("marp-cli 没有生成输出文件")
+            logger.info(f"已生成 {store.name(content_hash, ext)}")
+            return store.write_file(content_hash, ext, out_path)
+
+
+@app.errorhandler(RateLimited)
+@app.errorhandler(Overloaded)
+def too_busy(e):
+    status = 429 if isinstance(e, RateLimited) else 503
+    return str(e), status, {'Retry-After': retry_after_seconds(e.retry_after)}
+
+
+def upload_message(content_hash):
+    """上传接口返回的预览和下载链接"""
+    base_url = f'{PUBLIC_URL}/{content_hash}'
+    return f'Markdown 文件已保存\n预览链接: {base_url}.html \n下载链接: {base_url}.pptx \nPDF下载链接: {base_url}.pdf'
+
 
 @app.route('/upload', methods=['POST'])
+@limit(rate_limits, lambda e: (str(e), 429))
 def upload_markdown():
-    content = request.get_data(as_text=True)
-    file_name = str(int(time.time())) + ".md"
-    with open(f"data/{file_name}", 'w', encoding='utf-8') as f:
-        f.write(content)
-    return f'Markdown 文件已保存\n预览链接: http://127.0.0.1:5005/{file_name} \n下载链接: http://127.0.0.1:5005/{file_name}?pptx'
+    # 请求体流式写入临时文件，保存时直接移动，不在内存中保留内容
+    try:
+        with stage("marp", "receive"):
+            upload = receive_request(request, DATA_DIR, MAX_UPLOAD_BYTES)
+        with upload, stage("marp", "save"):
+            upload.save(store, '.md')
+            content_hash = upload.digest
+    except UploadError as e:
+        return str(e), e.status
+    # 预览需要的 html 立即生成，pdf 和 pptx 等到第一次下载时再生成
+    try:
+        with stage("marp", "render"):
+            export(content_hash, '.html')
+    except RenderError as e:
+        logger.error(f"生成 PPT 预览失败: {e}")
+        return 'PPT 预览生成失败', 500
+    return upload_message(content_hash)
+
 
+@app.route('/<filename>', methods=['GET'])
+def get_slides(filename):
+    """提供预览和下载，pdf/pptx 第一次请求时生成，之后作为静态文件返回"""
+    match = HASH_NAME_RE.match(filename)
+    if not match or match.group(2) not in EXPORT_FORMATS + ('.md',):
+        return '文件不存在', 404
+    content_hash, ext = match.groups()
+    options = {'as_attachment': ext in DOWNLOAD_NAMES, 'download_name': DOWNLOAD_NAMES.get(ext)}
+    # 已经生成过的文件直接返回，不存在时再生成
+    file_path = store.resolve(filename, check=False)
+    response = send_artifact(file_path, **options) if file_path else None
+    if response is None and ext != '.md':
+        # 只有需要转换时才消耗令牌
+        if store.exists(content_hash, '.md'):
+            rate_limits.check(tenant_key(request.headers, request.remote_addr))
+        try:
+            file_path = export(content_hash, ext)
+        except RenderError as e:
+            logger.error(f"生成 {filename} 失败: {e}")
+            return 'PPT 生成失败', 500
+        response = send_artifact(file_path, **options) if file_path else None
+    if response is None:
+        return '文件不存在或已过期', 404
+    return response
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5004)
+    app.run(host='0.0.0.0', port=5004, threaded=True)
@@ -0,0 +1,46 @@
+"""
+marp 常驻转换进程池
+
+每个工作进程是一个长期运行的 Node 进程（worker/render_worker.mjs），已经加载好 marp-cli，
+通过 stdin/stdout 按行交换 JSON，避免每次转换都执行 npx 查找和 Node 冷启动。
+转换结果由 marp-cli 直接写入任务指定的输出文件。
+进程的启动、回收和超时处理见 common.pool，这里只定义任务内容。
+"""
+import os
+
+from common.pool import ProcessPool, WorkerError, WorkerTimeout
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker", "render_worker.mjs")
+
+
+class RenderError(Exception):
+    """marp-cli 转换失败"""
+
+
+class RenderTimeout(RenderError):
+    """单次转换超时"""
+
+
+class MarpRenderPool(ProcessPool):
+    """marp 转换进程池，不可用时调用方回退到 marp 命令行"""
+
+    def __init__(self, size=2, timeout=120, max_jobs=200, start_timeout=30, retry_interval=60, command=None):
+        super().__init__(
+            command or ["node", WORKER_SCRIPT],
+            size=size,
+            timeout=timeout,
+            max_jobs=max_jobs,
+            start_timeout=start_timeout,
+            retry_interval=retry_interval,
+            name="marp"
+        )
+
+    def convert(self, input_path, output_path, fmt):
+        """把 input_path 的 markdown 转换为 fmt（html、pdf 或 pptx）格式，写入 output_path"""
+        job = {"input": os.path.abspath(input_path), "output": os.path.abspath(output_path), "format": fmt}
+        try:
+            self.request(job)
+        except WorkerTimeout as e:
+            raise RenderTimeout(str(e))
+        except WorkerError as e:
+            raise RenderError(str(e))
@@ -0,0 +1,56 @@
+// marp 常驻转换进程
+// 从 stdin 按行读取 {"id", "input", "output", "format"}，向 stdout 按行写回 {"id", "ok"} 或 {"id", "error"}
+// format 为 html、pdf 或 pptx，输出文件由 marp-cli 直接写到 output
+import readline from 'node:readline';
+
+const FORMAT_FLAGS = { html: [], pdf: ['--pdf'], pptx: ['--pptx'] };
+
+// stdout 用于交换任务结果，marp-cli 的日志全部转到 stderr
+const out = process.stdout.write.bind(process.stdout);
+console.log = console.info = (...args) => console.error(...args);
+
+function send(message) {
+  out(JSON.stringify(message) + '\n');
+}
+
+let marpCli;
+try {
+  ({ marpCli } = await import('@marp-team/marp-cli'));
+} catch (err) {
+  process.stderr.write(`marp 转换进程初始化失败: ${err.stack || err}\n`);
+  process.exit(1);
+}
+
+async function convert(job) {
+  const flags = FORMAT_FLAGS[job.format];
+  if (!flags) throw new Error(`不支持的格式: ${job.format}`);
+  // --no-stdin：任务通过 stdin 传递，不能让 marp-cli 读取 stdin 作为输入
+  const code = await marpCli([job.input, '--no-stdin', ...flags, '-o', job.output]);
+  if (code !== 0) throw new Error(`marp-cli 退出码 ${code}`);
+}
+
+// 同一进程内的任务按顺序执行，多个任务并行由进程池中的多个进程完成
+let chain = Promise.resolve();
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+rl.on('line', (line) => {
+  chain = chain.then(async () => {
+    let job;
+    try {
+      job = JSON.parse(line);
+    } catch (err) {
+      send({ id: null, error: `无法解析任务: ${err.message}` });
+      return;
+    }
+    try {
+      await convert(job);
+      send({ id: job.id, ok: true });
+    } catch (err) {
+      send({ id: job.id, error: String((err && err.message) || err) });
+    }
+  });
+});
+rl.on('close', () => {
+  chain.then(() => process.exit(0));
+});
+
+send({ ready: true });
@@ -0,0 +1,80 @@
+"""
+比较常驻渲染服务和每次调用 mmdc 的渲染耗时
+
+用法: python benchmark.py [--runs 20] [--concurrency 4] [--mode both|pool|mmdc]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from renderer_client import MermaidRenderer
+
+DIAGRAMS = [
+    "graph TD\n    A[开始] --> B{是否登录}\n    B -->|是| C[进入首页]\n    B -->|否| D[跳转登录页]\n    D --> B\n",
+    "sequenceDiagram\n    用户->>Dify: 提问\n    Dify->>工具服务: 上传 mermaid\n    工具服务-->>Dify: 预览链接\n    Dify-->>用户: 回答\n",
+    "gantt\n    title 项目计划\n    dateFormat YYYY-MM-DD\n    section 开发\n    需求分析 :a1, 2024-01-01, 3d\n    编码 :after a1, 5d\n",
+]
+
+
+def render_mmdc(code):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.mmd")
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write(code)
+        subprocess.run(
+            ["mmdc", "-p", "puppeteer-config.json", "-c", "config.json", "-i", input_path,
+             "-o", os.path.join(tmp_dir, "out.svg")],
+            check=True,
+            capture_output=True,
+        )
+
+
+def measure(name, render, runs, concurrency):
+    # 预热一次，常驻渲染服务的启动时间不计入结果
+    render(DIAGRAMS[0])
+    durations = []
+
+    def job(i):
+        started = time.perf_counter()
+        render(DIAGRAMS[i % len(DIAGRAMS)])
+        durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(job, range(runs)))
+    elapsed = time.perf_counter() - started
+
+    durations.sort()
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(
+        f"{name:>5}: {runs} 次, 并发 {concurrency}, 平均 {statistics.mean(durations) * 1000:.0f} ms, "
+        f"p50 {statistics.median(durations) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+        f"吞吐 {runs / elapsed:.1f} 次/秒"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较 mermaid 渲染方式的耗时")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=["both", "pool", "mmdc"], default="both")
+    parser.add_argument("--socket", default=os.environ.get("MERMAID_RENDERER_SOCKET", "/tmp/mermaid-renderer.sock"))
+    args = parser.parse_args()
+
+    if args.mode in ("both", "pool"):
+        renderer = MermaidRenderer(args.socket)
+        measure("pool", renderer.render, args.runs, args.concurrency)
+        print(f"渲染服务状态: {renderer.stats()}")
+    if args.mode in ("both", "mmdc"):
+        measure("mmdc", render_mmdc, args.runs, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,523 @@
-from flask import Flask, request, send_from_directory
-import time
+from flask import Flask, request, jsonify
+import os
+import sys
+import json
+import logging
 import subprocess
+import time
+
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import ContentStore, hash_content, HASH_NAME_RE
+from common.expiry import ExpiryIndex, start_sweeper
+from common.objectstore import open_backend
+from common.jobs import JobQueue, QueueFull, JobTimeout
+from common.upload import receive_request, UploadError
+from common.static import send_artifact
+from common.lint import LintError, NegativeCache
+from common.metrics import (CACHE_REQUESTS, INFLIGHT, QUEUE_DEPTH, RENDER_SECONDS, SUBPROCESS_FAILURES,
+                            SUBPROCESS_SPAWNS, instrument, stage, track)
+from common.ratelimit import TokenBuckets, RateLimited, Capacity, Overloaded, limit, retry_after_seconds, tenant_key
+from common.locks import KeyedLocks
+from renderer_client import MermaidRenderer, RenderError, RendererBusy, RendererUnavailable, RenderSyntaxError
+from validation import MERMAID_BLOCK_RE, syntax_error, validate_diagram, validate_markdown
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+FILE_EXPIRY_HOURS = int(os.environ.get("FILE_EXPIRY_HOURS", "24"))  # 文件过期时间(小时)
+CLEANUP_INTERVAL_HOURS = int(os.environ.get("CLEANUP_INTERVAL_HOURS", "1"))  # 清理间隔(小时)
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", "0"))  # 数据目录的容量上限(字节)，超出时删除最久未读取的文件，0表示不限
+STORAGE_BACKEND_URL = os.environ.get("STORAGE_BACKEND_URL", "")  # 多个副本共用的对象存储，s3://bucket/前缀 或 file:///目录，为空时只使用本地目录
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))  # 上传内容大小上限(字节)，超出返回413
+# 所有接口的请求体都不能超过上传上限，包括批量渲染接口
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+# 常驻渲染服务配置
+MERMAID_RENDERER = os.environ.get("MERMAID_RENDERER", "pool")  # pool(常驻浏览器) 或 mmdc(每次启动浏览器)
+MERMAID_RENDERER_SOCKET = os.environ.get("MERMAID_RENDERER_SOCKET", "/tmp/mermaid-renderer.sock")
+MERMAID_RENDER_TIMEOUT = int(os.environ.get("MERMAID_RENDER_TIMEOUT", "60"))  # 等待渲染结果的超时(秒)，包括排队时间
+MERMAID_BATCH_MAX = int(os.environ.get("MERMAID_BATCH_MAX", "20"))  # 批量渲染接口一次最多处理的图表数
+# 渲染前的检查，默认值与 mermaid 的 maxTextSize、maxEdges 相同
+MERMAID_MAX_TEXT_SIZE = int(os.environ.get("MERMAID_MAX_TEXT_SIZE", "50000"))  # 单个图表代码的字符数上限
+MERMAID_MAX_EDGES = int(os.environ.get("MERMAID_MAX_EDGES", "500"))  # 流程图的连线数上限
+# 后台任务队列配置
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # 执行渲染任务的线程数
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", "32"))  # 最多排队的任务数，超出时返回429
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", "110"))  # 单个任务超时(秒)
+# 按租户限流配置，所有worker共用计数
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))  # 每个租户每分钟可以渲染的图表数，0表示不限流
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MINUTE)))  # 短时间内最多连续渲染的图表数
+# 文件过期索引，清理时只处理已过期的文件
+expiry_index = ExpiryIndex(DATA_DIR, ttl=FILE_EXPIRY_HOURS * 3600, max_bytes=STORAGE_MAX_BYTES)
+# 按内容哈希保存文件: data/ab/cd/<hash>.md|.svg|.png
+store = ContentStore(DATA_DIR, index=expiry_index, tool="mermaid", backend=open_backend(STORAGE_BACKEND_URL))
+# 请求耗时和渲染指标，通过 /metrics 提供
+instrument(app, "mermaid", DATA_DIR)
+# 只有拿到文件锁的一个进程执行清理
+start_sweeper(expiry_index, CLEANUP_INTERVAL_HOURS * 3600, bootstrap_files=store.iter_files)
+# 渲染器报告语法错误的内容: data/ab/cd/<hash>.error，相同内容再次上传时直接返回错误
+failures = NegativeCache(store)
+
+# 常驻渲染服务，第一次渲染时自动启动，所有进程共用
+renderer = MermaidRenderer(MERMAID_RENDERER_SOCKET, timeout=MERMAID_RENDER_TIMEOUT) if MERMAID_RENDERER == "pool" else None
+
+# mmdc 的配置文件与服务代码放在一起，不依赖当前工作目录（网关中工作目录不是服务目录）
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+PUPPETEER_CONFIG = os.path.join(SERVICE_DIR, 'puppeteer-config.json')
+MMDC_CONFIG = os.path.join(SERVICE_DIR, 'config.json')
+
+
+def render_with_mmdc(md_path, ext, count=1):
+    """
+    启动一次浏览器渲染 markdown 中的前 count 个图表，返回 (每个图表的字节, 语法错误)，失败的图表为 None
+
+    mmdc 按顺序渲染，遇到第一个出错的图表就退出；退出码不为 0 且输出中有 mermaid 的语法错误时返回对应的 LintError。
+    """
+    with store.tempdir() as tmp_dir:
+        # markdown 输入时 mmdc 为每个图表生成 out-1.svg、out-2.svg ...
+        SUBPROCESS_SPAWNS.inc(tool="mermaid", kind="cli")
+        start = time.perf_counter()
+        error = None
+        try:
+            result = subprocess.run([
+                'mmdc', '-p', PUPPETEER_CONFIG, '-c', MMDC_CONFIG, '-i',
+                md_path, '-o', os.path.join(tmp_dir, 'out' + ext)
+            ], capture_output=True, text=True, timeout=MERMAID_RENDER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            SUBPROCESS_FAILURES.inc(tool="mermaid", kind="cli", reason="timeout")
+            logger.error(f"mmdc 超过 {MERMAID_RENDER_TIMEOUT} 秒未完成")
+            return [None] * count, None
+        RENDER_SECONDS.observe(time.perf_counter() - start, tool="mermaid", format=ext.lstrip('.'), renderer="cli")
+        if result.returncode != 0:
+            SUBPROCESS_FAILURES.inc(tool="mermaid", kind="cli", reason="exit")
+            output = (result.stderr or result.stdout or '').strip()
+            logger.warning(f"mmdc 退出码 {result.returncode}: {output[-1000:]}")
+            error = syntax_error(output)
+        outputs = []
+        for i in range(1, count + 1):
+            out_path = os.path.join(tmp_dir, f'out-{i}{ext}')
+            if os.path.exists(out_path):
+                with open(out_path, 'rb') as f:
+                    outputs.append(f.read())
+            else:
+                outputs.append(None)
+        return outputs, error
+
+
+def render_diagram(content, md_path, ext):
+    """
+    渲染第一个图表并返回 SVG/PNG 字节，常驻渲染服务不可用时回退到 mmdc
+
+    图表有语法错误时抛出 LintError，其他原因（超时等）失败时返回 None。
+    """
+    if renderer is not None:
+        match = MERMAID_BLOCK_RE.search(content)
+        if match:
+            start = time.perf_counter()
+            try:
+                result = renderer.render(match.group(1), ext.lstrip('.'))
+                RENDER_SECONDS.observe(time.perf_counter() - start, tool="mermaid", format=ext.lstrip('.'), renderer="sidecar")
+                return result
+            except RenderSyntaxError as e:
+                logger.warning(f"Mermaid 图表语法错误: {e}")
+                raise syntax_error(str(e), strict=False)
+            except RenderError as e:
+                # 超时或解析通过之后渲染出错，可能与图表内容无关，不记录为语法错误
+                logger.warning(f"Mermaid 图表渲染失败: {e}")
+                return None
+            except RendererUnavailable as e:
+                logger.warning(f"常驻渲染服务不可用，使用mmdc: {e}")
+    outputs, error = render_with_mmdc(md_path, ext)
+    if outputs[0] is None and error is not None:
+        raise error
+    return outputs[0]
+
+
+def render_failed(content_hash, error):
+    """记录渲染器报告的语法错误，相同内容再次上传时直接返回，不再渲染"""
+    failures.put(content_hash, error)
+    return error
+
+
+def wrap_diagram(code):
+    """单个图表保存为 markdown 时的内容，与上传接口相同，相同图表得到相同的文件名"""
+    return '```mermaid\n' + code + '\n```'
+
+
+def batch_error(result):
+    """批量渲染中单个图表的错误：语法错误为 LintError，其他为错误信息"""
+    if isinstance(result, RendererBusy):
+        return '渲染服务繁忙，请稍后重试'
+    if isinstance(result, RenderSyntaxError):
+        return syntax_error(str(result), strict=False)
+    return str(result)
+
+
+def render_batch(contents, ext):
+    """
+    渲染多个单图表 markdown，返回与 contents 对应的 (字节, 错误) 列表，错误为 LintError 或错误信息
+
+    使用常驻渲染服务时所有图表在同一个连接中提交、由多个页面并行渲染；
+    回退到 mmdc 时合并为一个 markdown 文件，只启动一次浏览器。mmdc 在第一个出错的图表处退出，
+    之后的图表再合并渲染一次，直到全部完成；所有重试共用 MERMAID_RENDER_TIMEOUT，超出时剩下的图表记为失败。
+    """
+    if renderer is not None:
+        try:
+            results = renderer.render_many([MERMAID_BLOCK_RE.search(c).group(1) for c in contents], ext.lstrip('.'))
+            return [(result, None) if isinstance(result, bytes) else (None, batch_error(result)) for result in results]
+        except RendererUnavailable as e:
+            logger.warning(f"常驻渲染服务不可用，使用mmdc: {e}")
+
+    results = []
+    deadline = time.monotonic() + MERMAID_RENDER_TIMEOUT
+    while len(results) < len(contents) and time.monotonic() < deadline:
+        remaining = contents[len(results):]
+        with store.tempdir() as tmp_dir:
+            md_path = os.path.join(tmp_dir, 'batch.md')
+            with open(md_path, 'w', encoding='utf-8') as f:
+                f.write('\n\n'.join(remaining))
+            outputs, error = render_with_mmdc(md_path, ext, count=len(remaining))
+        # 语法错误属于第一个没有生成的图表，它之前的图表都已生成
+        failed = next((i for i, output in enumerate(outputs) if output is None), len(outputs))
+        results.extend((output, None) for output in outputs[:failed])
+        if failed < len(outputs):
+            results.append((None, error if error is not None else 'Mermaid 图表生成失败'))
+    results.extend((None, 'Mermaid 图表生成失败') for _ in range(len(contents) - len(results)))
+    return results
+
+
+@app.errorhandler(RendererBusy)
+def renderer_busy(e):
+    return '渲染服务繁忙，请稍后重试', 503, {'Retry-After': '5'}
+
+
+class DiagramFailed(Exception):
+    """图表渲染失败"""
+
+
+def save_diagram(upload):
+    """检查并保存上传的 markdown，返回内容哈希；图表有误或之前渲染时报告过语法错误时抛出 LintError"""
+    # 防止格式不对
+    if not upload.contains(b'```mermaid'):
+        upload = upload.wrap(b'```mermaid\n', b'\n```')
+    with upload:
+        with stage("mermaid", "lint"):
+            validate_markdown(upload.read_text(), MERMAID_MAX_TEXT_SIZE, MERMAID_MAX_EDGES)
+            error = failures.get(upload.digest)
+        if error is not None:
+            CACHE_REQUESTS.inc(tool="mermaid", result="negative")
+            raise error
+        upload.save(store, '.md')
+        return upload.digest
+
+
+def receive_diagram():
+    """流式接收上传的 markdown 并保存，返回内容哈希"""
+    with receive_request(request, DATA_DIR, MAX_UPLOAD_BYTES) as upload:
+        return save_diagram(upload)
+
+
+def diagram_result(content_hash):
+    """图表的文件名和预览链接"""
+    file_name = store.name(content_hash, '.svg')
+    return {"file_name": file_name, "url": f'http://127.0.0.1:5002/svg/{file_name}'}
+
+
+def create_diagram(payload):
+    """后台任务：为已保存的 markdown 生成 SVG，返回文件名和预览链接"""
+    content_hash = payload["content_hash"]
+    md_path = store.path(content_hash, '.md')
+    # 相同内容已经生成过图片时不再渲染，也不需要读取 markdown
+    if store.exists(content_hash, '.svg'):
+        CACHE_REQUESTS.inc(tool="mermaid", result="hit")
+        return diagram_result(content_hash)
+    CACHE_REQUESTS.inc(tool="mermaid", result="miss")
+    with open(md_path, encoding='utf-8', newline='') as f:
+        content = f.read()
+    with stage("mermaid", "render"):
+        try:
+            svg = render_diagram(content, md_path, '.svg')
+        except LintError as e:
+            raise render_failed(content_hash, e)
+    if svg is None:
+        raise DiagramFailed('Mermaid 图表生成失败')
+    with stage("mermaid", "write"):
+        store.write(content_hash, '.svg', svg)
+    return diagram_result(content_hash)
+
+
+# 按租户限流，租户由请求头中的API Key或租户标识确定
+rate_limits = TokenBuckets(DATA_DIR, "mermaid", RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
+
+def rate_limited_json(e):
+    return jsonify({"success": False, "message": "请求过于频繁，请稍后重试", "error": str(e)}), 429
+
+
+# 渲染任务队列，同步上传接口也通过它执行渲染
+upload_jobs = JobQueue(
+    DATA_DIR,
+    create_diagram,
+    workers=JOB_WORKERS,
+    max_queue=JOB_MAX_QUEUE,
+    timeout=JOB_TIMEOUT,
+    ttl=FILE_EXPIRY_HOURS * 3600
+)
+track(QUEUE_DEPTH, upload_jobs.depth, tool="mermaid")
+
+# 批量渲染和 PNG 在请求线程中渲染，与任务队列使用同样的并发数和排队上限
+render_capacity = Capacity(JOB_WORKERS, JOB_MAX_QUEUE, name="Mermaid 渲染")
+track(INFLIGHT, lambda: render_capacity.active, tool="mermaid")
+# 同一张 PNG 同一时刻只渲染一次，后到的请求等待渲染完成后直接使用结果
+png_locks = KeyedLocks()
+
+
+def admit_render():
+    """请求线程中的渲染：任务队列已满或请求线程中的渲染已满时抛出 Overloaded"""
+    try:
+        upload_jobs.admit()
+    except QueueFull as e:
+        raise Overloaded(str(e), e.retry_after)
+    return render_capacity.admit()
+
+
+def overloaded_headers(e):
+    return {'Retry-After': retry_after_seconds(e.retry_after)}
+
 
 # 上传接口
 @app.route('/upload', methods=['POST'])
+@limit(rate_limits, lambda e: (str(e), 429))
 def upload_markdown():
-    content = request.get_data(as_text=True)
-    time_name = str(int(time.time()))
-    file_name = time_name + ".md"
-    # 防止格式不对
-    if '```mermaid' not in content:
-        content = '```mermaid\n' + content + '\n```'
-    with open(f"data/{file_name}", 'w', encoding='utf-8') as f:
-        f.write(content)
-    result = subprocess.run([
-        'mmdc', '-p', 'puppeteer-config.json', '-c', 'config.json', '-i',
-        f'./data/{file_name}'
-    ])
-    print(result.stdout)
-    return f'Markdown 文件已保存\n预览链接: http://127.0.0.1:5002/svg/{file_name}-1.svg'
+    try:
+        # 队列已满时在读取请求体之前拒绝
+        upload_jobs.admit()
+        with stage("mermaid", "receive"):
+            content_hash = receive_diagram()
+        with stage("mermaid", "job"):
+            result = upload_jobs.run({"content_hash": content_hash})
+    except UploadError as e:
+        return str(e), e.status
+    except LintError as e:
+        return str(e), 400
+    except QueueFull as e:
+        return '服务繁忙，请稍后重试', 429, {'Retry-After': retry_after_seconds(e.retry_after)}
+    except JobTimeout:
+        return 'Mermaid 图表生成超时', 504
+    except DiagramFailed as e:
+        return str(e), 500
+    return f'Markdown 文件已保存\n预览链接: {result["url"]}'
+
+
+# 异步上传接口，立即返回任务ID
+@app.route('/jobs', methods=['POST'])
+@limit(rate_limits, rate_limited_json)
+def create_job():
+    try:
+        upload_jobs.admit()
+        content_hash = receive_diagram()
+        job_id = upload_jobs.submit({"content_hash": content_hash}, webhook=request.args.get('webhook'))
+    except UploadError as e:
+        return jsonify({"success": False, "message": "上传内容不合法", "error": str(e)}), e.status
+    except LintError as e:
+        return jsonify({"success": False, "message": "图表检查未通过", "error": str(e), "details": e.to_dict()}), 400
+    except QueueFull as e:
+        return jsonify({"success": False, "message": "服务繁忙，请稍后重试", "error": str(e)}), 429, {'Retry-After': retry_after_seconds(e.retry_after)}
+    except ValueError as e:
+        return jsonify({"success": False, "message": "参数错误", "error": str(e)}), 400
+    return jsonify({
+        "success": True,
+        "message": "任务已提交",
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f'http://127.0.0.1:5002/jobs/{job_id}'
+    }), 202
+
+
+# 查询异步任务状态，成功时 result 中包含文件名和预览链接
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在", "error": "请求的任务未找到或已过期"}), 404
+    return jsonify({"success": True, "job": job})
+
+
+# 批量渲染接口
+@app.route('/render/batch', methods=['POST'])
+def render_batch_diagrams():
+    """
+    一次渲染多个图表
+
+    请求体可以是 JSON {"diagrams": ["graph TD ...", ...], "format": "url" | "svg"}，
+    也可以直接是包含多个 ```mermaid 代码块的 markdown（format 通过查询参数指定）。
+    每个图表单独返回结果，某个图表出错不影响其他图表。
+    """
+    # 按上传上限流式读取请求体，超出时不再继续读取
+    try:
+        with receive_request(request, DATA_DIR, MAX_UPLOAD_BYTES) as upload:
+            content = upload.read_text()
+    except UploadError as e:
+        return jsonify({"success": False, "message": "上传内容不合法", "error": str(e)}), e.status
+    data = None
+    if request.is_json:
+        try:
+            data = json.loads(content)
+        except ValueError:
+            pass
+    if isinstance(data, dict):
+        diagrams = data.get('diagrams')
+        output = data.get('format', 'url')
+        if not isinstance(diagrams, list) or not all(isinstance(d, str) for d in diagrams):
+            return jsonify({"success": False, "message": "diagrams 必须是字符串列表", "error": "INVALID_INPUT"}), 400
+        # 列表中的图表带了代码块标记时只取代码块内容
+        diagrams = [
+            match.group(1).removesuffix('\n') if (match := MERMAID_BLOCK_RE.search(d)) else d
+            for d in diagrams
+        ]
+    else:
+        output = request.args.get('format', 'url')
+        diagrams = [match.group(1).removesuffix('\n') for match in MERMAID_BLOCK_RE.finditer(content)]
+        # 没有代码块时把整个内容当作一个图表，与上传接口相同
+        if not diagrams and content.strip():
+            diagrams = [content]
+
+    if output not in ('url', 'svg'):
+        return jsonify({"success": False, "message": "format 只能是 url 或 svg", "error": "INVALID_INPUT"}), 400
+    if not diagrams:
+        return jsonify({"success": False, "message": "没有找到 mermaid 图表", "error": "EMPTY_CONTENT"}), 400
+    if len(diagrams) > MERMAID_BATCH_MAX:
+        return jsonify({
+            "success": False,
+            "message": f"一次最多渲染 {MERMAID_BATCH_MAX} 个图表",
+            "error": "TOO_MANY_DIAGRAMS"
+        }), 400
+    # 每个图表消耗一个令牌
+    try:
+        rate_limits.check(tenant_key(request.headers, request.remote_addr), cost=len(diagrams))
+    except RateLimited as e:
+        return rate_limited_json(e) + ({'Retry-After': retry_after_seconds(e.retry_after)},)
+
+    contents = [wrap_diagram(code) for code in diagrams]
+    hashes = [hash_content(c) for c in contents]
+    # 没有通过检查或之前报告过语法错误的图表不再渲染
+    errors = {}
+    for content_hash, code in zip(hashes, diagrams):
+        if content_hash in errors:
+            continue
+        try:
+            validate_diagram(code, MERMAID_MAX_TEXT_SIZE, MERMAID_MAX_EDGES)
+        except LintError as e:
+            errors[content_hash] = e
+            continue
+        error = failures.get(content_hash)
+        if error is not None:
+            CACHE_REQUESTS.inc(tool="mermaid", result="negative")
+            errors[content_hash] = error
+    for content_hash, content in zip(hashes, contents):
+        if content_hash not in errors:
+            store.write(content_hash, '.md', content)
+
+    # 已经生成过的图表直接复用，相同图表只渲染一次
+    pending = list(dict.fromkeys(h for h in hashes if h not in errors and not store.exists(h, '.svg')))
+    if pending:
+        try:
+            with admit_render():
+                rendered = render_batch([contents[hashes.index(h)] for h in pending], '.svg')
+        except Overloaded as e:
+            body = {"success": False, "message": "服务繁忙，请稍后重试", "error": str(e)}
+            return jsonify(body), 503, overloaded_headers(e)
+        for content_hash, (svg, error) in zip(pending, rendered):
+            if svg is None:
+                errors[content_hash] = render_failed(content_hash, error) if isinstance(error, LintError) else error
+            else:
+                store.write(content_hash, '.svg', svg)
+
+    results = []
+    for index, content_hash in enumerate(hashes):
+        error = errors.get(content_hash)
+        if isinstance(error, LintError):
+            results.append({"index": index, "success": False, "error": str(error), "details": error.to_dict()})
+            continue
+        if error is not None:
+            results.append({"index": index, "success": False, "error": error})
+            continue
+        file_name = store.name(content_hash, '.svg')
+        result = {"index": index, "success": True, "file_name": file_name}
+        if output == 'svg':
+            with open(store.path(content_hash, '.svg'), 'r', encoding='utf-8') as f:
+                result["svg"] = f.read()
+        else:
+            result["url"] = f'http://127.0.0.1:5002/svg/{file_name}'
+        results.append(result)
+
+    succeeded = sum(1 for r in results if r['success'])
+    return jsonify({
+        "success": succeeded == len(results),
+        "message": f"成功渲染 {succeeded}/{len(results)} 个图表",
+        "results": results
+    })
 
 
 # 获取svg接口
 @app.route('/svg/<filename>', methods=['GET'])
 def get_svg(filename):
-    return send_from_directory("/app/data", filename)
+    file_path = store.resolve(filename, check=False)
+    response = send_artifact(file_path) if file_path else None
+    if response is None:
+        return '文件不存在', 404
+    return response
+
+
+# 获取png接口，第一次访问时由已上传的 markdown 生成
+@app.route('/png/<filename>', methods=['GET'])
+def get_png(filename):
+    match = HASH_NAME_RE.match(filename)
+    if not match or match.group(2) != '.png':
+        return '文件不存在', 404
+    content_hash = match.group(1)
+    if not store.exists(content_hash, '.png'):
+        if not store.exists(content_hash, '.md'):
+            return '文件不存在', 404
+        error = failures.get(content_hash)
+        if error is not None:
+            return str(error), 400
+        try:
+            # 只有需要渲染时才消耗令牌
+            rate_limits.check(tenant_key(request.headers, request.remote_addr))
+            with png_locks.hold(content_hash):
+                # 等待期间其他请求可能已经生成
+                if not store.exists(content_hash, '.png'):
+                    with admit_render():
+                        failed = export_png(content_hash)
+                    if failed:
+                        return failed
+        except RateLimited as e:
+            return str(e), 429, overloaded_headers(e)
+        except Overloaded as e:
+            return str(e), 503, overloaded_headers(e)
+    return send_artifact(store.path(content_hash, '.png')) or ('文件不存在', 404)
+
+
+def export_png(content_hash):
+    """由已保存的 markdown 生成 PNG，失败时返回错误响应"""
+    md_path = store.path(content_hash, '.md')
+    with open(md_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    try:
+        png = render_diagram(content, md_path, '.png')
+    except LintError as e:
+        return str(render_failed(content_hash, e)), 400
+    if png is None:
+        return 'Mermaid 图表生成失败', 500
+    store.write(content_hash, '.png', png)
+    return None
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    # 单独运行时使用 Flask 自带的服务器且不开启调试模式，生产环境通过网关(gateway)部署
+    app.run(host='0.0.0.0', port=5002)
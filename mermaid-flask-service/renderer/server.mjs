@@ -0,0 +1,344 @@
+// mermaid 常驻渲染服务
+// 启动一个 Chromium 并保持 N 个已加载 mermaid 的页面，通过 Unix socket 按行交换 JSON：
+//   请求 {"id", "code", "format": "svg" | "png"}，或 {"id", "stats": true} 查询状态
+//   响应 {"id", "svg"} / {"id", "png": base64} / {"id", "kind": "syntax" | "render" | "timeout" | "busy" | "internal", "error"}
+//   syntax 是 mermaid.parse 报告的语法错误，相同代码总是失败；render 是解析通过之后渲染时出的错，可能与代码无关
+// 页面渲染满 MERMAID_PAGE_MAX_RENDERS 次后重建；浏览器进程树内存超过 MERMAID_RENDERER_MAX_RSS_MB 时，
+// 等手上的任务完成后重启浏览器；排队任务超过 MERMAID_RENDERER_MAX_QUEUE 个时直接返回 busy。
+import net from 'node:net';
+import readline from 'node:readline';
+import { existsSync, readFileSync, readdirSync, rmSync } from 'node:fs';
+import { dirname, join } from 'node:path';
+import { fileURLToPath } from 'node:url';
+import puppeteer from 'puppeteer';
+
+function intEnv(name, fallback) {
+  const value = parseInt(process.env[name] ?? '', 10);
+  return Number.isNaN(value) ? fallback : value;
+}
+
+function readJson(path) {
+  try {
+    return JSON.parse(readFileSync(path, 'utf8'));
+  } catch {
+    return {};
+  }
+}
+
+function log(message) {
+  process.stderr.write(`[mermaid-renderer] ${message}\n`);
+}
+
+const SOCKET = process.env.MERMAID_RENDERER_SOCKET || process.argv[2] || '/tmp/mermaid-renderer.sock';
+const PAGES = Math.max(1, intEnv('MERMAID_RENDERER_PAGES', 2));
+const MAX_RENDERS = intEnv('MERMAID_PAGE_MAX_RENDERS', 200);
+const TIMEOUT = intEnv('MERMAID_DIAGRAM_TIMEOUT', 20) * 1000;
+const MAX_QUEUE = intEnv('MERMAID_RENDERER_MAX_QUEUE', 32);
+const MAX_RSS = intEnv('MERMAID_RENDERER_MAX_RSS_MB', 1024) * 1024 * 1024;
+
+// 与 mmdc 使用相同的 puppeteer 启动参数和 mermaid 配置
+const serviceDir = dirname(dirname(fileURLToPath(import.meta.url)));
+const launchOptions = readJson(join(serviceDir, 'puppeteer-config.json'));
+const mermaidConfig = readJson(join(serviceDir, 'config.json'));
+const mermaidScript = fileURLToPath(import.meta.resolve('mermaid/dist/mermaid.min.js'));
+
+class DiagramError extends Error {
+  constructor(message, syntax) {
+    super(message);
+    this.syntax = syntax;
+  }
+}
+class DiagramTimeout extends Error {}
+
+let browser = null;
+let generation = 0;
+let idle = [];
+let active = 0;
+let restarting = false;
+let sequence = 0;
+let lastMemoryCheck = 0;
+const waiting = [];
+const counters = { rendered: 0, failed: 0, timeouts: 0, rejected: 0, recycled: 0, restarts: 0 };
+
+async function createPage() {
+  const page = await browser.newPage();
+  await page.setContent('<!doctype html><html><body style="margin:0;background:white"><div id="container"></div></body></html>');
+  await page.addScriptTag({ path: mermaidScript });
+  await page.evaluate((config) => {
+    window.mermaid.initialize({ startOnLoad: false, ...config });
+  }, mermaidConfig);
+  return { page, renders: 0, generation };
+}
+
+async function launch() {
+  browser = await puppeteer.launch({ headless: true, ...launchOptions });
+  generation += 1;
+  idle = [];
+  active = 0;
+  for (let i = 0; i < PAGES; i++) {
+    idle.push(await createPage());
+  }
+  browser.on('disconnected', () => {
+    if (!restarting) {
+      restart('浏览器意外退出');
+    }
+  });
+}
+
+async function restart(reason) {
+  restarting = true;
+  counters.restarts += 1;
+  log(`重启浏览器: ${reason}`);
+  const old = browser;
+  browser = null;
+  if (old) {
+    old.removeAllListeners('disconnected');
+    await old.close().catch(() => {});
+  }
+  for (;;) {
+    try {
+      await launch();
+      break;
+    } catch (err) {
+      log(`浏览器启动失败，5 秒后重试: ${err.message}`);
+      await new Promise((resolve) => setTimeout(resolve, 5000));
+    }
+  }
+  restarting = false;
+  dispatch();
+}
+
+// 统计浏览器进程树（包括各个渲染子进程）和本进程的常驻内存
+function memoryUsage() {
+  let total = process.memoryUsage().rss;
+  const pid = browser && browser.process() && browser.process().pid;
+  if (!pid) {
+    return total;
+  }
+  const children = new Map();
+  const rss = new Map();
+  try {
+    for (const name of readdirSync('/proc')) {
+      if (!/^\d+$/.test(name)) {
+        continue;
+      }
+      try {
+        const stat = readFileSync(`/proc/${name}/stat`, 'utf8');
+        const fields = stat.slice(stat.lastIndexOf(')') + 2).split(' ');
+        const ppid = Number(fields[1]);
+        if (!children.has(ppid)) {
+          children.set(ppid, []);
+        }
+        children.get(ppid).push(Number(name));
+        rss.set(Number(name), Number(fields[21]) * 4096);
+      } catch {
+        // 进程已经退出
+      }
+    }
+  } catch {
+    return total;
+  }
+  const stack = [pid];
+  while (stack.length) {
+    const current = stack.pop();
+    total += rss.get(current) || 0;
+    stack.push(...(children.get(current) || []));
+  }
+  return total;
+}
+
+function checkMemory() {
+  const now = Date.now();
+  if (restarting || !MAX_RSS || now - lastMemoryCheck < 1000) {
+    return;
+  }
+  lastMemoryCheck = now;
+  const used = memoryUsage();
+  if (used > MAX_RSS) {
+    // 停止分配新任务，等正在渲染的页面归还后再重启
+    restarting = true;
+    log(`内存占用 ${Math.round(used / 1048576)} MB 超过上限，准备重启浏览器`);
+  }
+}
+
+async function renderOn(page, job) {
+  const result = await page.evaluate(async (id, code) => {
+    // 先单独解析，只有解析阶段的错误算作语法错误
+    let parsed = false;
+    try {
+      await window.mermaid.parse(code);
+      parsed = true;
+      const { svg } = await window.mermaid.render(id, code);
+      return { svg };
+    } catch (err) {
+      document.getElementById(`d${id}`)?.remove();
+      return { error: String((err && err.message) || err), syntax: !parsed };
+    }
+  }, `mermaid-${++sequence}`, job.code || '');
+  if (result.error) {
+    throw new DiagramError(result.error, result.syntax);
+  }
+  if (job.format !== 'png') {
+    return { svg: result.svg };
+  }
+
+  await page.evaluate((svg) => {
+    document.getElementById('container').innerHTML = svg;
+  }, result.svg);
+  try {
+    const element = await page.$('#container > svg');
+    const png = await element.screenshot({ type: 'png' });
+    return { png: Buffer.from(png).toString('base64') };
+  } finally {
+    await page.evaluate(() => {
+      document.getElementById('container').innerHTML = '';
+    });
+  }
+}
+
+async function release(slot, recycle) {
+  // 浏览器已经重启，旧页面随旧浏览器一起作废
+  if (slot.generation !== generation) {
+    return;
+  }
+  if (recycle) {
+    counters.recycled += 1;
+    slot.page.close().catch(() => {});
+    try {
+      slot = await createPage();
+    } catch (err) {
+      if (slot.generation === generation && !restarting) {
+        restart(`无法创建页面: ${err.message}`);
+      }
+      return;
+    }
+    if (slot.generation !== generation) {
+      return;
+    }
+  }
+  active -= 1;
+  idle.push(slot);
+  checkMemory();
+  if (restarting && active === 0 && browser) {
+    restart('内存超过上限');
+    return;
+  }
+  dispatch();
+}
+
+async function run(slot, job, respond) {
+  let timer;
+  const timeout = new Promise((_, reject) => {
+    timer = setTimeout(() => reject(new DiagramTimeout()), TIMEOUT);
+  });
+  try {
+    const result = await Promise.race([renderOn(slot.page, job), timeout]);
+    counters.rendered += 1;
+    slot.renders += 1;
+    respond({ id: job.id, ...result });
+    release(slot, MAX_RENDERS > 0 && slot.renders >= MAX_RENDERS);
+  } catch (err) {
+    if (err instanceof DiagramError) {
+      counters.failed += 1;
+      slot.renders += 1;
+      respond({ id: job.id, kind: err.syntax ? 'syntax' : 'render', error: err.message });
+      release(slot, MAX_RENDERS > 0 && slot.renders >= MAX_RENDERS);
+    } else if (err instanceof DiagramTimeout) {
+      // 卡住的页面无法中断，直接关闭后重建
+      counters.timeouts += 1;
+      respond({ id: job.id, kind: 'timeout', error: `渲染超过 ${TIMEOUT / 1000} 秒未完成` });
+      release(slot, true);
+    } else {
+      respond({ id: job.id, kind: 'internal', error: String((err && err.message) || err) });
+      release(slot, true);
+    }
+  } finally {
+    clearTimeout(timer);
+  }
+}
+
+function dispatch() {
+  while (!restarting && idle.length && waiting.length) {
+    const slot = idle.pop();
+    const { job, respond } = waiting.shift();
+    active += 1;
+    run(slot, job, respond);
+  }
+}
+
+function submit(job, respond) {
+  if (waiting.length >= MAX_QUEUE) {
+    counters.rejected += 1;
+    respond({ id: job.id, kind: 'busy', error: '渲染队列已满' });
+    return;
+  }
+  waiting.push({ job, respond });
+  dispatch();
+}
+
+function stats() {
+  return {
+    pages: PAGES,
+    idle: idle.length,
+    active,
+    queued: waiting.length,
+    restarting,
+    memory: memoryUsage(),
+    ...counters,
+  };
+}
+
+try {
+  await launch();
+} catch (err) {
+  log(`浏览器启动失败: ${err.stack || err}`);
+  process.exit(1);
+}
+
+// 调用方在启动本服务前已持有锁，残留的 socket 文件属于已退出的旧进程
+if (existsSync(SOCKET)) {
+  rmSync(SOCKET);
+}
+
+const server = net.createServer((socket) => {
+  socket.on('error', () => {});
+  const send = (message) => {
+    if (!socket.destroyed) {
+      socket.write(JSON.stringify(message) + '\n');
+    }
+  };
+  const rl = readline.createInterface({ input: socket, crlfDelay: Infinity });
+  rl.on('line', (line) => {
+    let job;
+    try {
+      job = JSON.parse(line);
+    } catch (err) {
+      send({ id: null, kind: 'internal', error: `无法解析任务: ${err.message}` });
+      return;
+    }
+    if (job.stats) {
+      send({ id: job.id, stats: stats() });
+      return;
+    }
+    submit(job, send);
+  });
+});
+
+server.listen(SOCKET, () => {
+  log(`已启动，页面数 ${PAGES}，监听 ${SOCKET}`);
+});
+
+function shutdown() {
+  server.close();
+  rmSync(SOCKET, { force: true });
+  const done = () => process.exit(0);
+  if (browser) {
+    browser.removeAllListeners('disconnected');
+    browser.close().then(done, done);
+  } else {
+    done();
+  }
+}
+
+process.on('SIGTERM', shutdown);
+process.on('SIGINT', shutdown);
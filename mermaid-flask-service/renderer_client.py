@@ -0,0 +1,232 @@
+"""
+mermaid 常驻渲染服务客户端
+
+渲染服务（renderer/server.mjs）是一个独立的 Node 进程，持有一个 Chromium 和若干个已加载 mermaid 的页面，
+通过 Unix socket 接收任务，省去每次调用 mmdc 时启动浏览器的开销。
+所有 Flask 进程共用同一个渲染服务：第一次渲染时如果 socket 不可用，持有文件锁的进程负责把它拉起来。
+异步模式下通过 render_async 使用 asyncio 的 Unix socket 连接，等待渲染结果时不占用线程。
+"""
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import socket
+import subprocess
+import time
+
+from common.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SPAWNS
+
+logger = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "renderer", "server.mjs")
+# 异步连接单行响应的长度上限，PNG 以 base64 放在一行中返回
+RESPONSE_LIMIT = 64 * 1024 * 1024
+
+
+class RenderError(Exception):
+    """mermaid 渲染图表失败"""
+
+
+class RenderSyntaxError(RenderError):
+    """mermaid 解析图表时报告的语法错误，相同代码总是失败"""
+
+
+class RenderTimeout(RenderError):
+    """单个图表渲染超时"""
+
+
+class RendererBusy(Exception):
+    """渲染队列已满，调用方应稍后重试"""
+
+
+class RendererUnavailable(Exception):
+    """渲染服务不可用，调用方应回退到 mmdc"""
+
+
+class MermaidRenderer:
+    """
+    渲染服务客户端
+
+    每次渲染使用一个新的 socket 连接。autostart 为 True 时在连接失败后启动渲染服务，
+    启动失败后在 retry_interval 秒内直接抛出 RendererUnavailable。
+    """
+
+    def __init__(self, socket_path, timeout=60, start_timeout=60, retry_interval=60, autostart=True, command=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.retry_interval = retry_interval
+        self.autostart = autostart
+        self.command = command or ["node", SERVER_SCRIPT]
+        self._disabled_until = 0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _start(self):
+        """启动渲染服务并等待 socket 可用，多个进程同时调用时只有一个真正启动"""
+        with open(f"{self.socket_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # 等锁期间其他进程可能已经启动了渲染服务
+                try:
+                    return self._connect()
+                except OSError:
+                    pass
+
+                logger.info(f"启动 mermaid 渲染服务: {self.socket_path}")
+                env = dict(os.environ, MERMAID_RENDERER_SOCKET=self.socket_path)
+                # 使用独立的会话，开发模式下 Flask 重载时渲染服务继续运行
+                SUBPROCESS_SPAWNS.inc(tool="mermaid", kind="sidecar")
+                proc = subprocess.Popen(self.command, env=env, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL, start_new_session=True)
+                deadline = time.monotonic() + self.start_timeout
+                while time.monotonic() < deadline:
+                    if proc.poll() is not None:
+                        raise RendererUnavailable(f"mermaid 渲染服务启动失败，退出码 {proc.returncode}")
+                    try:
+                        return self._connect()
+                    except OSError:
+                        time.sleep(0.2)
+                proc.kill()
+                raise RendererUnavailable("mermaid 渲染服务启动超时")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self):
+        try:
+            return self._connect()
+        except OSError:
+            pass
+        if not self.autostart:
+            raise RendererUnavailable("mermaid 渲染服务未运行")
+        if time.time() < self._disabled_until:
+            raise RendererUnavailable("mermaid 渲染服务暂不可用")
+        try:
+            return self._start()
+        except (OSError, RendererUnavailable) as e:
+            SUBPROCESS_FAILURES.inc(tool="mermaid", kind="sidecar", reason="start")
+            logger.warning(f"mermaid 渲染服务启动失败，{self.retry_interval} 秒内回退到 mmdc: {e}")
+            self._disabled_until = time.time() + self.retry_interval
+            raise RendererUnavailable(str(e))
+
+    def _request(self, message):
+        sock = self._open()
+        try:
+            sock.settimeout(self.timeout)
+            sock.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as f:
+                line = f.readline()
+        except socket.timeout:
+            raise RenderTimeout(f"渲染超过 {self.timeout} 秒未完成")
+        except OSError as e:
+            raise RendererUnavailable(f"与 mermaid 渲染服务通信失败: {e}")
+        finally:
+            sock.close()
+        if not line:
+            raise RendererUnavailable("mermaid 渲染服务断开了连接")
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise RendererUnavailable("无法解析 mermaid 渲染服务的响应")
+
+    @staticmethod
+    def _result(response, fmt):
+        """把响应转换为 SVG/PNG 字节，出错时返回对应的异常"""
+        kind = response.get("kind")
+        if kind == "busy":
+            return RendererBusy(response.get("error"))
+        if kind == "timeout":
+            return RenderTimeout(response.get("error"))
+        if kind == "syntax":
+            return RenderSyntaxError(response.get("error"))
+        if kind == "render":
+            return RenderError(response.get("error"))
+        if kind is not None:
+            return RendererUnavailable(response.get("error"))
+        if fmt == "png":
+            return base64.b64decode(response["png"])
+        return response["svg"].encode("utf-8")
+
+    def render(self, code, fmt="svg"):
+        """渲染单个 mermaid 图表，返回 SVG 或 PNG 字节"""
+        result = self._result(self._request({"id": 1, "code": code, "format": fmt}), fmt)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def render_async(self, code, fmt="svg"):
+        """render 的协程版本"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=RESPONSE_LIMIT)
+        except OSError:
+            # 渲染服务没有运行时在线程中启动，只在第一次渲染时发生
+            sock = await asyncio.to_thread(self._open)
+            reader, writer = await asyncio.open_unix_connection(sock=sock, limit=RESPONSE_LIMIT)
+        try:
+            message = {"id": 1, "code": code, "format": fmt}
+            writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout(f"渲染超过 {self.timeout} 秒未完成")
+        except (OSError, ValueError) as e:
+            raise RendererUnavailable(f"与 mermaid 渲染服务通信失败: {e}")
+        finally:
+            writer.close()
+        if not line:
+            raise RendererUnavailable("mermaid 渲染服务断开了连接")
+        try:
+            result = self._result(json.loads(line), fmt)
+        except (ValueError, KeyError):
+            raise RendererUnavailable("无法解析 mermaid 渲染服务的响应")
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def render_many(self, codes, fmt="svg"):
+        """
+        在同一个连接中提交多个图表，由渲染服务的各个页面并行渲染
+
+        返回与 codes 顺序一致的列表，每一项是 SVG/PNG 字节或该图表对应的异常；
+        只有渲染服务本身不可用时才抛出 RendererUnavailable。
+        """
+        results = [None] * len(codes)
+        sock = self._open()
+        try:
+            sock.settimeout(self.timeout)
+            payload = "".join(
+                json.dumps({"id": i, "code": code, "format": fmt}, ensure_ascii=False) + "\n"
+                for i, code in enumerate(codes)
+            )
+            sock.sendall(payload.encode("utf-8"))
+            # 各个图表的结果按完成顺序返回
+            with sock.makefile("r", encoding="utf-8") as f:
+                for _ in codes:
+                    line = f.readline()
+                    if not line:
+                        raise RendererUnavailable("mermaid 渲染服务断开了连接")
+                    response = json.loads(line)
+                    results[response["id"]] = self._result(response, fmt)
+        except socket.timeout:
+            pass
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            raise RendererUnavailable(f"与 mermaid 渲染服务通信失败: {e}")
+        finally:
+            sock.close()
+        return [
+            RenderTimeout(f"渲染超过 {self.timeout} 秒未完成") if result is None else result
+            for result in results
+        ]
+
+    def stats(self):
+        """渲染服务的页面、队列和计数器状态"""
+        return self._request({"id": 1, "stats": True})["stats"]
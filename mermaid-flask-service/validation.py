@@ -0,0 +1,197 @@
+"""
+mermaid 图表的快速检查
+
+在交给渲染服务或 mmdc 之前检查：代码块是否闭合、大小是否超过 mermaid 的 maxTextSize（超出时 mermaid 不报错，
+而是画出一张写着错误信息的图）、第一行是否缺少图表类型；流程图还检查方向、引号和括号是否配对、
+subgraph 与 end 是否配对以及连线数，时序图检查 loop/alt/opt 等块与 end 是否配对。
+不认识的图表类型交给渲染器判断，新版本 mermaid 增加的图表类型不会被这里拒绝。
+
+只检查 mermaid 一定会报错的问题，通过检查的图表仍可能渲染失败，由渲染器报告具体的语法错误。
+图表中的行号从图表代码的第一行算起，与 mermaid 报错中的行号一致；代码块没有闭合时的行号是上传的 Markdown 中的行号。
+"""
+import re
+
+from common.lint import LintError
+
+# 与 mmdc 相同的规则提取 markdown 中的 mermaid 代码块
+MERMAID_BLOCK_RE = re.compile(r"^[^\S\n]*[`:]{3}mermaid[^\S\n]*\r?\n(.*?)^[^\S\n]*[`:]{3}[^\S\n]*$", re.M | re.S)
+_FENCE_START_RE = re.compile(r"^[^\S\n]*[`:]{3}mermaid[^\S\n]*$", re.M)
+
+# mermaid 11 已知的图表类型，即图表第一行的关键字；只用于提示大小写和选择结构检查，不在其中的类型交给渲染器
+DIAGRAM_TYPES = frozenset((
+    "graph", "flowchart", "flowchart-elk", "sequenceDiagram", "classDiagram", "classDiagram-v2",
+    "stateDiagram", "stateDiagram-v2", "erDiagram", "journey", "gantt", "pie", "quadrantChart",
+    "requirementDiagram", "gitGraph", "C4Context", "C4Container", "C4Component", "C4Dynamic", "C4Deployment",
+    "mindmap", "timeline", "zenuml", "sankey-beta", "xychart-beta", "block-beta", "packet-beta", "packet",
+    "architecture-beta", "kanban", "radar-beta", "treemap-beta", "info",
+))
+# 大小写写错时提示正确的写法
+_TYPES_BY_LOWER = {name.lower(): name for name in DIAGRAM_TYPES}
+_TYPE_RE = re.compile(r"[A-Za-z][\w-]*")
+
+FLOWCHART_TYPES = ("graph", "flowchart", "flowchart-elk")
+FLOWCHART_DIRECTIONS = ("TB", "TD", "BT", "RL", "LR")
+# 时序图中以 end 结束的块
+SEQUENCE_BLOCKS = ("loop", "alt", "opt", "par", "par_over", "critical", "break", "rect", "box")
+# 流程图中的连线：-->、-.->、==>、--x、--o 以及不带箭头的 ---、===、-.-、~~~；"-- 文字 -->" 只算结尾的一条
+_EDGE_RE = re.compile(r"(?:-{2,}|={2,}|-\.+-)[>xo]|-{3,}|={3,}|~{3,}|-\.+-")
+_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
+# mermaid 和 mmdc 报告的语法错误
+_ERROR_LINE_RE = re.compile(r"(?:Parse|Lexical) error on line (\d+)")
+_SYNTAX_ERROR_RE = re.compile(r"(?:Parse|Lexical) error|No diagram type detected|UnknownDiagramError|Syntax error")
+# 返回给调用方的报错最多保留的字符数
+MAX_ERROR_CHARS = 1000
+
+
+def _block_line(stripped):
+    """把 'end;' 这样的写法规范为关键字"""
+    return stripped.split(None, 1)[0].rstrip(";") if stripped else ""
+
+
+def _header(lines):
+    """跳过 front matter、%%{init}%% 指令、注释和空行，返回 (图表第一行的序号, 内容)，没有时返回 (None, None)"""
+    i = 0
+    if lines and lines[0].strip() == "---":
+        for j in range(1, len(lines)):
+            if lines[j].strip() == "---":
+                i = j + 1
+                break
+        else:
+            raise LintError("UNCLOSED_FRONTMATTER", "图表开头的 --- 配置没有结束", 1,
+                            "在配置之后加上一行 ---，或者删除开头的 ---")
+    in_directive = False
+    for index in range(i, len(lines)):
+        stripped = lines[index].strip()
+        if in_directive:
+            in_directive = "}%%" not in stripped
+            continue
+        if stripped.startswith("%%{"):
+            in_directive = "}%%" not in stripped
+            continue
+        if not stripped or stripped.startswith("%%"):
+            continue
+        return index, stripped
+    return None, None
+
+
+def _check_blocks(lines, start, openers, closer_hint):
+    """检查以 openers 开始、以 end 结束的块是否配对"""
+    stack = []
+    for index in range(start, len(lines)):
+        stripped = lines[index].strip()
+        if stripped.startswith("%%"):
+            continue
+        keyword = _block_line(stripped)
+        if keyword in openers:
+            stack.append((keyword, index + 1))
+        elif keyword == "end":
+            if not stack:
+                raise LintError("UNEXPECTED_END", "多余的 end，没有与之对应的块", index + 1,
+                                f"删除这一行，或者在前面补上 {closer_hint}；流程图中的节点不能命名为 end")
+            stack.pop()
+    if stack:
+        keyword, line = stack[-1]
+        raise LintError("UNCLOSED_BLOCK", f"{keyword} 块没有结束", line, f"在 {keyword} 块的最后加上一行 end")
+
+
+def _check_flowchart(lines, start, max_edges):
+    """检查流程图的引号和括号是否配对、连线数是否超过上限"""
+    stack = []
+    quote_line = None
+    edges = 0
+    for index in range(start, len(lines)):
+        line = lines[index]
+        if quote_line is None and line.strip().startswith("%%"):
+            continue
+        if quote_line is None:
+            edges += len(_EDGE_RE.findall(line))
+        for char in line:
+            if char == '"':
+                quote_line = None if quote_line is not None else index + 1
+            elif quote_line is not None:
+                continue
+            elif char in "([{":
+                stack.append((char, index + 1))
+            elif char in _BRACKETS and stack:
+                # 非对称节点 A>文字] 的 ] 没有对应的左括号，忽略
+                opener, line_no = stack.pop()
+                if opener != _BRACKETS[char]:
+                    raise LintError("MISMATCHED_BRACKET", f"括号不配对：{opener} 与 {char}", index + 1,
+                                    '节点文字中有括号等特殊字符时用双引号括起来，例如 A["文字(说明)"]')
+        # 不在引号中的节点文字不能换行
+        if stack and quote_line is None:
+            opener, line_no = stack[0]
+            raise LintError("UNCLOSED_BRACKET", f"括号 {opener} 没有闭合", line_no,
+                            '检查节点形状的括号是否成对，节点文字中有括号时用双引号括起来，例如 A["文字(说明)"]')
+    if quote_line is not None:
+        raise LintError("UNCLOSED_QUOTE", "双引号没有闭合", quote_line, "检查这一行的双引号是否成对")
+    if edges > max_edges:
+        raise LintError("TOO_MANY_EDGES", f"连线数 {edges} 超过上限 {max_edges}", None,
+                        "拆分为多个图表，或者合并部分节点")
+    _check_blocks(lines, start, ("subgraph",), "subgraph")
+
+
+def validate_diagram(code, max_chars=50000, max_edges=500):
+    """检查一个图表的代码，不通过时抛出 LintError"""
+    if len(code) > max_chars:
+        raise LintError("TOO_LARGE", f"图表代码有 {len(code)} 个字符，超过上限 {max_chars}", None,
+                        "拆分为多个图表，或者缩短节点文字")
+    lines = code.splitlines()
+    index, header = _header(lines)
+    if header is None:
+        raise LintError("EMPTY_DIAGRAM", "图表代码为空", None, "在代码块中写上图表类型和内容，例如 flowchart TD 换行后写 A --> B")
+
+    match = _TYPE_RE.match(header)
+    kind = match.group(0) if match else ""
+    if kind not in DIAGRAM_TYPES:
+        correct = _TYPES_BY_LOWER.get(kind.lower())
+        if correct:
+            raise LintError("UNKNOWN_DIAGRAM_TYPE", f"不支持的图表类型: {header[:50]}", index + 1,
+                            f"图表类型区分大小写，应为 {correct}")
+        # 第一行已经是节点和连线，说明漏写了图表类型；其他不认识的关键字可能是新的图表类型，交给渲染器
+        if not match or _EDGE_RE.search(header):
+            raise LintError("UNKNOWN_DIAGRAM_TYPE", f"缺少图表类型: {header[:50]}", index + 1,
+                            "图表第一行应为图表类型，例如 flowchart TD、sequenceDiagram、classDiagram、stateDiagram-v2、"
+                            "erDiagram、gantt、pie、mindmap")
+        return
+
+    if kind in FLOWCHART_TYPES:
+        rest = header[len(kind):].split(None, 1)
+        direction = rest[0].rstrip(";") if rest else ""
+        # 只判断看起来像方向的两个字母，其他写法交给 mermaid
+        if re.fullmatch(r"[A-Za-z]{2}", direction) and direction not in FLOWCHART_DIRECTIONS:
+            raise LintError("INVALID_DIRECTION", f"流程图方向 {direction} 无效", index + 1,
+                            "方向应为 TB、TD、BT、RL 或 LR（大写），例如 flowchart LR")
+        _check_flowchart(lines, index + 1, max_edges)
+    elif kind == "sequenceDiagram":
+        _check_blocks(lines, index + 1, SEQUENCE_BLOCKS, "loop/alt/opt/par/critical/break/rect/box")
+
+
+def validate_markdown(content, max_chars=50000, max_edges=500):
+    """检查上传的 markdown 中的第一个 mermaid 代码块（只渲染第一个），不通过时抛出 LintError"""
+    match = MERMAID_BLOCK_RE.search(content)
+    if match is None:
+        start = _FENCE_START_RE.search(content)
+        if start is not None:
+            raise LintError("UNCLOSED_FENCE", "mermaid 代码块没有结束标记", content.count("\n", 0, start.start()) + 1,
+                            "在图表代码之后加上一行 ```")
+        raise LintError("EMPTY_DIAGRAM", "没有找到 mermaid 图表", None, "上传 ```mermaid 代码块，或者直接上传图表代码")
+    validate_diagram(match.group(1), max_chars, max_edges)
+
+
+def syntax_error(message, strict=True):
+    """
+    把渲染器的报错转换为 LintError
+
+    strict 为 True 时（mmdc 的输出中还可能有浏览器启动失败等与内容无关的错误）只识别 mermaid 的语法错误，
+    不是语法错误时返回 None。
+    """
+    if strict and not _SYNTAX_ERROR_RE.search(message):
+        return None
+    # 去掉 Node 的调用栈
+    lines = [line for line in message.strip().splitlines() if not line.lstrip().startswith("at ")]
+    text = "\n".join(lines)[:MAX_ERROR_CHARS] or "图表语法错误"
+    found = _ERROR_LINE_RE.search(message)
+    return LintError("SYNTAX_ERROR", text, int(found.group(1)) if found else None,
+                     "按报错中的位置修改图表语法；节点文字中有括号、引号等特殊字符时用双引号括起来")
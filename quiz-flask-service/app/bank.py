@@ -0,0 +1,269 @@
+"""
+题库模式
+
+上传的试卷在生成页面时同时编译为题库：页面中的 HTML 按顶层有序列表拆成题目，每道题记录题型、题干、
+选项和答案，以及组卷用的 HTML 片段（选项之前的部分、每个选项、选项之后的部分），以 JSON 按内容哈希保存。
+组卷时按种子打乱题目和选项的顺序、抽取指定数量的题目，直接拼接片段生成页面，不再运行 Markdown 和 Jinja。
+
+只有顶层有序列表中的条目是题目；第一个列表之前的内容（标题等）和最后一个列表之后的内容原样保留，
+多个列表之间的内容（例如分节标题）在组卷时省略。
+
+答案只保存在题库中：能编译为题库的试卷由服务端判分，保存的页面和组卷生成的页面都去掉了选项上的答案属性，
+题库文件丢失或损坏时从保存的 Markdown 原文重新编译。
+"""
+import html
+import json
+import logging
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+
+from app.grading import AnswerKey
+from app.render import PAGE_PREFIX, PAGE_SUFFIX, page_fragment, render_page
+
+logger = logging.getLogger(__name__)
+
+# 题库格式的版本，格式变化时旧的题库文件会重新编译
+BANK_VERSION = 2
+
+# 列表相关的标签，用来确定题目的边界；填空题的 <li> 没有结束标签，所以只按开始位置切分
+_TAG_RE = re.compile(r"<(/?)(ol|ul|li)\b[^>]*>")
+# quiz 扩展生成的选项列表
+_OPTIONS_RE = re.compile(r'<ul class="(radio-list|checklist|textbox)">\n(.*?)</ul>', re.S)
+_ITEM_START_RE = re.compile(r"^(?=<li>)", re.M)
+_CONTENT_RE = re.compile(r'data-content="([^"]*)"')
+# 选项上的答案属性：data-content 是答案，data-question 是答案取反或变形后的干扰值，同样能推出答案
+_ANSWER_ATTR_RE = re.compile(r' data-(?:content|question)="[^"]*"')
+_STRIP_TAGS_RE = re.compile(r"<[^>]+>")
+
+# 选项列表的 class 对应的题型
+QUESTION_TYPES = {"radio-list": "radio", "checklist": "checkbox", "textbox": "textbox"}
+
+
+class BankError(Exception):
+    """页面不能编译为题库"""
+
+
+def _text(fragment):
+    """HTML 片段中的纯文本"""
+    return " ".join(html.unescape(_STRIP_TAGS_RE.sub(" ", fragment)).split())
+
+
+def strip_answers(html_text):
+    """去掉页面或片段中选项上的答案属性"""
+    return _ANSWER_ATTR_RE.sub("", html_text)
+
+
+def _split_questions(fragment):
+    """
+    返回 (第一个顶层有序列表之前的内容, 每道题 <li> 内的 HTML, 最后一个顶层有序列表之后的内容)
+
+    没有顶层有序列表时返回 None。
+    """
+    stack = []
+    prefix_end = suffix_start = None
+    questions = []
+    start = None
+    for match in _TAG_RE.finditer(fragment):
+        closing, tag = match.group(1), match.group(2)
+        if tag in ("ol", "ul"):
+            if not closing:
+                if not stack and tag == "ol" and prefix_end is None:
+                    prefix_end = match.start()
+                stack.append(tag)
+            elif stack and stack[-1] == tag:
+                stack.pop()
+                if not stack and tag == "ol":
+                    if start is not None:
+                        questions.append(fragment[start:match.start()])
+                        start = None
+                    suffix_start = match.end()
+        elif tag == "li" and not closing and stack == ["ol"]:
+            if start is not None:
+                questions.append(fragment[start:match.start()])
+            start = match.end()
+    if prefix_end is None or suffix_start is None:
+        return None
+    # 题目的 </li> 和之后的换行在组卷时重新加上
+    questions = [re.sub(r"</li>\s*$", "", question) for question in questions]
+    return fragment[:prefix_end], questions, fragment[suffix_start:]
+
+
+def _compile_question(inner):
+    """把一道题的 HTML 编译为题目字典"""
+    match = _OPTIONS_RE.search(inner)
+    if match is None:
+        # 没有选项的条目（说明文字等）原样保留
+        return {"type": "text", "prompt": _text(inner), "options": [], "answer": None,
+                "head": f"<li>{inner}</li>\n", "items": [], "tail": ""}
+
+    kind = QUESTION_TYPES[match.group(1)]
+    items = [item for item in _ITEM_START_RE.split(match.group(2)) if item]
+    if _CONTENT_RE.search(match.group(2)) is None:
+        # 已经去掉答案的页面不能编译出答案表
+        raise BankError("页面中没有答案，请重新上传试卷")
+    if kind == "textbox":
+        # 填空题的答案倒序保存在 data-content 中
+        found = _CONTENT_RE.search(items[0]) if items else None
+        options = []
+        answer = html.unescape(found.group(1)[::-1]) if found else ""
+    else:
+        options = [_text(item) for item in items]
+        answer = [i for i, item in enumerate(items) if 'data-content="1"' in item]
+    return {
+        "type": kind,
+        "prompt": _text(inner[:match.start()]),
+        "options": options,
+        "answer": answer,
+        "head": f"<li>{inner[:match.start(2)]}",
+        # 组卷用的片段不带答案
+        "items": [strip_answers(item) for item in items],
+        "tail": f"{inner[match.end(2):]}</li>\n",
+    }
+
+
+class QuestionBank:
+    """编译好的题库，questions 中每道题包含题型、题干、选项、答案和组卷用的 HTML 片段"""
+
+    def __init__(self, prefix, suffix, questions):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.questions = questions
+        self._key = None
+
+    @property
+    def key(self):
+        """判分用的答案表，第一次使用时生成"""
+        if self._key is None:
+            self._key = AnswerKey.from_bank(self)
+        return self._key
+
+    @classmethod
+    def compile(cls, fragment):
+        """从试卷内容的 HTML 片段编译题库，没有题目时抛出 BankError"""
+        parts = _split_questions(fragment)
+        if parts is None:
+            raise BankError("试卷中没有编号的题目")
+        prefix, questions, suffix = parts
+        return cls(prefix, suffix, [_compile_question(question) for question in questions])
+
+    @classmethod
+    def from_page(cls, page):
+        fragment = page_fragment(page)
+        if fragment is None:
+            raise BankError("页面不是当前版本的试卷模板生成的，请重新上传")
+        return cls.compile(fragment)
+
+    @classmethod
+    def from_json(cls, data):
+        bank = json.loads(data)
+        if not isinstance(bank, dict) or bank.get("version") != BANK_VERSION:
+            raise BankError("题库格式版本不一致")
+        return cls(bank["prefix"], bank["suffix"], bank["questions"])
+
+    def to_json(self):
+        return json.dumps({"version": BANK_VERSION, "prefix": self.prefix, "suffix": self.suffix,
+                           "questions": self.questions}, ensure_ascii=False, separators=(",", ":"))
+
+    def select(self, seed=None, count=None):
+        """
+        返回组卷使用的 [(题目序号, 选项顺序), ...]
+
+        seed 为 None 时保持原来的顺序；否则用 seed 打乱题目顺序和单选、多选题的选项顺序，相同的 seed 总是得到相同的结果。
+        count 为 None 时使用全部题目，否则取前 count 道。
+        """
+        order = list(range(len(self.questions)))
+        rng = random.Random(seed) if seed is not None else None
+        if rng is not None:
+            rng.shuffle(order)
+        if count is not None:
+            order = order[:count]
+        selected = []
+        for index in order:
+            options = list(range(len(self.questions[index]["items"])))
+            if rng is not None and self.questions[index]["type"] in ("radio", "checkbox"):
+                rng.shuffle(options)
+            selected.append((index, options))
+        return selected
+
+    def assemble(self, seed=None, count=None):
+        """按 select 的结果拼接完整的试卷页面"""
+        parts = [PAGE_PREFIX, self.prefix, "<ol>\n"]
+        for index, options in self.select(seed, count):
+            question = self.questions[index]
+            parts.append(question["head"])
+            items = question["items"]
+            parts.extend(items[i] for i in options)
+            parts.append(question["tail"])
+        parts += ["</ol>", self.suffix, PAGE_SUFFIX]
+        return "".join(parts)
+
+
+class BankCache:
+    """
+    按内容哈希缓存已加载的题库
+
+    依次查找进程内缓存和题库文件；没有题库文件时从 Markdown 原文编译题库并保存，之后的请求不再编译。
+    """
+
+    def __init__(self, store, max_entries=256):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, content_hash, bank):
+        self.store.write(content_hash, '.json', bank.to_json())
+        # 上传时生成答案表，第一次提交不需要等待
+        bank.key
+        self._remember(content_hash, bank)
+
+    def get(self, content_hash):
+        """返回题库，试卷不存在或已过期时返回 None，不能编译为题库时抛出 BankError"""
+        if not self.store.exists(content_hash, '.html'):
+            return None
+        with self._lock:
+            bank = self._entries.get(content_hash)
+            if bank is not None:
+                self._entries.move_to_end(content_hash)
+                return bank
+        json_path = self.store.path(content_hash, '.json')
+        try:
+            with open(json_path, encoding='utf-8') as f:
+                bank = QuestionBank.from_json(f.read())
+            # 答案表在这里生成，题目字段缺失或类型不对的题库文件和 JSON 格式错误一样重新编译
+            bank.key
+        except FileNotFoundError:
+            bank = self._compile(content_hash)
+            self.store.write(content_hash, '.json', bank.to_json())
+        except (BankError, ValueError, KeyError, TypeError) as e:
+            # 旧版本、写了一半或被改坏的题库文件：删除后从原文重新编译，store.write 不会覆盖已存在的文件
+            if not isinstance(e, BankError):
+                logger.warning(f"题库文件 {json_path} 无法读取，重新编译: {e!r}")
+            try:
+                os.remove(json_path)
+            except OSError:
+                pass
+            bank = self._compile(content_hash)
+            self.store.write(content_hash, '.json', bank.to_json())
+        self._remember(content_hash, bank)
+        return bank
+
+    def _compile(self, content_hash):
+        """从 Markdown 原文重新编译题库；之前版本上传的试卷没有保存原文，页面中仍带有答案，从页面编译"""
+        if self.store.exists(content_hash, '.md'):
+            with open(self.store.path(content_hash, '.md'), encoding='utf-8', newline='') as f:
+                return QuestionBank.from_page(render_page(f.read()))
+        with open(self.store.path(content_hash, '.html'), encoding='utf-8') as f:
+            return QuestionBank.from_page(f.read())
+
+    def _remember(self, content_hash, bank):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[content_hash] = bank
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -23,11 +23,11 @@ class ChecklistExtension(Extension):
         }
         super().__init__(**kwargs)
 
-    def extendMarkdown(self, md, md_globals):
+    def extendMarkdown(self, md):
         list_class = self.getConfig("list_class")
         renderer = self.getConfig("render_item")
         postprocessor = ChecklistPostprocessor(list_class, renderer, md)
-        md.postprocessors.add("checklist", postprocessor, ">raw_html")
+        md.postprocessors.register(postprocessor, "checklist", 25)
 
 
 class ChecklistPostprocessor(Postprocessor):
@@ -22,11 +22,11 @@ class RadioExtension(Extension):
         }
         super().__init__(**kwargs)
 
-    def extendMarkdown(self, md, md_globals):
+    def extendMarkdown(self, md):
         list_class = self.getConfig("list_class")
         renderer = self.getConfig("render_item")
         postprocessor = RadioPostprocessor(list_class, renderer, md)
-        md.postprocessors.add("radio", postprocessor, ">raw_html")
+        md.postprocessors.register(postprocessor, "radio", 27.5)
 
 
 class RadioPostprocessor(Postprocessor):
@@ -22,11 +22,11 @@ class TextboxExtension(Extension):
         }
         super().__init__(**kwargs)
 
-    def extendMarkdown(self, md, md_globals):
+    def extendMarkdown(self, md):
         list_class = self.getConfig("list_class")
         renderer = self.getConfig("render_item")
         postprocessor = TextboxPostprocessor(list_class, renderer, md)
-        md.postprocessors.add("textbox", postprocessor, ">raw_html")
+        md.postprocessors.register(postprocessor, "textbox", 28.75)
 
 
 class TextboxPostprocessor(Postprocessor):
@@ -0,0 +1,108 @@
+"""
+服务端判分
+
+答案表由题库编译得到，每道题一条 __slots__ 记录：单选、多选题的正确选项压缩为位掩码，填空题保存规范化后的答案，
+判分时不需要解析 HTML，也不需要保留题干和选项文字。评分规则与页面中 app.js 的一致：
+单选题选中正确选项得 1 分；多选题得分为 选中的正确项比例 - 选中的错误项比例（保留两位小数，最低 0 分）；
+填空题去掉首尾空白后不区分大小写比较；没有选项的条目不计分。
+
+提交的答案按组卷后页面中的顺序排列（与 /quiz/<id> 使用相同的 seed 和 count），
+选项序号是页面中显示的顺序，判分时按 QuestionBank.select 的结果换算为原始序号。
+"""
+
+# 题型编号，与题库中的题型名称对应
+RADIO, CHECKBOX, TEXTBOX, TEXT = range(4)
+_KINDS = {"radio": RADIO, "checkbox": CHECKBOX, "textbox": TEXTBOX, "text": TEXT}
+
+
+class SubmissionError(ValueError):
+    """提交的答案格式不正确"""
+
+
+def _normalize(text):
+    return text.strip().lower()
+
+
+class KeyEntry:
+    """一道题的答案：题型、正确选项的位掩码、选项数和正确项数，填空题的规范化答案"""
+
+    __slots__ = ("kind", "mask", "options", "corrects", "text")
+
+    def __init__(self, kind, mask=0, options=0, corrects=0, text=None):
+        self.kind = kind
+        self.mask = mask
+        self.options = options
+        self.corrects = corrects
+        self.text = text
+
+    @classmethod
+    def from_question(cls, question):
+        kind = _KINDS[question["type"]]
+        if kind == TEXTBOX:
+            return cls(kind, text=_normalize(question["answer"]))
+        if kind == TEXT:
+            return cls(kind)
+        mask = 0
+        for index in question["answer"]:
+            mask |= 1 << index
+        return cls(kind, mask, len(question["items"]), len(question["answer"]))
+
+    def score(self, selected):
+        """按原始选项序号的位掩码（填空题为文字）判分，返回 0 到 1 之间的得分"""
+        if self.kind == RADIO:
+            return 1.0 if selected & self.mask and not selected & ~self.mask else 0.0
+        if self.kind == TEXTBOX:
+            return 1.0 if _normalize(selected) == self.text else 0.0
+        hits = bin(selected & self.mask).count("1")
+        misses = bin(selected & ~self.mask).count("1")
+        incorrects = self.options - self.corrects
+        score = (hits / self.corrects if self.corrects else 0) - (misses / incorrects if incorrects else 0)
+        return max(0.0, round(score, 2))
+
+
+class AnswerKey:
+    """一份试卷的答案表"""
+
+    __slots__ = ("entries",)
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    @classmethod
+    def from_bank(cls, bank):
+        return cls(tuple(KeyEntry.from_question(question) for question in bank.questions))
+
+    def grade(self, selection, answers):
+        """
+        判分，返回 (总分 0-100, 得分之和, 计分的题数, [(原始题号, 得分), ...])
+
+        selection 是 QuestionBank.select 的结果，answers 按页面顺序排列，与 selection 一一对应：
+        单选题为选项序号，多选题为选项序号列表，填空题为字符串，没有作答时为 None；没有选项的条目的答案被忽略。
+        """
+        if not isinstance(answers, list) or len(answers) != len(selection):
+            raise SubmissionError(f"answers 必须是包含 {len(selection)} 个元素的列表")
+        total = 0.0
+        graded = []
+        for position, ((index, options), answer) in enumerate(zip(selection, answers)):
+            entry = self.entries[index]
+            if entry.kind == TEXT:
+                continue
+            if answer is None:
+                score = 0.0
+            elif entry.kind == TEXTBOX:
+                if not isinstance(answer, str):
+                    raise SubmissionError(f"第 {position + 1} 题的答案必须是字符串")
+                score = entry.score(answer)
+            else:
+                chosen = [answer] if entry.kind == RADIO else answer
+                if not isinstance(chosen, list) or not all(
+                        isinstance(i, int) and not isinstance(i, bool) and 0 <= i < len(options) for i in chosen):
+                    raise SubmissionError(f"第 {position + 1} 题的答案必须是 0 到 {len(options) - 1} 之间的选项序号")
+                selected = 0
+                for i in chosen:
+                    selected |= 1 << options[i]
+                score = entry.score(selected)
+            total += score
+            graded.append((index, score))
+        percent = round(total / len(graded) * 100, 2) if graded else 0.0
+        return percent, round(total, 2), len(graded), graded
@@ -0,0 +1,93 @@
+"""
+试卷渲染
+
+Jinja 环境、编译后的模板和渲染好的 app.js 在导入时创建一次，所有请求共用；
+Markdown 实例不是线程安全的，每个线程各自持有一个，每次转换前调用 reset() 清理上一次的状态。
+渲染结果按内容哈希缓存在进程内。
+"""
+import threading
+from collections import OrderedDict
+
+import markdown
+from jinja2 import Environment, PackageLoader, select_autoescape
+
+# quiz 扩展一次扫描完成单选、多选和填空题的替换
+EXTENSIONS = ["tables", "app.extensions.quiz"]
+
+# 模板不会在运行期间修改，关闭 auto_reload 避免每次取模板时检查文件
+env = Environment(loader=PackageLoader('app', 'static'),
+                  autoescape=select_autoescape(['html', 'xml']),
+                  auto_reload=False)
+base_template = env.get_template('base.html')
+wrapper_template = env.get_template('wrapper.html')
+# app.js 不依赖试卷内容，只渲染一次
+javascript = env.get_template('app.js').render()
+
+_local = threading.local()
+
+
+def _markdown():
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=EXTENSIONS,
+                                           output_format="html5")
+    return md
+
+
+def markdown_to_html(content):
+    """把试卷 Markdown 转换为 HTML 片段"""
+    return _markdown().reset().convert(content)
+
+
+def render_fragment(fragment):
+    """把 HTML 片段放入试卷页面"""
+    test_html = base_template.render(content=fragment,
+                                     javascript=javascript)
+    return wrapper_template.render(content=test_html)
+
+
+def render_page(content):
+    """把试卷 Markdown 渲染为完整的 HTML 页面"""
+    return render_fragment(markdown_to_html(content))
+
+
+# 页面中试卷内容之前和之后的部分，题库组卷时直接拼接，不再渲染模板
+_CONTENT_MARKER = "<!--quiz-content-->"
+PAGE_PREFIX, PAGE_SUFFIX = render_fragment(_CONTENT_MARKER).split(_CONTENT_MARKER)
+
+
+def page_fragment(page):
+    """从 render_page 生成的页面中取出试卷内容的 HTML 片段，不是本模板生成的页面时返回 None"""
+    if len(page) < len(PAGE_PREFIX) + len(PAGE_SUFFIX) or \
+            not page.startswith(PAGE_PREFIX) or not page.endswith(PAGE_SUFFIX):
+        return None
+    return page[len(PAGE_PREFIX):len(page) - len(PAGE_SUFFIX)]
+
+
+class RenderCache:
+    """按内容哈希缓存渲染结果的 LRU，条目数或总字符数超出限制时淘汰最久未使用的"""
+
+    def __init__(self, max_entries=128, max_chars=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def render(self, content_hash, content):
+        """返回内容对应的 HTML 页面，没有缓存时渲染并放入缓存"""
+        with self._lock:
+            html = self._entries.get(content_hash)
+            if html is not None:
+                self._entries.move_to_end(content_hash)
+                return html
+        html = render_page(content)
+        if self.max_entries > 0 and len(html) <= self.max_chars:
+            with self._lock:
+                if content_hash not in self._entries:
+                    self._entries[content_hash] = html
+                    self._chars += len(html)
+                while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._chars -= len(evicted)
+        return html
@@ -0,0 +1,176 @@
+"""
+答题结果日志
+
+每条提交结果先放在内存中，由写入线程按批追加到 data/.results/ab/cd/<试卷 id>-<主机名>-<pid>.jsonl，
+积累到 batch_size 条时立即写入，否则每 flush_interval 秒写入一次；每个进程只追加自己的文件，多个 worker 之间不需要加锁。
+导出时先写入当前进程的缓冲，再读取这份试卷在所有进程中的文件后汇总，只需要列出试卷 id 前缀对应的一个目录。
+上传试卷的租户记录在 data/.results/ab/cd/<试卷 id>.owners 中，只有这些租户可以导出答题结果。
+
+结果文件和租户文件登记在数据目录的过期索引中，最后一次写入 ttl 之后由清理线程删除：
+试卷过期后不能再提交，它的结果随后也会被删除。
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 成绩分布的区间数，每个区间 10 分
+SCORE_BUCKETS = 10
+
+
+class ResultsLog:
+    def __init__(self, data_dir, flush_interval=2.0, batch_size=500, index=None):
+        self.directory = os.path.join(data_dir, ".results")
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.index = index
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def _partition(self, quiz_id):
+        """试卷 id 前缀对应的目录，与 ContentStore 相同按前两级分目录"""
+        return os.path.join(self.directory, quiz_id[:2], quiz_id[2:4])
+
+    def _path(self, quiz_id):
+        # 数据目录可能被多个容器共用，文件名中带上主机名避免 pid 冲突
+        return os.path.join(self._partition(quiz_id), f"{quiz_id}-{socket.gethostname()}-{os.getpid()}.jsonl")
+
+    def _track(self, path):
+        if self.index is not None:
+            self.index.track(path)
+
+    def _ensure_started(self):
+        """每个进程启动一个写入线程；fork 之后继承来的缓冲已由父进程写入，清空"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._buffer = []
+            self._pid = os.getpid()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def append(self, record):
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        by_quiz = {}
+        for record in records:
+            by_quiz.setdefault(record["quiz"], []).append(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        for quiz_id, lines in by_quiz.items():
+            path = self._path(quiz_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            self._track(path)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"写入答题结果时出错: {e}")
+
+    def _owners_path(self, quiz_id):
+        return os.path.join(self._partition(quiz_id), f"{quiz_id}.owners")
+
+    def owners(self, quiz_id):
+        """上传过这份试卷的租户"""
+        try:
+            with open(self._owners_path(quiz_id), encoding="utf-8") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def add_owner(self, quiz_id, tenant):
+        """记录上传试卷的租户，相同内容的试卷可能由多个租户分别上传；重复上传时刷新过期时间"""
+        path = self._owners_path(quiz_id)
+        if tenant not in self.owners(quiz_id):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 追加写入一行，多个 worker 同时写入时不会交错
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(tenant + "\n")
+        self._track(path)
+
+    def records(self, quiz_id):
+        """所有进程中某份试卷的提交结果，当前进程尚未写入的结果先写入"""
+        self.flush()
+        directory = self._partition(quiz_id)
+        try:
+            entries = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return
+        prefix = f"{quiz_id}-"
+        for entry in entries:
+            if not entry.startswith(prefix) or not entry.endswith(".jsonl"):
+                continue
+            try:
+                with open(os.path.join(directory, entry), encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            # 进程退出时可能留下写了一半的行
+                            continue
+            except FileNotFoundError:
+                # 已被清理线程删除
+                continue
+
+    def aggregate(self, quiz_id, questions):
+        """汇总提交次数、平均分、成绩分布和每道题的平均得分，questions 为题库中的题目数"""
+        count = 0
+        score_sum = 0.0
+        low = high = None
+        distribution = [0] * SCORE_BUCKETS
+        attempts = [0] * questions
+        totals = [0.0] * questions
+        full_marks = [0] * questions
+        for record in self.records(quiz_id):
+            score = record["score"]
+            count += 1
+            score_sum += score
+            low = score if low is None else min(low, score)
+            high = score if high is None else max(high, score)
+            distribution[min(int(score // (100 / SCORE_BUCKETS)), SCORE_BUCKETS - 1)] += 1
+            for index, question_score in record["questions"]:
+                if index < questions:
+                    attempts[index] += 1
+                    totals[index] += question_score
+                    full_marks[index] += question_score >= 1
+        return {
+            "submissions": count,
+            "mean_score": round(score_sum / count, 2) if count else None,
+            "min_score": low,
+            "max_score": high,
+            "score_distribution": [
+                {"from": i * 100 // SCORE_BUCKETS, "to": (i + 1) * 100 // SCORE_BUCKETS, "count": n}
+                for i, n in enumerate(distribution)],
+            "questions": [
+                {"question": i, "attempts": attempts[i],
+                 "mean_score": round(totals[i] / attempts[i], 4) if attempts[i] else None,
+                 "correct_rate": round(full_marks[i] / attempts[i], 4) if attempts[i] else None}
+                for i in range(questions)],
+        }
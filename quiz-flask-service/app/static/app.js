@@ -7,8 +7,72 @@ $(function(){
         }
     });
 
+    // 能编译为题库的试卷页面不带答案，提交到 /quiz/<id>/submit 由服务端判分
+    var quizPath = /^(.*?)\/(?:get_html|quiz)\/([0-9a-f]{64})(?:\.html)?$/.exec(window.location.pathname);
+
+    function intParam(params, name) {
+        var value = params.get(name);
+        return value === null || value === '' ? null : parseInt(value, 10);
+    }
+
+    function collectAnswers() {
+        // 与题库相同：顶层有序列表中的每个条目是一道题，没有选项的条目答案为 null
+        var answers = [];
+        $('ol').filter(function() {
+            return $(this).parents('li').length == 0;
+        }).children('li').each(function() {
+            var options = $(this).find('ul.radio-list,ul.checklist,ul.textbox').first();
+            var answer = null;
+            if (options.hasClass('radio-list')) {
+                var checked = options.find('input[type="radio"]').index(options.find('input[type="radio"]:checked'));
+                answer = checked < 0 ? null : checked;
+            } else if (options.hasClass('checklist')) {
+                answer = [];
+                options.find('input[type="checkbox"]').each(function(i) {
+                    if (this.checked) {
+                        answer.push(i);
+                    }
+                });
+            } else if (options.hasClass('textbox')) {
+                answer = String(options.find('input[type="text"]').val());
+            }
+            answers.push(answer);
+        });
+        return answers;
+    }
+
+    function submitQuestions() {
+        var params = new URLSearchParams(window.location.search);
+        $.ajax({
+            url: quizPath[1] + '/quiz/' + quizPath[2] + '/submit',
+            method: 'POST',
+            contentType: 'application/json',
+            dataType: 'json',
+            data: JSON.stringify({
+                seed: intParam(params, 'seed'),
+                count: intParam(params, 'count'),
+                answers: collectAnswers()
+            })
+        }).done(function(result) {
+            // 判分结果按页面顺序排列，只包含有选项的题目
+            $('li.question-row').each(function(i) {
+                var question = result.questions[i];
+                if (!question || question.score == 0) {
+                    $(this).addClass('text-danger');
+                } else if (question.score < 1) {
+                    $(this).addClass('text-warning');
+                }
+            });
+            showScore(result.points, result.total);
+        });
+    }
+
     function checkQuestion() {
         resetQuestions(true);
+        if (quizPath && $('input[data-content]').length == 0) {
+            submitQuestions();
+            return;
+        }
         var questions = $('li.question-row');
         var total_questions = questions.length;
         var correct = 0;
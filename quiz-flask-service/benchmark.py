@@ -0,0 +1,118 @@
+"""
+试卷渲染的微基准测试
+
+比较每次请求都重新创建 Markdown 实例和 Jinja 环境的旧流程与预编译流程的每秒渲染次数，
+以及 quiz 扩展与原来三个扩展在不同题目数量下的耗时。两种扩展输出逐字节一致由 tests/test_extensions.py 验证。
+
+用法: python benchmark.py [--seconds 3] [--questions 50] [--scale 10,100,1000,5000]
+"""
+import argparse
+import time
+
+import markdown
+from jinja2 import Environment, PackageLoader, select_autoescape
+
+from app import render
+
+QUESTIONS = [
+    "1. MaxSoft is a software company.\n    - (x) True\n    - ( ) False\n",
+    "2. What are the test automation frameworks developed by MaxSoft?\n"
+    "    - [x] IntelliAPI\n    - [x] WebBot\n    - [ ] Gauge\n    - [ ] Selenium\n",
+    "3. Who is the Co-Founder of MaxSoft?\n    - R:= Osanda\n",
+]
+
+
+# 优化前使用的三个扩展，每个扩展对整个 HTML 做两次正则替换
+LEGACY_EXTENSIONS = [
+    "tables", "app.extensions.checkbox", "app.extensions.radio",
+    "app.extensions.textbox"
+]
+
+
+def make_quiz(count):
+    body = "\n".join(QUESTIONS[i % len(QUESTIONS)] for i in range(count))
+    return f"# Benchmark Quiz\n\n---\n{body}"
+
+
+def legacy_render(content):
+    """优化前 /upload_markdown 中的渲染流程"""
+    html = markdown.markdown(content,
+                             extensions=LEGACY_EXTENSIONS,
+                             output_format="html5")
+    env = Environment(loader=PackageLoader('app', 'static'),
+                      autoescape=select_autoescape(['html', 'xml']))
+    javascript = env.get_template('app.js').render()
+    test_html = env.get_template('base.html').render(content=html,
+                                                     javascript=javascript)
+    return env.get_template('wrapper.html').render(content=test_html)
+
+
+def measure(name, fn, content, seconds):
+    fn(content)
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fn(content)
+        count += 1
+    rate = count / (time.perf_counter() - started)
+    print(f"{name:>12}: {rate:8.1f} 次/秒")
+    return rate
+
+
+def compare_extensions(sizes, seconds):
+    """比较 quiz 扩展与原来三个扩展在不同题目数量下的转换耗时"""
+    legacy_md = markdown.Markdown(extensions=LEGACY_EXTENSIONS, output_format="html5")
+    quiz_md = markdown.Markdown(extensions=render.EXTENSIONS, output_format="html5")
+
+    # 后处理阶段在 Markdown 转换之后，单独计时才能看出扫描次数的差别
+    plain_md = markdown.Markdown(extensions=["tables"], output_format="html5")
+    legacy_posts = [legacy_md.postprocessors[name] for name in ("textbox", "radio", "checklist")]
+    quiz_post = quiz_md.postprocessors["quiz"]
+
+    def run_legacy(text):
+        for post in legacy_posts:
+            text = post.run(text)
+        return text
+
+    for size in sizes:
+        content = make_quiz(size)
+        assert legacy_md.reset().convert(content) == quiz_md.reset().convert(content)
+        html = plain_md.reset().convert(content)
+        assert run_legacy(html) == quiz_post.run(html)
+        legacy = _time(run_legacy, html, seconds)
+        single = _time(quiz_post.run, html, seconds)
+        print(f"{size:>6} 题 ({len(html) / 1024:8.0f} KB): 三个扩展 {legacy * 1000:8.2f} ms, "
+              f"quiz 扩展 {single * 1000:8.2f} ms, 提升 {legacy / single:.1f} 倍")
+
+
+def _time(fn, arg, seconds):
+    count = 0
+    started = time.perf_counter()
+    while count < 3 or time.perf_counter() - started < seconds:
+        fn(arg)
+        count += 1
+    return (time.perf_counter() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="试卷渲染微基准测试")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--scale", default="10,100,1000,5000", help="扩展对比使用的题目数量，逗号分隔")
+    args = parser.parse_args()
+
+    content = make_quiz(args.questions)
+    assert legacy_render(content) == render.render_page(content), "预编译流程的输出与旧流程不一致"
+
+    print(f"试卷题目数: {args.questions}")
+    legacy = measure("旧流程", legacy_render, content, args.seconds)
+    compiled = measure("预编译", render.render_page, content, args.seconds)
+    cache = render.RenderCache()
+    cached = measure("按哈希缓存", lambda c: cache.render("benchmark", c), content, args.seconds)
+    print(f"预编译提升 {compiled / legacy:.1f} 倍，命中缓存提升 {cached / legacy:.0f} 倍")
+    print()
+    compare_extensions([int(size) for size in args.scale.split(",")], args.seconds / 3)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,111 @@
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Response, request, jsonify
 
+import json
 import os
-import markdown
+import re
+import sys
 import time
-from jinja2 import Environment, PackageLoader, select_autoescape
+
+# 共享模块位于仓库根目录的 common 包中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import ContentStore
+from common.expiry import ExpiryIndex, start_sweeper
+from common.objectstore import open_backend
+from common.upload import receive_request, UploadError
+from common.static import send_artifact, send_variant
+from common.metrics import CACHE_REQUESTS, RENDER_SECONDS, instrument, stage
+from common.ratelimit import TokenBuckets, header_tenant, limit
+from app.render import RenderCache
+from app.bank import BankCache, BankError, QuestionBank, strip_answers
+from app.grading import SubmissionError
+from app.results import ResultsLog
 
 app = Flask(__name__)
 
 # 配置文件夹路径
 UPLOAD_FOLDER = './markdown-quiz-files'
-OUTPUT_FOLDER = 'data'
+OUTPUT_FOLDER = os.environ.get("DATA_DIR", "data")
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
+FILE_EXPIRY_HOURS = int(os.environ.get("FILE_EXPIRY_HOURS", "24"))  # 文件过期时间(小时)
+CLEANUP_INTERVAL_HOURS = int(os.environ.get("CLEANUP_INTERVAL_HOURS", "1"))  # 清理间隔(小时)
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", "0"))  # 数据目录的容量上限(字节)，超出时删除最久未读取的文件，0表示不限
+STORAGE_BACKEND_URL = os.environ.get("STORAGE_BACKEND_URL", "")  # 多个副本共用的对象存储，s3://bucket/前缀 或 file:///目录，为空时只使用本地目录
+QUIZ_RENDER_CACHE_SIZE = int(os.environ.get("QUIZ_RENDER_CACHE_SIZE", "128"))  # 进程内缓存的渲染结果数，0表示不缓存
+QUIZ_BANK_CACHE_SIZE = int(os.environ.get("QUIZ_BANK_CACHE_SIZE", "256"))  # 进程内缓存的题库数，0表示不缓存
+QUIZ_RESULTS_FLUSH_INTERVAL = float(os.environ.get("QUIZ_RESULTS_FLUSH_INTERVAL", "2"))  # 答题结果写入日志的间隔(秒)
+QUIZ_RESULTS_BATCH_SIZE = int(os.environ.get("QUIZ_RESULTS_BATCH_SIZE", "500"))  # 缓冲的答题结果达到该条数时立即写入
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))  # 每个租户每分钟可以上传的试卷数，0表示不限流，所有worker共用计数
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MINUTE)))  # 短时间内最多连续上传的试卷数
+
+# 试卷 id 是 Markdown 内容的 SHA-256
+QUIZ_ID_RE = re.compile(r"^[0-9a-f]{64}$")
 
 # 确保文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 按内容哈希保存生成的试卷: data/ab/cd/<hash>.html
+expiry_index = ExpiryIndex(OUTPUT_FOLDER, ttl=FILE_EXPIRY_HOURS * 3600, max_bytes=STORAGE_MAX_BYTES)
+store = ContentStore(OUTPUT_FOLDER, index=expiry_index, tool="quiz", backend=open_backend(STORAGE_BACKEND_URL))
+# 请求耗时和渲染指标，通过 /metrics 提供
+instrument(app, "quiz", OUTPUT_FOLDER)
+# 只有拿到文件锁的一个进程执行清理
+start_sweeper(expiry_index, CLEANUP_INTERVAL_HOURS * 3600, bootstrap_files=store.iter_files)
+# 按内容哈希缓存渲染好的页面
+render_cache = RenderCache(max_entries=QUIZ_RENDER_CACHE_SIZE)
+# 按内容哈希缓存编译好的题库，/quiz/<id> 直接用题库组卷
+bank_cache = BankCache(store, max_entries=QUIZ_BANK_CACHE_SIZE)
+# 提交的答题结果按批追加到 data/.results 中，按试卷分文件、每个进程一个文件，与试卷一样由过期索引清理
+results_log = ResultsLog(OUTPUT_FOLDER, QUIZ_RESULTS_FLUSH_INTERVAL, QUIZ_RESULTS_BATCH_SIZE, index=expiry_index)
+# 按租户限流，租户由请求头中的API Key或租户标识确定
+rate_limits = TokenBuckets(OUTPUT_FOLDER, "quiz", RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
 
 @app.route('/upload_markdown', methods=['POST'])
+@limit(rate_limits, lambda e: (jsonify({"error": str(e)}), 429))
 def upload_markdown():
-    content = request.get_data(as_text=True)
-    print(content)
-    if content is None:
-        return jsonify({"error": "Invalid input"}), 400
     """Render quiz in Markdown format to HTML."""
-    extensions = [
-        "tables", "app.extensions.checkbox", "app.extensions.radio",
-        "app.extensions.textbox"
-    ]
-    html = markdown.markdown(content,
-                             extensions=extensions,
-                             output_format="html5")
-    env = Environment(loader=PackageLoader('app', 'static'),
-                      autoescape=select_autoescape(['html', 'xml']))
-    javascript = env.get_template('app.js').render()
-    test_html = env.get_template('base.html').render(content=html,
-                                                     javascript=javascript)
-    test_html = env.get_template('wrapper.html').render(content=test_html)
-    filename = str(int(time.time()))
-    with open(os.path.join(OUTPUT_FOLDER, f"{filename}.html"),
-              "w+",
-              encoding='utf-8') as f:  # create final file
-        f.write(test_html)
+    # 请求体流式写入临时文件并计算哈希，只有需要渲染时才读取内容
+    try:
+        with stage("quiz", "receive"):
+            upload = receive_request(request, OUTPUT_FOLDER, app.config['MAX_CONTENT_LENGTH'])
+        with upload:
+            filename = upload.digest
+            # 按请求头识别的租户（与限流相同），之后只有它可以导出这份试卷的答题结果
+            owner = header_tenant(request.headers, request.remote_addr)
+            if owner:
+                results_log.add_owner(filename, owner)
+            # 相同内容的试卷已经生成过时直接返回链接
+            if store.exists(filename, '.html'):
+                CACHE_REQUESTS.inc(tool="quiz", result="hit")
+                store.touch(filename, '.html')
+                # Markdown 原文与页面同时过期
+                upload.save(store, '.md')
+                return jsonify(
+                    {"message":
+                     f"保存成功\n查看链接http://127.0.0.1:5006/get_html/{filename}"}), 200
+            content = upload.read_text()
+            # 保存 Markdown 原文，题库文件丢失时从原文重新编译
+            upload.save(store, '.md')
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    CACHE_REQUESTS.inc(tool="quiz", result="miss")
+    with stage("quiz", "render"), RENDER_SECONDS.time(tool="quiz", format="html", renderer="python"):
+        test_html = render_cache.render(filename, content)
+    with stage("quiz", "bank"):
+        try:
+            bank = QuestionBank.from_page(test_html)
+        except BankError:
+            # 没有编号题目的试卷只能整页查看，仍由页面中的 app.js 判分
+            pass
+        else:
+            # 能编译为题库的试卷由服务端判分，保存的页面不带答案
+            bank_cache.save(filename, bank)
+            test_html = strip_answers(test_html)
+    with stage("quiz", "write"):
+        # 页面最后写入，其他请求看到页面时题库已经存在
+        store.write(filename, '.html', test_html)  # create final file
 
     return jsonify(
         {"message":
@@ -54,12 +117,112 @@ def get_html(filename):
     if not filename.endswith('.html'):
         filename += '.html'
 
-    file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if not os.path.exists(file_path):
+    file_path = store.resolve(filename, check=False)
+    response = send_artifact(file_path) if file_path else None
+    if response is None:
         return jsonify({"error": "File not found"}), 404
+    return response
+
+
+def _int_arg(name, minimum):
+    """查询参数中的整数，没有时返回 None，不是整数或小于 minimum 时抛出 ValueError"""
+    value = request.args.get(name)
+    if value is None or value == "":
+        return None
+    value = int(value)
+    if value < minimum:
+        raise ValueError(value)
+    return value
+
+
+def _load_bank(quiz_id):
+    """返回 (题库, 错误响应)，试卷 id 不正确、试卷不存在或不能编译为题库时题库为 None"""
+    if not QUIZ_ID_RE.match(quiz_id):
+        return None, (jsonify({"error": "Invalid quiz id"}), 400)
+    try:
+        bank = bank_cache.get(quiz_id)
+    except BankError as e:
+        return None, (jsonify({"error": str(e)}), 422)
+    if bank is None:
+        return None, (jsonify({"error": "Quiz not found"}), 404)
+    return bank, None
+
+
+@app.route('/quiz/<quiz_id>', methods=['GET'])
+def get_quiz(quiz_id):
+    """用题库组卷：seed 打乱题目和选项的顺序，count 抽取题目数量，都不指定时与 /get_html 的页面相同"""
+    try:
+        seed = _int_arg("seed", 0)
+        count = _int_arg("count", 1)
+    except ValueError:
+        return jsonify({"error": "seed must be a non-negative integer and count a positive integer"}), 400
+
+    bank, error = _load_bank(quiz_id)
+    if error:
+        return error
+    if count is not None:
+        count = min(count, len(bank.questions))
+    # 组卷结果只由试卷内容和参数决定，可以长期缓存
+    etag = f"{quiz_id}-{'' if seed is None else seed}-{'' if count is None else count}"
+    with stage("quiz", "assemble"):
+        return send_variant(bank.assemble(seed, count), etag)
+
+
+@app.route('/quiz/<quiz_id>/submit', methods=['POST'])
+def submit_quiz(quiz_id):
+    """
+    服务端判分并记录结果
+
+    请求体为 JSON：{"seed": 组卷的 seed, "count": 组卷的题目数, "answers": [...], "taker": 答题人标识}，
+    seed、count 与打开试卷时的 /quiz/<id> 参数相同，answers 按页面中的题目顺序排列。
+    """
+    bank, error = _load_bank(quiz_id)
+    if error:
+        return error
+    submission = request.get_json(silent=True)
+    if not isinstance(submission, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    seed, count, taker = submission.get("seed"), submission.get("count"), submission.get("taker")
+    if not (seed is None or isinstance(seed, int) and not isinstance(seed, bool) and seed >= 0) or \
+            not (count is None or isinstance(count, int) and not isinstance(count, bool) and count >= 1):
+        return jsonify({"error": "seed must be a non-negative integer and count a positive integer"}), 400
+    if taker is not None and not isinstance(taker, str):
+        return jsonify({"error": "taker must be a string"}), 400
+
+    with stage("quiz", "grade"):
+        selection = bank.select(seed, count)
+        try:
+            score, points, total, graded = bank.key.grade(selection, submission.get("answers"))
+        except SubmissionError as e:
+            return jsonify({"error": str(e)}), 400
+    results_log.append({"quiz": quiz_id, "time": round(time.time(), 3), "seed": seed, "count": count,
+                        "taker": taker, "score": score, "questions": graded})
+    return jsonify({"score": score, "points": points, "total": total,
+                    "questions": [{"question": index, "score": question_score} for index, question_score in graded]}), 200
+
+
+@app.route('/quiz/<quiz_id>/results', methods=['GET'])
+def quiz_results(quiz_id):
+    """
+    导出答题结果：默认返回汇总统计，format=jsonl 时返回每次提交的原始记录
 
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+    结果中包含答题人标识，只有上传过这份试卷的租户（按 API Key 或租户请求头识别）可以导出；
+    只按远端地址识别的请求可能来自同一个代理后的任何用户，不能导出。
+    """
+    bank, error = _load_bank(quiz_id)
+    if error:
+        return error
+    tenant = header_tenant(request.headers, request.remote_addr)
+    if tenant is None or tenant not in results_log.owners(quiz_id):
+        return jsonify({"error": "Forbidden"}), 403
+    if request.args.get("format") == "jsonl":
+        lines = (json.dumps(record, ensure_ascii=False) + "\n" for record in results_log.records(quiz_id))
+        return Response(lines, mimetype="application/x-ndjson")
+    with stage("quiz", "aggregate"):
+        summary = results_log.aggregate(quiz_id, len(bank.questions))
+    return jsonify({"quiz": quiz_id, **summary}), 200
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5006, host='0.0.0.0')
+    # 单独运行时使用 Flask 自带的服务器且不开启调试模式，生产环境通过网关(gateway)部署
+    app.run(port=5006, host='0.0.0.0')
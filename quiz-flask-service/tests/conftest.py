@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 测试直接导入服务目录下的 app 包
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
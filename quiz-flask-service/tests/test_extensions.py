@@ -0,0 +1,82 @@
+"""
+quiz 扩展与原来的 checkbox、radio、textbox 三个扩展的输出逐字节一致
+
+样例包括 markdown-quiz-files 中的试卷、覆盖各种写法（大小写、嵌套、松散列表、表格、HTML 实体）的片段和生成的大试卷；
+生成的试卷同时单独比较后处理阶段，排除 Markdown 转换本身的影响。
+"""
+import glob
+import os
+
+import markdown
+import pytest
+
+from app import render
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 优化前使用的三个扩展
+LEGACY_EXTENSIONS = [
+    "tables", "app.extensions.checkbox", "app.extensions.radio",
+    "app.extensions.textbox"
+]
+
+QUESTIONS = [
+    "1. MaxSoft is a software company.\n    - (x) True\n    - ( ) False\n",
+    "2. What are the test automation frameworks developed by MaxSoft?\n"
+    "    - [x] IntelliAPI\n    - [x] WebBot\n    - [ ] Gauge\n    - [ ] Selenium\n",
+    "3. Who is the Co-Founder of MaxSoft?\n    - R:= Osanda\n",
+]
+
+SAMPLES = [
+    "- [X] 大写\n- [ ] 空\n\n- (X) 大写\n- ( ) 空\n\n- r:= 小写\n- R:=  两端空格  \n",
+    "1. 嵌套\n    - [x] **加粗** `代码`\n        - ( ) 更深一层\n    - R:= <b>html</b> &amp; 实体\n",
+    "* [x] 星号列表\n\n    段落\n\n* [ ] 松散列表\n",
+    "| a | b |\n|---|---|\n| [x] | (x) |\n\n- not [x] 中间\n- (x)紧挨\n- R:=\n",
+]
+
+FIXTURE_FILES = sorted(glob.glob(os.path.join(SERVICE_DIR, "markdown-quiz-files", "*.md")))
+
+
+def make_quiz(count):
+    body = "\n".join(QUESTIONS[i % len(QUESTIONS)] for i in range(count))
+    return f"# Quiz\n\n---\n{body}"
+
+
+@pytest.fixture(scope="module")
+def converters():
+    legacy = markdown.Markdown(extensions=LEGACY_EXTENSIONS, output_format="html5")
+    quiz = markdown.Markdown(extensions=render.EXTENSIONS, output_format="html5")
+    return legacy, quiz
+
+
+def assert_same(converters, content):
+    legacy, quiz = converters
+    assert quiz.reset().convert(content) == legacy.reset().convert(content)
+
+
+def test_fixture_files_exist():
+    assert FIXTURE_FILES
+
+
+@pytest.mark.parametrize("path", FIXTURE_FILES, ids=os.path.basename)
+def test_fixture_file(converters, path):
+    with open(path, "r", encoding="utf-8") as f:
+        assert_same(converters, f.read())
+
+
+@pytest.mark.parametrize("content", SAMPLES)
+def test_sample(converters, content):
+    assert_same(converters, content)
+
+
+@pytest.mark.parametrize("count", [1, 30, 1000])
+def test_generated_quiz(converters, count):
+    content = make_quiz(count)
+    assert_same(converters, content)
+
+    legacy, quiz = converters
+    html = markdown.Markdown(extensions=["tables"], output_format="html5").convert(content)
+    text = html
+    for name in ("textbox", "radio", "checklist"):
+        text = legacy.postprocessors[name].run(text)
+    assert quiz.postprocessors["quiz"].run(html) == text